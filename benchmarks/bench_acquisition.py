@@ -0,0 +1,70 @@
+"""
+Benchmarks the acquisition -> sim -> log path with simulated ANT+ sensors.
+
+Rides simulated rides through AntSensors, the trainer engine and a
+streaming TCX log, with the simulated sensors sending pages from their own
+thread at 10x and 100x real time, and then stepped as fast as possible.
+Reports the step latency, and how much of the power survived dropouts.
+
+Run from the repository root:
+    python benchmarks/bench_acquisition.py
+"""
+import datetime as dt
+import os
+import tempfile
+import time
+import numpy as np
+from pmtrainer.ant_sensors import AntSensors
+from pmtrainer.simulated_ant import SimulatedAntDriver
+from pmtrainer.tcx_file import Tcx
+from pmtrainer.trainer_engine import TrainerEngine, Timer
+from pmtrainer.workout_profile import Workout
+
+WORKOUT_FILE = os.path.join(os.path.dirname(__file__), "..", "tests", "fixtures",
+                            "sample_workouts", "test_workout.yaml")
+TICK_S = 0.1
+DROPOUT = 0.1
+POWER_WATTS = 200
+
+def _bench(name, out_dir, duration_s, time_scale=None):
+    ant_driver = SimulatedAntDriver(power_watts=POWER_WATTS, dropout=DROPOUT,
+                                    time_scale=time_scale, seed=1)
+    sensors = AntSensors(ant_driver=ant_driver)
+    sensors.connect()
+    logfile = Tcx()
+    logfile.start_log(os.path.join(out_dir, "{}.tcx".format(name.replace(" ", "_"))),
+                      streaming=True)
+    logfile.start_activity(activity_type=Tcx.ActivityType.OTHER)
+    engine = TrainerEngine(sensors, Workout(WORKOUT_FILE), logfile,
+                           timer=Timer(replay=True, tick_ms=TICK_S * 1000))
+    engine.start(dt.datetime.utcfromtimestamp(ant_driver.clock()))
+
+    step_times = []
+    start = time.perf_counter()
+    next_tick = time.monotonic()
+    while engine.elapsed.total_seconds() < duration_s:
+        t0 = time.perf_counter()
+        engine.step()
+        step_times.append(time.perf_counter() - t0)
+        if time_scale:
+            next_tick += TICK_S / time_scale
+            time.sleep(max(next_tick - time.monotonic(), 0))
+    elapsed = time.perf_counter() - start
+    sensors.close()
+    logfile.close_log()
+
+    reconstructor = engine.power_reconstructor
+    step_ms = np.array(step_times) * 1000
+    print("{:10s}: {:6.1f}s for {:5.0f}s ({:6.1f}x) step p50 {:.3f}ms p99 {:.3f}ms "
+          "max {:.3f}ms, {} pages {} dropped, {} of {} events missed, avg {:.1f}W".format(
+              name, elapsed, duration_s, duration_s / elapsed, np.percentile(step_ms, 50),
+              np.percentile(step_ms, 99), np.max(step_ms), ant_driver.pages_sent,
+              ant_driver.pages_dropped, reconstructor.missed_events,
+              reconstructor.total_events,
+              reconstructor.total_accumulated_power / max(reconstructor.total_events, 1)))
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        _bench("10x", tmp_dir, 120, time_scale=10)
+        _bench("100x", tmp_dir, 3600, time_scale=100)
+        _bench("unpaced", tmp_dir, 3600)
@@ -0,0 +1,37 @@
+"""
+Benchmarks simulating many riders with a BikeSim each, against one BikeSimBatch.
+
+Run from the repository root:
+    python benchmarks/bench_bike_sim.py
+"""
+import time
+import numpy as np
+from pmtrainer.bike_sim import BikeSim, BikeSimBatch
+
+RIDER_COUNTS = [1, 8, 128, 1024]
+STEPS = 600 # Ten minutes at 1Hz, in 0.1s sim steps
+
+def _bench(num_riders):
+    rng = np.random.default_rng(1)
+    powers = rng.uniform(100, 400, (STEPS, num_riders))
+    times = np.arange(STEPS, dtype=float)
+
+    start = time.perf_counter()
+    sims = [BikeSim(weight_kg=80) for _ in range(num_riders)]
+    power_lists = powers.tolist()
+    for t, row in zip(times.tolist(), power_lists):
+        for sim, power in zip(sims, row):
+            sim.update(power, t)
+    scalar_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = BikeSimBatch(num_riders, weight_kg=80)
+    batch.run(powers, times)
+    batch_s = time.perf_counter() - start
+    assert np.array_equal(batch.total_distance_m, [sim.total_distance_m for sim in sims])
+    print("{:5d} riders x {} steps: scalar {:8.1f}ms batch {:7.1f}ms ({:5.1f}x)".format(
+        num_riders, STEPS, scalar_s * 1000, batch_s * 1000, scalar_s / batch_s))
+
+if __name__ == "__main__":
+    for count in RIDER_COUNTS:
+        _bench(count)
@@ -0,0 +1,51 @@
+"""
+Benchmarks looking up the grade on a century-length course, and riding it
+with the bike simulator, against riding a flat road.
+
+Run from the repository root:
+    python benchmarks/bench_course.py
+"""
+import time
+import numpy as np
+from pmtrainer.bike_sim import BikeSim
+from pmtrainer.course import Course
+
+COURSE_M = 160934 # 100 miles
+POINT_SPACING_M = 5.0
+LOOKUPS = 100000
+RIDE_S = 3600
+
+def _course():
+    rng = np.random.default_rng(1)
+    distance = np.arange(0, COURSE_M, POINT_SPACING_M)
+    altitude = 100 + np.cumsum(rng.normal(0, 0.2, len(distance)))
+    return Course(distance, altitude)
+
+def _ride(course):
+    sim = BikeSim(weight_kg=80, course=course)
+    start = time.perf_counter()
+    for t in range(RIDE_S + 1):
+        sim.update(250, t)
+    return time.perf_counter() - start
+
+def main():
+    start = time.perf_counter()
+    course = _course()
+    load_s = time.perf_counter() - start
+    print("Course: {} points, precomputed in {:.1f}ms".format(
+        len(course.distance_m), load_s * 1000))
+
+    queries = np.random.default_rng(2).uniform(0, COURSE_M, LOOKUPS).tolist()
+    start = time.perf_counter()
+    for d in queries:
+        course.grade_at(d)
+    lookup_s = time.perf_counter() - start
+    print("grade_at: {:.2f}us per lookup".format(lookup_s / LOOKUPS * 1e6))
+
+    flat_s = _ride(None)
+    course_s = _ride(course)
+    print("Riding {}s: flat {:.1f}ms, course {:.1f}ms".format(
+        RIDE_S, flat_s * 1000, course_s * 1000))
+
+if __name__ == "__main__":
+    main()
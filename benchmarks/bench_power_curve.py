@@ -0,0 +1,51 @@
+"""
+Benchmarks the mean-maximal power curve of a 4 hour ride: a naive scan of
+every window, the prefix-sum version, and the live curve updated every second.
+
+Run from the repository root:
+    python benchmarks/bench_power_curve.py
+"""
+import time
+import numpy as np
+from pmtrainer.power_curve import PowerCurve, mean_max_power, CURVE_DURATIONS_S
+
+RIDE_S = 4 * 3600
+NAIVE_SAMPLE_S = 600 # The naive scan is too slow to run on the whole ride
+
+def _naive_mmp(power, durations_s):
+    curve = {}
+    for duration_s in durations_s:
+        best = None
+        for i in range(len(power) - duration_s + 1):
+            avg = sum(power[i:i + duration_s]) / duration_s
+            best = avg if best is None or avg > best else best
+        curve[duration_s] = best
+    return curve
+
+def main():
+    power = np.clip(np.random.default_rng(1).normal(200, 80, RIDE_S), 0, None)
+
+    # Time the naive scan over the first NAIVE_SAMPLE_S windows of each duration, and scale it up:
+    sample = power.tolist()
+    start = time.perf_counter()
+    durations = [d for d in CURVE_DURATIONS_S if d < len(sample)]
+    for d in durations:
+        _naive_mmp(sample[:d + NAIVE_SAMPLE_S], [d])
+    naive_s = (time.perf_counter() - start) * (RIDE_S / NAIVE_SAMPLE_S)
+    print("Naive scan: ~{:.1f}s (estimated from {}s of windows)".format(
+        naive_s, NAIVE_SAMPLE_S))
+
+    start = time.perf_counter()
+    curve = mean_max_power(power)
+    print("Prefix sums: {:.2f}ms".format((time.perf_counter() - start) * 1000))
+
+    live = PowerCurve()
+    start = time.perf_counter()
+    for p in power.tolist():
+        live.add(p)
+    live_s = time.perf_counter() - start
+    print("Live curve: {:.2f}us per second of ride".format(live_s / RIDE_S * 1e6))
+    print(", ".join("{}s: {:.0f}W".format(d, w) for d, w in curve.items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Benchmarks answering a history question (the total TSS of each month) from
+the ride history database, against parsing every log again.
+
+Run from the repository root:
+    python benchmarks/bench_ride_history.py
+"""
+import os
+import tempfile
+import time
+import numpy as np
+from pmtrainer.ride_history import RideHistory, read_ride
+from pmtrainer.tcx_file import Tcx, Point
+from pmtrainer.trackpoints import format_time
+
+NUM_RIDES = 50
+RIDE_S = 3600
+START_S = 1609459200 # 2021-01-01
+
+def _write_logs(log_dir):
+    rng = np.random.default_rng(1)
+    for i in range(NUM_RIDES):
+        log = Tcx()
+        log.start_log(os.path.join(log_dir, "ride{:03d}.tcx".format(i)))
+        start_s = START_S + i * 86400
+        log.start_activity(activity_type=Tcx.ActivityType.OTHER, start_time=format_time(start_s))
+        for t, power in enumerate(np.clip(rng.normal(200, 60, RIDE_S), 0, None).astype(int)):
+            log.add_point(Point(time=format_time(start_s + t), power_watts=int(power),
+                                heartrate_bpm=140, distance_m=8.0 * t))
+        log.close_log()
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        log_dir = os.path.join(tmp, "logs")
+        os.makedirs(log_dir)
+        _write_logs(log_dir)
+        history = RideHistory(os.path.join(tmp, "history.db"))
+
+        start = time.perf_counter()
+        history.import_logs(log_dir)
+        print("Imported {} one hour rides in {:.2f}s".format(
+            NUM_RIDES, time.perf_counter() - start))
+        print("Database: {:.0f}kB, logs: {:.0f}kB".format(
+            os.path.getsize(history.db_file) / 1024,
+            sum(os.path.getsize(os.path.join(log_dir, f)) for f in os.listdir(log_dir)) / 1024))
+
+        start = time.perf_counter()
+        for fname in sorted(os.listdir(log_dir)):
+            read_ride(os.path.join(log_dir, fname))
+        parse_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        rows = history.db.execute(
+            "SELECT strftime('%Y-%m', start_time, 'unixepoch') AS month, SUM(tss) "
+            "FROM rides GROUP BY month").fetchall()
+        query_s = time.perf_counter() - start
+        print("Monthly TSS: re-parsing logs {:.2f}s, query {:.2f}ms ({} months)".format(
+            parse_s, query_s * 1000, len(rows)))
+        history.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Benchmarks how many concurrent riders one session server can sustain.
+
+Hosts increasing numbers of simulated riders, each with their own ANT+
+sensors, engine and log (with their bike sims updated together in one
+batch), and runs a few simulated minutes of ticks back to back. A box can
+sustain a number of riders while the tick latency stays well under the
+tick period.
+
+Run from the repository root:
+    python benchmarks/bench_session_server.py
+"""
+import datetime as dt
+import os
+import tempfile
+from pmtrainer.ant_sensors import AntSensors
+from pmtrainer.session_server import SessionServer, SERVER_TICK_S
+from pmtrainer.simulated_ant import SimulatedAntDriver
+from pmtrainer.workout_profile import Workout
+
+WORKOUT_FILE = os.path.join(os.path.dirname(__file__), "..", "tests", "fixtures",
+                            "sample_workouts", "test_workout.yaml")
+RIDER_COUNTS = [1, 8, 32, 128]
+DURATION_S = 120
+
+def _bench(num_riders, log_dir):
+    server = SessionServer(log_dir=log_dir)
+    workout = Workout(WORKOUT_FILE)
+    all_sensors = []
+    for i in range(num_riders):
+        ant_driver = SimulatedAntDriver(dropout=0.05, seed=i)
+        sensors = AntSensors(ant_driver=ant_driver)
+        sensors.connect()
+        all_sensors.append(sensors)
+        server.add_session("rider{}".format(i), sensors, workout, duration_s=DURATION_S,
+                           start_time=dt.datetime.utcfromtimestamp(ant_driver.start_epoch_s),
+                           replay=True)
+    server.run(realtime=False)
+    server.close()
+    for sensors in all_sensors:
+        sensors.close()
+    percentiles = server.latency_percentiles()
+    print("{:4d} riders: tick latency {} ({:.0f}% of the {:.0f}ms tick at p99)".format(
+        num_riders, ", ".join("p{:g} {:7.2f}ms".format(p, v * 1000)
+                              for p, v in percentiles.items()),
+        percentiles[99] / SERVER_TICK_S * 100, SERVER_TICK_S * 1000))
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for count in RIDER_COUNTS:
+            _bench(count, os.path.join(tmp_dir, str(count)))
@@ -0,0 +1,69 @@
+"""
+Benchmarks loading a batch of rides from .npz archives, against parsing
+their TCX logs, and converting the logs with one process and with a pool.
+
+Run from the repository root:
+    python benchmarks/bench_tcx_archive.py
+"""
+import glob
+import os
+import tempfile
+import time
+import numpy as np
+from pmtrainer.tcx_archive import convert_dir, load_archive, read_columns
+from pmtrainer.tcx_file import Tcx, Point
+from pmtrainer.trackpoints import format_time
+
+NUM_RIDES = 24
+RIDE_S = 3600
+START_S = 1609459200 # 2021-01-01
+
+def _write_logs(log_dir):
+    rng = np.random.default_rng(1)
+    for i in range(NUM_RIDES):
+        log = Tcx()
+        log.start_log(os.path.join(log_dir, "ride{:03d}.tcx".format(i)))
+        start_s = START_S + i * 86400
+        log.start_activity(activity_type=Tcx.ActivityType.OTHER, start_time=format_time(start_s))
+        for t, power in enumerate(np.clip(rng.normal(200, 60, RIDE_S), 0, None).astype(int)):
+            log.add_point(Point(time=format_time(start_s + t), power_watts=int(power),
+                                heartrate_bpm=140, distance_m=8.0 * t))
+        log.close_log()
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        log_dir = os.path.join(tmp, "logs")
+        os.makedirs(log_dir)
+        _write_logs(log_dir)
+        logs = sorted(glob.glob(os.path.join(log_dir, "*.tcx")))
+
+        start = time.perf_counter()
+        for fname in logs:
+            read_columns(fname)
+        parse_s = time.perf_counter() - start
+        print("Parsing {} logs: {:.0f}ms".format(len(logs), parse_s * 1000))
+
+        for workers in sorted({1, os.cpu_count()}):
+            out_dir = os.path.join(tmp, "npz{}".format(workers))
+            start = time.perf_counter()
+            convert_dir(log_dir, out_dir, workers=workers)
+            convert_s = time.perf_counter() - start
+            print("Converting with {} process(es): {:.0f}ms".format(workers, convert_s * 1000))
+
+        start = time.perf_counter()
+        convert_dir(log_dir, out_dir)
+        print("Converting again (all skipped): {:.1f}ms".format(
+            (time.perf_counter() - start) * 1000))
+
+        archives = sorted(glob.glob(os.path.join(out_dir, "*.npz")))
+        start = time.perf_counter()
+        for fname in archives:
+            load_archive(fname)
+        load_s = time.perf_counter() - start
+        print("Loading {} archives: {:.0f}ms ({:.0f}x faster than parsing)".format(
+            len(archives), load_s * 1000, parse_s / load_s))
+        print("Log size {:.0f}kB, archive size {:.0f}kB".format(
+            os.path.getsize(logs[0]) / 1000, os.path.getsize(archives[0]) / 1000))
+
+if __name__ == "__main__":
+    main()
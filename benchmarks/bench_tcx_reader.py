@@ -0,0 +1,71 @@
+"""
+Benchmarks reading TCX files with the in-memory and streaming readers.
+
+Reads each of the sample TCX fixtures, and a multi-hour ride built by
+repeating the points from the larger fixture, reporting the time and
+peak memory needed to read every point with each reader.
+
+Run from the repository root:
+    python benchmarks/bench_tcx_reader.py
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+from pmtrainer.tcx_file import Tcx
+
+FIXTURE_PATH = os.path.dirname(__file__) + "/../tests/fixtures/sample_tcx_files/"
+LONG_RIDE_REPEATS = 8
+
+def _read_all(fname, streaming):
+    '''
+    Reads every point in a file and returns the number of points read.
+    '''
+    tcx = Tcx()
+    tcx.open_log(fname, streaming=streaming)
+    count = 0
+    while tcx.get_next_point() is not None:
+        count += 1
+    return count
+
+def _make_long_ride(fname, repeats):
+    '''
+    Writes a ride made from the fixture's points repeated several times.
+    '''
+    src = Tcx()
+    src.open_log(FIXTURE_PATH + "20210325_160413.tcx", streaming=True)
+    points = []
+    p = src.get_next_point()
+    while p is not None:
+        points.append(p)
+        p = src.get_next_point()
+    out = Tcx()
+    out.start_log(fname, streaming=True)
+    out.start_activity(activity_type=Tcx.ActivityType.OTHER)
+    for _ in range(repeats):
+        for p in points:
+            out.add_point(p)
+    out.close_log()
+
+def _bench(fname):
+    print(os.path.basename(fname))
+    for streaming in [False, True]:
+        start = time.perf_counter()
+        count = _read_all(fname, streaming)
+        elapsed = time.perf_counter() - start
+        # Measure memory on a separate pass, since tracing slows everything down:
+        tracemalloc.start()
+        _read_all(fname, streaming)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("  {:9s}: {:6d} points {:7.1f}ms {:6.1f}us/point  peak {:7.1f}kB".format(
+            "streaming" if streaming else "in-memory", count, elapsed * 1000,
+            elapsed * 1e6 / max(count, 1), peak / 1024))
+
+if __name__ == "__main__":
+    for f in sorted(os.listdir(FIXTURE_PATH)):
+        _bench(FIXTURE_PATH + f)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        long_ride = tmp_dir + "/long_ride.tcx"
+        _make_long_ride(long_ride, LONG_RIDE_REPEATS)
+        _bench(long_ride)
@@ -0,0 +1,38 @@
+"""
+Benchmarks the training load over a decade of daily rides: computing it
+from the whole archive, adding one more ride incrementally, and the daily
+load for every day of the archive.
+
+Run from the repository root:
+    python benchmarks/bench_training_load.py
+"""
+import time
+import numpy as np
+from pmtrainer.training_load import TrainingLoad, daily_load
+
+YEARS = 10
+FIRST_DAY = 737000
+
+def main():
+    rng = np.random.default_rng(1)
+    days = np.arange(FIRST_DAY, FIRST_DAY + YEARS * 365)
+    tss = rng.uniform(20, 150, len(days))
+
+    start = time.perf_counter()
+    load = TrainingLoad.from_rides(days, tss)
+    archive_s = time.perf_counter() - start
+    print("{} rides: whole archive in {:.2f}ms".format(len(days), archive_s * 1000))
+
+    start = time.perf_counter()
+    load.add(days[-1] + 1, 100)
+    add_s = time.perf_counter() - start
+    print("Adding a ride: {:.1f}us (CTL {:.1f}, ATL {:.1f}, TSB {:.1f})".format(
+        add_s * 1e6, load.ctl, load.atl, load.tsb))
+
+    start = time.perf_counter()
+    daily_load(days, tss, days[0], days[-1])
+    daily_s = time.perf_counter() - start
+    print("Daily load for {} days: {:.1f}ms".format(len(days), daily_s * 1000))
+
+if __name__ == "__main__":
+    main()
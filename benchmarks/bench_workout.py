@@ -0,0 +1,64 @@
+"""
+Benchmarks the per-tick cost of workout profile lookups.
+
+Generates workouts with an increasing number of blocks, and times the
+calls the main loop makes on every tick at evenly spaced points through
+each workout. The cost per tick should not grow with the block count.
+Also times evaluating the same points with a single vectorized call.
+
+Run from the repository root:
+    python benchmarks/bench_workout.py
+"""
+import os
+import tempfile
+import time
+import numpy as np
+import yaml
+from pmtrainer.workout_profile import Workout
+
+BLOCK_COUNTS = [2, 10, 100, 1000]
+DURATION_S = 3600
+TICKS = 20000
+
+def _make_workout(fname, num_blocks):
+    '''
+    Writes a workout of equal length blocks, alternating between ramps and steady efforts.
+    '''
+    blocks = []
+    for i in range(num_blocks):
+        start = 0.5 + 0.5 * (i % 3) / 2
+        blocks.append({"duration": 1.0 / num_blocks, "start": start,
+                       "end": start + 0.2 if i % 2 else start})
+    with open(fname, "w") as f:
+        yaml.dump({"name": "{} Blocks".format(num_blocks), "description": "Benchmark workout",
+                   "duration_s": DURATION_S, "blocks": blocks}, f)
+
+def _bench(workout):
+    '''
+    Returns the average time per tick in seconds.
+    '''
+    start = time.perf_counter()
+    for i in range(TICKS):
+        t = DURATION_S * i / TICKS
+        workout.power_target(t)
+        workout.block_time_remaining(t)
+        workout.block_index(t)
+    return (time.perf_counter() - start) / TICKS
+
+def _bench_vectorized(workout):
+    '''
+    Returns the average time per point in seconds for power_targets().
+    '''
+    times = DURATION_S * np.arange(TICKS) / TICKS
+    start = time.perf_counter()
+    workout.power_targets(times)
+    return (time.perf_counter() - start) / TICKS
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for num_blocks in BLOCK_COUNTS:
+            fname = os.path.join(tmp_dir, "workout_{}.yaml".format(num_blocks))
+            _make_workout(fname, num_blocks)
+            workout = Workout(fname)
+            print("{:5d} blocks: {:6.2f}us/tick  vectorized {:6.3f}us/point".format(
+                num_blocks, _bench(workout) * 1e6, _bench_vectorized(workout) * 1e6))
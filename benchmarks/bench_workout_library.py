@@ -0,0 +1,49 @@
+"""
+Benchmarks scanning a large workout library.
+
+Generates a tree of workout files, and times a cold scan with an empty
+index parsing in this process and in a process pool, then a warm scan
+where nothing has changed.
+
+Run from the repository root:
+    python benchmarks/bench_workout_library.py
+"""
+import os
+import tempfile
+import time
+import yaml
+from pmtrainer.workout_library import WorkoutLibrary
+
+NUM_WORKOUTS = 2000
+BLOCKS_PER_WORKOUT = 20
+WORKOUTS_PER_DIR = 100
+
+def _make_library(directory):
+    '''
+    Writes the workout files into subdirectories of directory.
+    '''
+    for i in range(NUM_WORKOUTS):
+        subdir = os.path.join(directory, "set_{:02d}".format(i // WORKOUTS_PER_DIR))
+        os.makedirs(subdir, exist_ok=True)
+        blocks = [{"duration": 1.0 / BLOCKS_PER_WORKOUT, "start": 0.5 + (j % 5) / 10,
+                   "end": 0.5 + (j % 5) / 10} for j in range(BLOCKS_PER_WORKOUT)]
+        with open(os.path.join(subdir, "workout_{:04d}.yaml".format(i)), "w") as f:
+            yaml.dump({"name": "Workout {:04d}".format(i), "description": "Benchmark workout",
+                       "duration_s": 3600, "blocks": blocks}, f)
+
+def _bench(name, index_file, directory, max_workers=None):
+    start = time.perf_counter()
+    workouts, errors = WorkoutLibrary(index_file).scan(
+        directory, recursive=True, max_workers=max_workers)
+    elapsed = time.perf_counter() - start
+    print("{:18s}: {:5d} workouts {:3d} errors {:8.1f}ms".format(
+        name, len(workouts), len(errors), elapsed * 1000))
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        workout_dir = os.path.join(tmp_dir, "workouts")
+        _make_library(workout_dir)
+        _bench("cold, serial", os.path.join(tmp_dir, "serial.json"), workout_dir, max_workers=1)
+        index_file = os.path.join(tmp_dir, "parallel.json")
+        _bench("cold, parallel", index_file, workout_dir)
+        _bench("warm", index_file, workout_dir)
@@ -4,6 +4,11 @@ Handles interactions with ANT+ heartrate and power meter sensors.
 Connects to the sensors, and provides callbacks to the python-ant library
 for each type of device. Outputs heartrate, power, and cadence data.
 
+The ANT+ stack is reached through a driver object, a UsbAntDriver by
+default. Any object with the same methods can be used instead, such as
+the SimulatedAntDriver in pmtrainer.simulated_ant, which needs no hardware
+(or python-ant).
+
 Depends on python_ant from: https://github.com/bissont/python-ant
 Note that there are other forks available, but this one is the only
 one that seems to work.
@@ -29,61 +34,155 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
 import sys
+import time
 from datetime import datetime as dt
 from enum import Enum
 
-from ant.core import driver, exceptions
-from ant.core.node import Node, Network
-from ant.core.constants import NETWORK_KEY_ANT_PLUS, NETWORK_NUMBER_PUBLIC
-from ant.plus.plus import ChannelState
-from ant.plus.heartrate import HeartRate
-from ant.plus.power import BicyclePower
-
-class AntSensors():
+try:
+    from ant.core import driver, exceptions
+    from ant.core.node import Node, Network
+    from ant.core.constants import NETWORK_KEY_ANT_PLUS, NETWORK_NUMBER_PUBLIC
+    from ant.plus.plus import ChannelState, ChannelID
+    from ant.plus.heartrate import HeartRate
+    from ant.plus.power import BicyclePower
+except ImportError: # Only needed for the USB driver
+    driver = None
+from pmtrainer.sensors import SensorStatus, POWER_SAMPLE_FIELDS, HEARTRATE_SAMPLE_FIELDS
+from pmtrainer.ring_buffer import RingBuffer
+from pmtrainer.power_events import interval_power
+
+SAMPLE_BUFFER_SIZE = 256 # About a minute of 4Hz power events
+HEARTRATE_DEVICE_TYPE = 0x78
+POWER_DEVICE_TYPE = 0x0B
+
+class RiderSensors():
     """
-    ANT+ Heartrate and Power Meter sensor handler
+    Heartrate and power meter data for one rider, updated by the ANT+
+    callbacks of a heartrate and a power meter channel.
     """
-    class SensorStatus():
+    def __init__(self, clock=time.time, buffer_size=SAMPLE_BUFFER_SIZE):
+        self.clock = clock # Time sensor events are stamped with
+        # Every new sensor event is buffered here by the node's message thread,
+        # until the main loop drains them:
+        self.power_samples = RingBuffer(POWER_SAMPLE_FIELDS, capacity=buffer_size)
+        self.heartrate_samples = RingBuffer(HEARTRATE_SAMPLE_FIELDS, capacity=buffer_size)
+        self._power_meter_status = SensorStatus(fresh_time_s=2)
+        self._heart_rate_status = SensorStatus(fresh_time_s=2)
+        self.reset()
+
+    def reset(self):
         """
-        Tracks the status of a sensor device, whether it's connected
-        and if its data is fresh.
+        Reinitializes all data fields, and discards any buffered events.
         """
-        class State(Enum):
-            """
-            State of an ANT+ sensor
-            """
-            NOTCONNECTED = 1
-            CONNECTED = 2
-            STALE = 3
-
-        def __init__(self, fresh_time_s=15):
-            self._connected = False
-            self._last_seen_time = None
-            self._fresh_time_s = fresh_time_s
-
-        def make_fresh(self):
-            """ Marks the sensor as connected and makes last seen time now"""
-            self._connected = True
-            self._last_seen_time = dt.now()
-
-        def make_disconnected(self):
-            """ Marks the sensor as disconnceted"""
-            self._connected = False
-
-        @property
-        def state(self):
-            """ Returns the state of the sensor
-            Returns:
-                SensorStatus.State representing current state
-            """
-            if not self._connected:
-                _s = self.State.NOTCONNECTED
-            elif (self._last_seen_time and
-                  (dt.now() - self._last_seen_time).total_seconds() > self._fresh_time_s):
-                _s = self.State.STALE
-            else:
-                _s = self.State.CONNECTED
-            return _s
+        # Heartrate fields
+        self._heartrate_bpm = None
+        self._rr_interval_ms = None
+        self._hr_event_time_ms = None
+        # Power meter fields
+        self._instantaneous_power_watts = None
+        self._cadence_rpm = None
+        self._accumulated_power_watts = None
+        self._average_power_watts = None
+        self._power_event_count = None
+        self.power_samples.clear()
+        self.heartrate_samples.clear()
+
+    def update(self, elapsed_s):
+        """
+        Sensor data arrive through the ANT+ callbacks, so there's nothing to update.
+        """
+
+    def _on_heartrate_data(self, computed_heartrate, event_time_ms, rr_interval_ms):
+        self._heartrate_bpm = computed_heartrate
+        self._rr_interval_ms = rr_interval_ms
+        if (not self._hr_event_time_ms) or event_time_ms > self._hr_event_time_ms:
+            self._hr_event_time_ms = event_time_ms
+            self._heart_rate_status.make_fresh()
+            self.heartrate_samples.push(computed_heartrate, event_time_ms, rr_interval_ms,
+                                        time_s=self.clock())
+
+    def _on_power_data(self, event_count, _, cadence_rpm,
+                       accumulated_power_watts, instantaneous_power_watts):
+        self._instantaneous_power_watts = instantaneous_power_watts
+        self._cadence_rpm = cadence_rpm
+        # Pages are repeated until the next event, so only a change in the event
+        # count is a new event (including repeats of 0, after the count rolls over):
+        if self._power_event_count is None or event_count != self._power_event_count:
+            if self._power_event_count is not None and self._accumulated_power_watts is not None:
+                # Average over all events since the last one seen, including any missed:
+                events, power = interval_power(
+                    [self._power_event_count, event_count],
+                    [self._accumulated_power_watts, accumulated_power_watts])
+                if events[0] > 0:
+                    self._average_power_watts = float(power[0])
+            self._power_event_count = event_count
+            self._power_meter_status.make_fresh()
+            self.power_samples.push(event_count, cadence_rpm, accumulated_power_watts,
+                                    instantaneous_power_watts, time_s=self.clock())
+        self._accumulated_power_watts = accumulated_power_watts
+
+    def drain_power_samples(self):
+        """
+        Returns all power meter events received since the last call, as a
+        structured array with fields "time" and POWER_SAMPLE_FIELDS.
+        """
+        return self.power_samples.drain()
+
+    def drain_heartrate_samples(self):
+        """
+        Returns all heartrate events received since the last call, as a
+        structured array with fields "time" and HEARTRATE_SAMPLE_FIELDS.
+        """
+        return self.heartrate_samples.drain()
+
+    @property
+    def heartrate_bpm(self):
+        """
+        Returns heartrate in beats per minute (BPM) or None if heartrate data are not
+        available or fresh.
+        """
+        #TODO: check for stale data (if no update in xx sec, return None)
+        return self._heartrate_bpm
+
+    @property
+    def power_watts(self):
+        """
+        Returns power in Watts if available, or None if not available or fresh.
+        If power events were missed, this is the average power across them.
+        """
+        #TODO: check for stale data (if no update in xx sec, return None)
+        if self._average_power_watts is not None:
+            return self._average_power_watts
+        return self._instantaneous_power_watts
+
+    @property
+    def cadence_rpm(self):
+        """
+        Returns cadence in RPM if available or None if not available or fresh.
+        """
+        #TODO: check for stale data (if no update in xx sec, return None)
+        return self._cadence_rpm
+
+    @property
+    def heart_rate_status(self):
+        """
+        Returns status of heart rate sensor.
+        """
+        return self._heart_rate_status.state
+
+    @property
+    def power_meter_status(self):
+        """
+        Returns status of power meter sensor.
+        """
+        return self._power_meter_status.state
+
+
+class AntSensors(RiderSensors):
+    """
+    ANT+ Heartrate and Power Meter sensor handler
+    """
+    SensorStatus = SensorStatus # Kept here so existing users of AntSensors.SensorStatus work
 
     class SensorError(Exception):
         """
@@ -103,67 +202,38 @@ class AntSensors():
             self.message = message
             self.err_type = err_type
 
-    def __init__(self, search_timeout_sec=120):
+    def __init__(self, search_timeout_sec=120, buffer_size=SAMPLE_BUFFER_SIZE, ant_driver=None):
         """
-        Create Ant+ node, network, and initialize all attributes
+        Create Ant+ node, network, and initialize all attributes. The node is
+        reached through ant_driver if given, or a USB dongle.
         """
         self.search_timeout_sec = search_timeout_sec
-        self.device = driver.USB2Driver()
-        self.antnode = Node(self.device)
-        self.network = Network(key=NETWORK_KEY_ANT_PLUS, name='N:ANT+')
+        self.driver = ant_driver if ant_driver else UsbAntDriver()
+        super().__init__(clock=self.driver.clock, buffer_size=buffer_size)
 
         # Start search for sensors and register callbacks:
-        self.device_power_meter = BicyclePower(self.antnode, self.network,
+        self.device_power_meter = self.driver.power_meter(
             callbacks = {'onDevicePaired': self._on_device_found,
                          'onPowerData': self._on_power_data,
                          'onChannelClosed': self._on_channel_closed,
                          'onSearchTimeout': self._on_search_timeout})
-        self._power_meter_status = AntSensors.SensorStatus(fresh_time_s=2)
-        self.device_heart_rate = HeartRate(self.antnode, self.network,
+        self.device_heart_rate = self.driver.heart_rate(
             callbacks = {'onDevicePaired': self._on_device_found,
                          'onHeartRateData': self._on_heartrate_data,
                          'onChannelClosed': self._on_channel_closed,
                          'onSearchTimeout': self._on_search_timeout})
-        self._heart_rate_status = AntSensors.SensorStatus(fresh_time_s=2)
         self._reconnect = True
-        # Heartrate fields
-        self._heartrate_bpm = None
-        self._rr_interval_ms = None
-        self._hr_event_time_ms = None
-        # Power meter fields
-        self._instantaneous_power_watts = None
-        self._cadence_rpm = None
-        self._accumulated_power_watts = None
-        self._power_event_count = None
 
     def connect(self):
         """
         Attaches to the ANT+ dongle and begins search for heartrate
         and power meter sensors.
         """
-        try:
-            self.antnode.start()
-            self.antnode.setNetworkKey(NETWORK_NUMBER_PUBLIC, self.network)
-        except exceptions.DriverError as e:
-            raise AntSensors.SensorError(
-                message = e.args[0],
-                err_type=AntSensors.SensorError.ErrorType.USB)
-        except exceptions.NodeError as e:
-            raise AntSensors.SensorError(
-                message = e.args[0],
-                err_type = AntSensors.SensorError.ErrorType.NODE)
-
-        # Reinitialize all data fields
-        self._heartrate_bpm = None
-        self._rr_interval_ms = None
-        self._hr_event_time_ms = None
-        self._instantaneous_power_watts = None
-        self._cadence_rpm = None
-        self._accumulated_power_watts = None
-        self._power_event_count = None
+        self.driver.start()
+        self.reset()
         # Open device and start searching
-        self.device_heart_rate.open(searchTimeout=self.search_timeout_sec)
-        self.device_power_meter.open(searchTimeout=self.search_timeout_sec)
+        self.driver.open_device(self.device_heart_rate, self.search_timeout_sec)
+        self.driver.open_device(self.device_power_meter, self.search_timeout_sec)
 
     def close(self):
         """
@@ -171,16 +241,16 @@ class AntSensors():
         prior to exit.
         """
         self._reconnect = False
-        if (self.device_heart_rate.state and
-            self.device_heart_rate.state != ChannelState.CLOSED):
-            self.device_heart_rate.close()
-        if (self.device_power_meter.state and
-            self.device_power_meter.state != ChannelState.CLOSED):
-            self.device_power_meter.close()
-        try:
-            self.antnode.stop()
-        except (exceptions.NodeError, exceptions.DriverError):
-            pass
+        self.driver.close_device(self.device_heart_rate)
+        self.driver.close_device(self.device_power_meter)
+        self.driver.stop()
+
+    def update(self, elapsed_s):
+        """
+        Sensor data arrive through the ANT+ callbacks, so this only lets drivers
+        that aren't driven by the clock catch up to the elapsed time.
+        """
+        self.driver.update(elapsed_s)
 
     def _on_device_found(self, device, ch_id):
         #TODO: make the device number available
@@ -207,66 +277,95 @@ class AntSensors():
             message = "Timed out searching for device: {}".format(device.name),
             err_type=AntSensors.SensorError.ErrorType.TIMEOUT)
 
-    def _on_heartrate_data(self, computed_heartrate, event_time_ms, rr_interval_ms):
-        self._heartrate_bpm = computed_heartrate
-        self._rr_interval_ms = rr_interval_ms
-        if (not self._hr_event_time_ms) or event_time_ms > self._hr_event_time_ms:
-            self._hr_event_time_ms = event_time_ms
-            self._heart_rate_status.make_fresh()
 
-    def _on_power_data(self, event_count, _, cadence_rpm,
-                       accumulated_power_watts, instantaneous_power_watts):
-        self._instantaneous_power_watts = instantaneous_power_watts
-        self._cadence_rpm = cadence_rpm
-        self._accumulated_power_watts = accumulated_power_watts
-        if (not self._power_event_count) or event_count != self._power_event_count:
-            self._power_event_count = event_count
-            self._power_meter_status.make_fresh()
+class UsbAntDriver():
+    """
+    Reaches ANT+ sensors through a USB dongle, using python-ant.
+    """
+    def __init__(self):
+        if driver is None:
+            raise AntSensors.SensorError(
+                message="python-ant is not installed",
+                err_type=AntSensors.SensorError.ErrorType.USB)
+        self.device = driver.USB2Driver()
+        self.antnode = Node(self.device)
+        self.network = Network(key=NETWORK_KEY_ANT_PLUS, name='N:ANT+')
 
-    @property
-    def heartrate_bpm(self):
+    def start(self):
         """
-        Returns heartrate in beats per minute (BPM) or None if heartrate data are not
-        available or fresh.
+        Attaches to the dongle and sets up the ANT+ network.
         """
-        #TODO: check for stale data (if no update in xx sec, return None)
-        return self._heartrate_bpm
+        try:
+            self.antnode.start()
+            self.antnode.setNetworkKey(NETWORK_NUMBER_PUBLIC, self.network)
+        except exceptions.DriverError as e:
+            raise AntSensors.SensorError(
+                message = e.args[0],
+                err_type=AntSensors.SensorError.ErrorType.USB)
+        except exceptions.NodeError as e:
+            raise AntSensors.SensorError(
+                message = e.args[0],
+                err_type = AntSensors.SensorError.ErrorType.NODE)
 
-    @property
-    def power_watts(self):
+    def stop(self):
         """
-        Returns power in Watts if available, or None if not available or fresh.
+        Releases the dongle.
         """
-        #TODO: return calculated power from accumulated power if there are event_count gaps
-        #TODO: check for stale data (if no update in xx sec, return None)
-        return self._instantaneous_power_watts
+        try:
+            self.antnode.stop()
+        except (exceptions.NodeError, exceptions.DriverError):
+            pass
 
-    @property
-    def cadence_rpm(self):
+    def heart_rate(self, callbacks):
         """
-        Returns cadence in RPM if available or None if not available or fresh.
+        Returns a heart rate monitor channel, calling back to callbacks.
         """
-        #TODO: check for stale data (if no update in xx sec, return None)
-        return self._cadence_rpm
+        channel = HeartRate(self.antnode, self.network, callbacks=callbacks)
+        channel.device_type = HEARTRATE_DEVICE_TYPE
+        return channel
 
-    @property
-    def heart_rate_status(self):
+    def power_meter(self, callbacks):
         """
-        Returns status of heart rate sensor.
+        Returns a bicycle power meter channel, calling back to callbacks.
         """
-        return self._heart_rate_status.state
+        channel = BicyclePower(self.antnode, self.network, callbacks=callbacks)
+        channel.device_type = POWER_DEVICE_TYPE
+        return channel
 
-    @property
-    def power_meter_status(self):
+    @staticmethod
+    def open_device(device, search_timeout_s, device_number=0):
         """
-        Returns status of power meter sensor.
+        Opens a device channel, searching for the given device number,
+        or any device of its type if it's 0.
         """
-        return self._power_meter_status.state
+        if device_number:
+            device.open(channelId=ChannelID(device_number, device.device_type, 0),
+                        searchTimeout=search_timeout_s)
+        else:
+            device.open(searchTimeout=search_timeout_s)
 
+    @staticmethod
+    def close_device(device):
+        """
+        Closes a device channel, if it's open.
+        """
+        if device.state and device.state != ChannelState.CLOSED:
+            device.close()
 
-if __name__ == "__main__":
-    import time
+    def update(self, elapsed_s):
+        """
+        The dongle sends data as they arrive, so there's nothing to update.
+        """
 
+    @staticmethod
+    def clock():
+        """
+        Returns the time sensor events are stamped with, in UTC epoch seconds.
+        """
+        return time.time()
+
+
+if __name__ == "__main__":
     print("Attaching to ANT+ sensors...")
     sensors = AntSensors()
     try:
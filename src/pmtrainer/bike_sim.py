@@ -1,5 +1,6 @@
 """
-Very basic bike simulator.
+Very basic bike simulator, for a single rider, or vectorized over a batch
+of riders (or of archived rides being re-simulated).
 
 Copyright (C) 2021  Robert Ussery
 
@@ -16,21 +17,49 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
+import math
+import numpy as np
+
+G_MPS2 = 9.80655 # Gravitational acceleration constant, assume we're on a flat surface
+CRR = 0.005 # Coefficient of rolling resistance, varies with tire type and surface
+CDA_M2 = 0.324 # Coefficient of aerodynamic drag times frontal area
+RHO_KGPM3 = 1.225 # Air density, assumes sea level
+AERO_DRAG_COEFF = 0.5 * CDA_M2 * RHO_KGPM3 # Drag force per (m/s)^2
+LOSS = 0.035 # powertrain losses
+# Avoid divide-by-zero, and make pedal force realistic
+# (hard to develop high wattage at low speed):
+MIN_PEDAL_SPEED_MPS = 0.5
+MAX_POWER_WATTS = 10000
+# The sim integrates in fixed steps, however far apart its updates are, so
+# results don't depend on the update rate. Time beyond the substep limit in
+# one update (e.g. after a long stall) is covered at the current speed:
+SIM_STEP_S = 0.1
+MAX_SUBSTEPS = 600
+STEP_TOLERANCE = 1e-6 # Fraction of a step, so rounding doesn't delay a step to the next update
+MIPH_PER_MPS = 2.23694
+M_PER_MI = 1609
 
 class BikeSim():
     '''
     Very basic bike simulator, calculates speed and distance
     based on power input and a few rider parameters.
     '''
-    def __init__(self, weight_kg=75):
+    def __init__(self, weight_kg=75, step_s=SIM_STEP_S, max_substeps=MAX_SUBSTEPS, course=None):
         self._weight_kg = weight_kg
+        self.step_s = step_s
+        self.max_substeps = max_substeps
+        self.course = course # Flat if None, or a Course giving the grade by distance
         self._last_update_time_s = None
+        self._start_time_s = None
+        self._steps = 0 # Steps simulated since the start time
         self._total_distance_m = 0.0
         self._speed_mps = 0.0
 
     def update(self, power_watts, time_s):
         '''
-        Calculate speed and distance based on power
+        Calculate speed and distance based on power, up to time_s (float seconds).
+        The time since the last update is simulated in fixed steps of step_s,
+        at up to max_substeps steps per update.
 
         Simulator based on https://www.omnicalculator.com/sports/cycling-wattage
         P = (Fg + Fr + Fa) * v / (1 - loss) -> v = P * (1-loss) / (Fg + Fr + Fa)
@@ -41,49 +70,64 @@ class BikeSim():
         loss = drivetrain losses
         '''
 
-        if power_watts > 10000:
-            raise ValueError("Out of range power {} > 10000".format(power_watts))
+        if power_watts > MAX_POWER_WATTS:
+            raise ValueError("Out of range power {} > {}".format(power_watts, MAX_POWER_WATTS))
+
+        # Calculate the number of steps since the last update. If time goes back
+        # (e.g. the timer was restarted), carry on from the new time:
+        if self._last_update_time_s is None or time_s < self._last_update_time_s:
+            self._start_time_s = time_s
+            self._steps = 0
+        self._last_update_time_s = time_s
+        steps = int((time_s - self._start_time_s) / self.step_s + STEP_TOLERANCE) - self._steps
+        if steps <= 0:
+            return
+        self._steps += steps
 
+        for _ in range(min(steps, self.max_substeps)):
+            self._step(power_watts)
+        if steps > self.max_substeps:
+            self._total_distance_m += self._speed_mps * ((steps - self.max_substeps) * self.step_s)
+
+    def _step(self, power_watts):
+        '''
+        Simulate one step of step_s, with explicit Euler integration.
+        '''
         # Calculate longitudinal component of gravity
-        Fg_N = 0 # assumes we're on a flat course
+        # (grade is rise over run, so the sine of the slope is grade/sqrt(1+grade^2))
+        grade = self.grade
+        Fg_N = G_MPS2 * self._weight_kg * grade / math.sqrt(1 + grade * grade)
 
         # Calculate rolling resistance
-        G_mps2 = 9.80655 # Gravitational acceleration constant, assume we're on a flat surface
-        CRR = 0.005 # Coefficient of rolling resistance, varies with tire type and surface
         if self._speed_mps > 0.0:
-            Fr_N = G_mps2 * self._weight_kg * CRR
+            Fr_N = G_MPS2 * self._weight_kg * CRR
         else:
             Fr_N = 0.0
 
         # Calculate aerodynamic drag
-        CDA_m2 = 0.324 # Coefficient of aerodynamic drag times frontal area
-        RHO_kgpm3 = 1.225 # Air density, assumes sea level
-        Fa_N = 0.5 * CDA_m2 * RHO_kgpm3 * pow(self._speed_mps, 2) # Use previous speed
+        Fa_N = AERO_DRAG_COEFF * (self._speed_mps * self._speed_mps) # Use previous speed
 
         # Calculate rider pedalling force
-        LOSS = 0.035 # powertrain losses
-        if self._speed_mps < 0.5:
-            # Avoid divide-by-zero, and make pedal force realistic
-            # (hard to develop high wattage at low speed)
-            pow_spd_mps = 0.5
-        else:
-            pow_spd_mps = self._speed_mps
+        pow_spd_mps = max(self._speed_mps, MIN_PEDAL_SPEED_MPS)
         Fp_N = power_watts * (1-LOSS) / pow_spd_mps
 
-        # Calculate time delta
-        if self._last_update_time_s is None:
-            self._last_update_time_s = time_s
-        DeltaT_s = time_s - self._last_update_time_s
-
         # Calculate new speed
         A_mps2 = (Fp_N - (Fg_N + Fr_N + Fa_N)) / self._weight_kg
-        self._speed_mps = self._speed_mps + A_mps2 * DeltaT_s
+        self._speed_mps = self._speed_mps + A_mps2 * self.step_s
         if self._speed_mps < 0.0:
             self._speed_mps = 0.0  # Don't allow negative speed
 
-        # Update time and calculate distance travelled from avg. speed
-        self._total_distance_m += self._speed_mps * DeltaT_s
-        self._last_update_time_s = time_s
+        # Calculate distance travelled from the new speed
+        self._total_distance_m += self._speed_mps * self.step_s
+
+    @property
+    def grade(self):
+        '''
+        Grade (rise over run) of the course at the current distance.
+        '''
+        if self.course is None:
+            return 0.0
+        return self.course.grade_at(self._total_distance_m)
 
     @property
     def speed_mps(self):
@@ -97,7 +141,7 @@ class BikeSim():
         '''
         Speed in miles per hour.
         '''
-        return self._speed_mps * 2.23694
+        return self._speed_mps * MIPH_PER_MPS
 
     @property
     def total_distance_m(self):
@@ -111,7 +155,7 @@ class BikeSim():
         '''
         Total distance travelled in miles.
         '''
-        return self._total_distance_m / 1609
+        return self._total_distance_m / M_PER_MI
 
     @property
     def weight_kg(self):
@@ -126,3 +170,319 @@ class BikeSim():
         Sets the combined bike+rider weight.
         '''
         self._weight_kg = weight_kg
+
+
+class BikeSimRider():
+    '''
+    One rider of a BikeSimBatch, with the same interface as a BikeSim, so it
+    can stand in for one in a trainer engine. Riders in a batch share its
+    course. Once released, the rider keeps its final speed and distance, and
+    its place in the batch can be taken by a new rider.
+    '''
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+        self._released = None # (speed, distance, weight) once released
+
+    def update(self, power_watts, time_s):
+        '''
+        Calculates this rider's speed and distance, leaving the rest of the batch
+        alone. To update many riders at once, update the batch instead.
+        '''
+        if self._released:
+            raise ValueError("Can't update a rider released from its batch")
+        self.batch.update(power_watts, time_s, riders=[self.index])
+
+    def release(self):
+        '''
+        Frees the rider's place in the batch, keeping its final state.
+        '''
+        if not self._released:
+            self._released = (self.speed_mps, self.total_distance_m, self.weight_kg)
+            self.batch.release_rider(self.index)
+
+    @property
+    def course(self):
+        '''
+        The course shared by every rider in the batch, or None if it's flat.
+        '''
+        return self.batch.course
+
+    @property
+    def grade(self):
+        '''
+        Grade (rise over run) of the course at the current distance.
+        '''
+        if self.course is None:
+            return 0.0
+        return self.course.grade_at(self.total_distance_m)
+
+    @property
+    def speed_mps(self):
+        '''
+        Speed in meters per second.
+        '''
+        if self._released:
+            return self._released[0]
+        return float(self.batch.speed_mps[self.index])
+
+    @property
+    def speed_miph(self):
+        '''
+        Speed in miles per hour.
+        '''
+        return self.speed_mps * MIPH_PER_MPS
+
+    @property
+    def total_distance_m(self):
+        '''
+        Total distance travelled in meters.
+        '''
+        if self._released:
+            return self._released[1]
+        return float(self.batch.total_distance_m[self.index])
+
+    @property
+    def total_distance_mi(self):
+        '''
+        Total distance travelled in miles.
+        '''
+        return self.total_distance_m / M_PER_MI
+
+    @property
+    def weight_kg(self):
+        '''
+        Returns the bike+rider weight used for the sim.
+        '''
+        if self._released:
+            return self._released[2]
+        return float(self.batch.weight_kg[self.index])
+
+    @weight_kg.setter
+    def weight_kg(self, weight_kg):
+        '''
+        Sets the combined bike+rider weight.
+        '''
+        if self._released:
+            self._released = self._released[:2] + (weight_kg,)
+            return
+        weights = self.batch.weight_kg.copy()
+        weights[self.index] = weight_kg
+        self.batch.weight_kg = weights
+
+
+class BikeSimBatch():
+    '''
+    The BikeSim model for a batch of n independent riders, held as NumPy
+    arrays and updated together in one vectorized step. Each rider's
+    numbers are the same as a BikeSim given the same inputs. Riders can be
+    added to the batch, and each rider can be used on its own as a BikeSim
+    through rider().
+    '''
+    def __init__(self, n=0, weight_kg=75, step_s=SIM_STEP_S, max_substeps=MAX_SUBSTEPS,
+                 course=None):
+        self.step_s = step_s
+        self.max_substeps = max_substeps
+        self.course = course # Course shared by every rider, or flat if None
+        self._speed_mps = np.zeros(n)
+        self._total_distance_m = np.zeros(n)
+        self._last_update_time_s = np.full(n, np.nan) # NaN until a rider is first updated
+        self._start_time_s = np.full(n, np.nan)
+        self._steps = np.zeros(n, dtype=int) # Steps simulated since the start time
+        self._free = [] # Indexes of released riders, to reuse
+        self.weight_kg = weight_kg
+
+    def __len__(self):
+        return len(self._speed_mps)
+
+    def rider(self, index):
+        '''
+        Returns a BikeSimRider for one of the batch's riders.
+        '''
+        return BikeSimRider(self, index)
+
+    def add_rider(self, weight_kg=75):
+        '''
+        Adds a rider, in the place of a released rider if there is one, and
+        returns its BikeSimRider.
+        '''
+        if self._free:
+            index = self._free.pop()
+        else:
+            index = len(self)
+            self._speed_mps = np.append(self._speed_mps, 0.0)
+            self._total_distance_m = np.append(self._total_distance_m, 0.0)
+            self._last_update_time_s = np.append(self._last_update_time_s, np.nan)
+            self._start_time_s = np.append(self._start_time_s, np.nan)
+            self._steps = np.append(self._steps, 0)
+            self._weight_kg = np.append(self._weight_kg, 0.0)
+            self._rolling_N = np.append(self._rolling_N, 0.0)
+        self._speed_mps[index] = 0.0
+        self._total_distance_m[index] = 0.0
+        self._last_update_time_s[index] = np.nan
+        self._start_time_s[index] = np.nan
+        self._steps[index] = 0
+        self._weight_kg[index] = weight_kg
+        self._rolling_N[index] = G_MPS2 * weight_kg * CRR
+        return self.rider(index)
+
+    def release_rider(self, index):
+        '''
+        Frees a rider's place in the batch for the next rider added.
+        '''
+        self._free.append(index)
+
+    def update(self, power_watts, time_s, riders=None):
+        '''
+        Calculates the riders' speed and distance, from their power and the
+        time, each either a scalar or an array with one value per rider. If
+        riders (a list of indexes) is given, only those riders are updated,
+        from values given in the same order, and the rest are left alone.
+        '''
+        if riders is None:
+            power_watts = np.broadcast_to(np.asarray(power_watts, dtype=float),
+                                          self._speed_mps.shape)
+            time_s = np.broadcast_to(np.asarray(time_s, dtype=float), self._speed_mps.shape)
+            active = None
+        else:
+            riders = np.asarray(riders, dtype=int)
+            active = np.zeros(len(self), dtype=bool)
+            active[riders] = True
+            power = np.zeros(len(self))
+            power[riders] = power_watts
+            power_watts = power
+            times = self._last_update_time_s.copy()
+            times[riders] = time_s
+            time_s = times
+        if np.any(power_watts > MAX_POWER_WATTS):
+            raise ValueError("Out of range power {} > {}".format(
+                np.max(power_watts), MAX_POWER_WATTS))
+        self._step(power_watts, time_s, active)
+
+    def _step(self, power_watts, time_s, active=None):
+        '''
+        Updates the riders, from arrays of power and time with one value per
+        rider. Only riders set in the active mask are updated, if it's given.
+        '''
+        restart = ~(time_s >= self._last_update_time_s) # Including the first update
+        if active is not None:
+            restart &= active
+        if np.any(restart):
+            self._start_time_s[restart] = time_s[restart]
+            self._steps[restart] = 0
+        self._last_update_time_s = np.array(time_s)
+        elapsed_s = time_s - self._start_time_s
+        if active is not None:
+            elapsed_s = np.where(active, elapsed_s, 0.0) # Riders never updated have no start
+        steps = np.maximum(np.floor(elapsed_s / self.step_s +
+                                    STEP_TOLERANCE).astype(int) - self._steps, 0)
+        self._steps += steps
+
+        substeps = np.minimum(steps, self.max_substeps)
+        max_substeps = int(np.max(substeps)) if len(substeps) else 0
+        if max_substeps and np.all(substeps == max_substeps):
+            for _ in range(max_substeps):
+                self._substep(power_watts, None)
+        else:
+            for i in range(max_substeps):
+                self._substep(power_watts, i < substeps)
+        over = steps > self.max_substeps
+        if np.any(over):
+            self._total_distance_m[over] += self._speed_mps[over] * (
+                (steps[over] - self.max_substeps) * self.step_s)
+
+    def _substep(self, power_watts, active):
+        '''
+        Simulates one step of step_s for the active riders (all of them if None).
+        '''
+        speed = self._speed_mps
+        grade = self.grade
+        Fg_N = G_MPS2 * self._weight_kg * grade / np.sqrt(1 + grade * grade)
+        Fr_N = self._rolling_N * (speed > 0.0)
+        Fa_N = AERO_DRAG_COEFF * (speed * speed)
+        Fp_N = power_watts * (1-LOSS) / np.maximum(speed, MIN_PEDAL_SPEED_MPS)
+        A_mps2 = (Fp_N - (Fg_N + Fr_N + Fa_N)) / self._weight_kg
+        new_speed = np.maximum(speed + A_mps2 * self.step_s, 0.0)
+        if active is None:
+            self._speed_mps = new_speed
+            self._total_distance_m += new_speed * self.step_s
+        else:
+            self._speed_mps = np.where(active, new_speed, speed)
+            self._total_distance_m += np.where(active, new_speed * self.step_s, 0.0)
+
+    def run(self, power_watts, times_s):
+        '''
+        Steps the batch through a series of updates, one per row of power_watts
+        (with a column per rider), at the times in times_s (one per row, or an
+        array of the same shape). As each step depends on the last, the rows are
+        stepped in turn, with every rider updated at once. Returns arrays of the
+        speed and total distance after each step, shaped like power_watts.
+        '''
+        power_watts = np.asarray(power_watts, dtype=float)
+        times_s = np.asarray(times_s, dtype=float)
+        if times_s.ndim == 1:
+            times_s = times_s[:, np.newaxis]
+        times_s = np.broadcast_to(times_s, power_watts.shape)
+        if np.any(power_watts > MAX_POWER_WATTS):
+            raise ValueError("Out of range power {} > {}".format(
+                np.max(power_watts), MAX_POWER_WATTS))
+        speeds = np.empty(power_watts.shape)
+        distances = np.empty(power_watts.shape)
+        for i, (power, t) in enumerate(zip(power_watts, times_s)):
+            self._step(power, t)
+            speeds[i] = self._speed_mps
+            distances[i] = self._total_distance_m
+        return speeds, distances
+
+    @property
+    def grade(self):
+        '''
+        Grades of the course at each rider's current distance.
+        '''
+        if self.course is None:
+            return np.zeros(len(self))
+        return self.course.grades_at(self._total_distance_m)
+
+    @property
+    def speed_mps(self):
+        '''
+        Speeds in meters per second.
+        '''
+        return self._speed_mps
+
+    @property
+    def speed_miph(self):
+        '''
+        Speeds in miles per hour.
+        '''
+        return self._speed_mps * MIPH_PER_MPS
+
+    @property
+    def total_distance_m(self):
+        '''
+        Total distances travelled in meters.
+        '''
+        return self._total_distance_m
+
+    @property
+    def total_distance_mi(self):
+        '''
+        Total distances travelled in miles.
+        '''
+        return self._total_distance_m / M_PER_MI
+
+    @property
+    def weight_kg(self):
+        '''
+        Returns the bike+rider weights used for the sim.
+        '''
+        return self._weight_kg
+
+    @weight_kg.setter
+    def weight_kg(self, weight_kg):
+        '''
+        Sets the combined bike+rider weights, from a scalar or one per rider.
+        '''
+        self._weight_kg = np.broadcast_to(np.asarray(weight_kg, dtype=float),
+                                          self._speed_mps.shape).copy()
+        self._rolling_N = G_MPS2 * self._weight_kg * CRR # Rolling resistance when moving
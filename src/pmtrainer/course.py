@@ -0,0 +1,198 @@
+"""
+Courses for the bike simulator to ride, loaded from the elevation profile
+and route of a TCX or GPX file.
+
+The profile is precomputed into arrays indexed by distance along the
+course, with the grade of each segment between points smoothed over a
+short window to hide GPS altitude noise. Looking up the grade, altitude or
+position at a distance is a binary search over the segment start
+distances, so it stays fast on century-length courses.
+
+Copyright (C) 2021  Robert Ussery
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from bisect import bisect_right
+import gzip
+import os
+from xml.etree import ElementTree as et
+import numpy as np
+from pmtrainer.tcx_file import Tcx
+
+EARTH_RADIUS_M = 6371000.0
+GRADE_WINDOW_M = 20.0 # Distance grades are smoothed over
+MAX_GRADE = 0.3
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+def _read_gpx(fname):
+    '''
+    Returns lists of the latitude, longitude and altitude of each track or
+    route point in a GPX file, with NaN altitudes for points without one.
+    '''
+    lat_deg, lon_deg, altitude_m = [], [], []
+    opener = gzip.open if fname.endswith(".gz") else open
+    with opener(fname, "rb") as f:
+        for _, elem in et.iterparse(f):
+            if _local_name(elem.tag) in ("trkpt", "rtept"):
+                ele = next((e.text for e in elem if _local_name(e.tag) == "ele"), None)
+                lat_deg.append(float(elem.get("lat")))
+                lon_deg.append(float(elem.get("lon")))
+                altitude_m.append(float(ele) if ele else np.nan)
+                elem.clear()
+    return lat_deg, lon_deg, altitude_m
+
+def _read_tcx(fname):
+    '''
+    Returns lists of the latitude, longitude, altitude and distance of each
+    Trackpoint in a TCX activity or course file, with NaN for missing values.
+    '''
+    log = Tcx()
+    log.open_log(fname, streaming=True)
+    columns = ([], [], [], [])
+    point = log.get_next_point()
+    while point is not None:
+        for column, value in zip(columns, [point.lat_deg, point.lon_deg, point.altitude_m,
+                                           point.distance_m]):
+            column.append(np.nan if value is None else value)
+        point = log.get_next_point()
+    return columns
+
+def path_distance_m(lat_deg, lon_deg):
+    '''
+    Returns the cumulative distance along a path of points, using the haversine formula.
+    '''
+    lat = np.radians(np.asarray(lat_deg, dtype=float))
+    lon = np.radians(np.asarray(lon_deg, dtype=float))
+    a = (np.sin(np.diff(lat) / 2) ** 2 +
+         np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2)
+    steps = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    return np.concatenate(([0.0], np.cumsum(steps)))
+
+class Course():
+    '''
+    An elevation profile, and optionally a route, by distance along a course.
+    Past the end of the course, it's flat and stays at the finish.
+    '''
+    def __init__(self, distance_m, altitude_m, lat_deg=None, lon_deg=None, name=None,
+                 grade_window_m=GRADE_WINDOW_M):
+        distance_m = np.asarray(distance_m, dtype=float)
+        altitude_m = np.asarray(altitude_m, dtype=float)
+        keep = np.isfinite(distance_m) & np.isfinite(altitude_m)
+        if lat_deg is not None and lon_deg is not None:
+            lat_deg = np.asarray(lat_deg, dtype=float)
+            lon_deg = np.asarray(lon_deg, dtype=float)
+            keep &= np.isfinite(lat_deg) & np.isfinite(lon_deg)
+        # Keep one point per distance, so every segment has a length:
+        keep[1:] &= np.diff(np.maximum.accumulate(np.where(keep, distance_m, -np.inf))) > 0
+        if np.count_nonzero(keep) < 2:
+            raise ValueError("Course needs at least two points with distance and altitude")
+        self.name = name
+        self.distance_m = distance_m[keep] - distance_m[keep][0]
+        self.altitude_m = altitude_m[keep]
+        self.lat_deg = lat_deg[keep] if lat_deg is not None else None
+        self.lon_deg = lon_deg[keep] if lon_deg is not None else None
+
+        # Grade of each segment, from the altitude either side of its middle over
+        # the smoothing window, or the segment itself if it's longer:
+        half_m = np.maximum(grade_window_m, np.diff(self.distance_m)) / 2
+        mid_m = (self.distance_m[:-1] + self.distance_m[1:]) / 2
+        lo_m = np.maximum(mid_m - half_m, 0)
+        hi_m = np.minimum(mid_m + half_m, self.length_m)
+        self.grade = np.clip((np.interp(hi_m, self.distance_m, self.altitude_m) -
+                              np.interp(lo_m, self.distance_m, self.altitude_m)) / (hi_m - lo_m),
+                             -MAX_GRADE, MAX_GRADE)
+        self._starts_m = self.distance_m[:-1].tolist() # For bisect, which is fastest on lists
+        self._grades = self.grade.tolist()
+
+    @classmethod
+    def from_file(cls, fname):
+        '''
+        Loads a course from a TCX or GPX file (optionally gzipped). Distances are
+        taken from the file if it has them for every point, otherwise they're
+        measured along the route.
+        '''
+        if fname.endswith((".gpx", ".gpx.gz")):
+            lat_deg, lon_deg, altitude_m = _read_gpx(fname)
+            distance_m = None
+        else:
+            lat_deg, lon_deg, altitude_m, distance_m = _read_tcx(fname)
+        lat_deg, lon_deg = np.array(lat_deg, dtype=float), np.array(lon_deg, dtype=float)
+        has_route = len(lat_deg) > 1 and np.all(np.isfinite(lat_deg) & np.isfinite(lon_deg))
+        if distance_m is None or not np.all(np.isfinite(distance_m)):
+            if not has_route:
+                raise ValueError("Course {} has no distances or positions".format(fname))
+            distance_m = path_distance_m(lat_deg, lon_deg)
+        name = os.path.basename(fname).split(".")[0]
+        if has_route:
+            return cls(distance_m, altitude_m, lat_deg, lon_deg, name=name)
+        return cls(distance_m, altitude_m, name=name)
+
+    @property
+    def length_m(self):
+        '''
+        Returns the length of the course.
+        '''
+        return float(self.distance_m[-1])
+
+    def segment(self, distance_m):
+        '''
+        Returns the index of the segment containing a distance, by binary search.
+        '''
+        return min(max(bisect_right(self._starts_m, distance_m) - 1, 0), len(self._starts_m) - 1)
+
+    def segments(self, distance_m):
+        '''
+        Returns the index of the segment containing each of an array of distances.
+        '''
+        return np.clip(np.searchsorted(self.distance_m[:-1], distance_m, side="right") - 1,
+                       0, len(self._starts_m) - 1)
+
+    def grade_at(self, distance_m):
+        '''
+        Returns the grade (rise over run) at a distance along the course.
+        '''
+        if distance_m >= self.length_m:
+            return 0.0
+        return self._grades[self.segment(distance_m)]
+
+    def grades_at(self, distance_m):
+        '''
+        Returns the grade at each of an array of distances along the course.
+        '''
+        distance_m = np.asarray(distance_m, dtype=float)
+        return np.where(distance_m >= self.length_m, 0.0, self.grade[self.segments(distance_m)])
+
+    def _interpolate(self, values, distance_m):
+        i = self.segment(distance_m)
+        start, end = self.distance_m[i], self.distance_m[i + 1]
+        frac = min(max((distance_m - start) / (end - start), 0.0), 1.0)
+        return float(values[i] + (values[i + 1] - values[i]) * frac)
+
+    def altitude_at(self, distance_m):
+        '''
+        Returns the altitude at a distance along the course.
+        '''
+        return self._interpolate(self.altitude_m, distance_m)
+
+    def position_at(self, distance_m):
+        '''
+        Returns the (latitude, longitude) at a distance along the course,
+        or (None, None) if the course has no route.
+        '''
+        if self.lat_deg is None:
+            return None, None
+        return (self._interpolate(self.lat_deg, distance_m),
+                self._interpolate(self.lon_deg, distance_m))
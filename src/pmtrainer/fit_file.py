@@ -0,0 +1,267 @@
+"""
+Writes and reads activity track points as binary FIT files.
+
+Implements the subset of the FIT protocol needed for a single-lap activity:
+file_id, record, lap, session and activity messages, using normal
+(uncompressed) record headers. See the FIT SDK for the protocol details:
+https://developer.garmin.com/fit/protocol/
+
+Copyright (C) 2021  Robert Ussery
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import struct
+import numpy as np
+from pmtrainer.trackpoints import TrackpointBuffer
+
+FIT_EPOCH_S = 631065600 # 1989-12-31T00:00:00Z, the zero time for FIT timestamps
+SEMICIRCLES_PER_DEG = 2**31 / 180.0
+PROTOCOL_VERSION = 0x20
+PROFILE_VERSION = 2132
+HEADER_SIZE = 14
+
+# Global message numbers:
+MESG_FILE_ID = 0
+MESG_SESSION = 18
+MESG_LAP = 19
+MESG_RECORD = 20
+MESG_ACTIVITY = 34
+
+# Base types as (type code, struct format, invalid value):
+ENUM = (0x00, "B", 0xFF)
+UINT8 = (0x02, "B", 0xFF)
+UINT16 = (0x84, "H", 0xFFFF)
+SINT32 = (0x85, "i", 0x7FFFFFFF)
+UINT32 = (0x86, "I", 0xFFFFFFFF)
+UINT32Z = (0x8C, "I", 0x00000000)
+BASE_TYPES = {t[0]: t for t in [ENUM, UINT8, UINT16, SINT32, UINT32, UINT32Z]}
+
+# Record fields as (field number, base type, trackpoint column, scale, offset):
+RECORD_FIELDS = [
+    (253, UINT32, "time", 1, -FIT_EPOCH_S),
+    (0, SINT32, "lat_deg", SEMICIRCLES_PER_DEG, 0),
+    (1, SINT32, "lon_deg", SEMICIRCLES_PER_DEG, 0),
+    (2, UINT16, "altitude_m", 5, 500),
+    (3, UINT8, "heartrate_bpm", 1, 0),
+    (4, UINT8, "cadence_rpm", 1, 0),
+    (5, UINT32, "distance_m", 100, 0),
+    (6, UINT16, "speed_mps", 1000, 0),
+    (7, UINT16, "power_watts", 1, 0),
+]
+
+SPORT_CYCLING = 2
+SUB_SPORT_INDOOR_CYCLING = 6
+SUB_SPORT_GENERIC = 0
+
+_CRC_TABLE = []
+for _i in range(256):
+    _crc = _i
+    for _ in range(8):
+        _crc = (_crc >> 1) ^ 0xA001 if _crc & 1 else _crc >> 1
+    _CRC_TABLE.append(_crc)
+
+class FitError(Exception):
+    '''
+    Exceptions for reading FIT files.
+    '''
+    def __init__(self, message=""):
+        super().__init__(message)
+
+def crc16(data, crc=0):
+    '''
+    Calculates the FIT CRC (CRC-16/ARC) of a bytes object.
+    '''
+    for byte in data:
+        crc = (crc >> 8) ^ _CRC_TABLE[(crc ^ byte) & 0xFF]
+    return crc
+
+def _definition(local_num, global_num, fields):
+    '''
+    Returns a definition message for a list of (field number, base type) tuples.
+    '''
+    out = struct.pack("<BBBHB", 0x40 | local_num, 0, 0, global_num, len(fields))
+    for field_num, base_type in fields:
+        out += struct.pack("<BBB", field_num, struct.calcsize(base_type[1]), base_type[0])
+    return out
+
+def _message(local_num, global_num, fields):
+    '''
+    Returns a definition message and a data message, for a list of
+    (field number, base type, value) tuples. Values of None are written as invalid.
+    '''
+    out = _definition(local_num, global_num, [f[:2] for f in fields])
+    out += struct.pack("<B", local_num)
+    for _, base_type, val in fields:
+        out += struct.pack("<" + base_type[1], base_type[2] if val is None else int(round(val)))
+    return out
+
+def _encode_column(values, base_type, scale, offset):
+    '''
+    Scales a column of values to its FIT representation, replacing NaN with
+    the invalid value for the type.
+    '''
+    _, fmt, invalid = base_type
+    dtype = np.dtype("<" + fmt)
+    info = np.iinfo(dtype)
+    scaled = np.round((values + offset) * scale)
+    valid = np.isfinite(scaled) & (scaled >= info.min) & (scaled <= info.max)
+    out = np.full(len(values), invalid, dtype=dtype)
+    out[valid] = scaled[valid]
+    return out
+
+def _encode_records(trackpoints, local_num):
+    '''
+    Returns a definition message and all the record messages for the trackpoints.
+    Columns without any data are left out of the definition.
+    '''
+    fields = [f for f in RECORD_FIELDS
+              if f[2] == "time" or not np.all(np.isnan(trackpoints.column(f[2])))]
+    dtype = np.dtype([("header", "u1")] +
+                     [(f[2], "<" + f[1][1]) for f in fields])
+    records = np.zeros(len(trackpoints), dtype=dtype)
+    records["header"] = local_num
+    for _, base_type, column, scale, offset in fields:
+        records[column] = _encode_column(trackpoints.column(column), base_type, scale, offset)
+    return _definition(local_num, MESG_RECORD, [f[:2] for f in fields]) + records.tobytes()
+
+def write_fit(fname, trackpoints, total_time_s=None, distance_m=None, indoor=True):
+    '''
+    Writes a FIT activity file from a TrackpointBuffer, with a single lap and session.
+    Lap time and distance are calculated from the points if not given.
+    Note that FIT timestamps have a resolution of one second.
+    '''
+    times = trackpoints.column("time")
+    if len(times) == 0 or np.any(np.isnan(times)):
+        raise FitError("All points must have a time to write a FIT file")
+    start_s, end_s = times[0] - FIT_EPOCH_S, times[-1] - FIT_EPOCH_S
+    if total_time_s is None:
+        total_time_s = end_s - start_s
+    if distance_m is None:
+        dist = trackpoints.column("distance_m")
+        distance_m = np.nanmax(dist) if not np.all(np.isnan(dist)) else None
+    sub_sport = SUB_SPORT_INDOOR_CYCLING if indoor else SUB_SPORT_GENERIC
+    total_time_ms = float(total_time_s) * 1000
+    distance_cm = None if distance_m is None else float(distance_m) * 100
+
+    data = _message(0, MESG_FILE_ID, [
+        (0, ENUM, 4), # Activity file
+        (1, UINT16, 255), # Development manufacturer
+        (2, UINT16, 0), # Product
+        (3, UINT32Z, 1), # Serial number
+        (4, UINT32, start_s)]) # Time created
+    data += _encode_records(trackpoints, 1)
+    data += _message(2, MESG_LAP, [
+        (253, UINT32, end_s),
+        (0, ENUM, 9), # Lap event
+        (1, ENUM, 1), # Stop
+        (2, UINT32, start_s),
+        (7, UINT32, total_time_ms), # Elapsed time
+        (8, UINT32, total_time_ms), # Timer time
+        (9, UINT32, distance_cm),
+        (25, ENUM, SPORT_CYCLING),
+        (39, ENUM, sub_sport)])
+    data += _message(3, MESG_SESSION, [
+        (253, UINT32, end_s),
+        (0, ENUM, 8), # Session event
+        (1, ENUM, 1), # Stop
+        (2, UINT32, start_s),
+        (5, ENUM, SPORT_CYCLING),
+        (6, ENUM, sub_sport),
+        (7, UINT32, total_time_ms),
+        (8, UINT32, total_time_ms),
+        (9, UINT32, distance_cm),
+        (25, UINT16, 0), # First lap index
+        (26, UINT16, 1)]) # Number of laps
+    data += _message(4, MESG_ACTIVITY, [
+        (253, UINT32, end_s),
+        (0, UINT32, total_time_ms),
+        (1, UINT16, 1), # Number of sessions
+        (2, ENUM, 0), # Manual activity
+        (3, ENUM, 26), # Activity event
+        (4, ENUM, 1)]) # Stop
+
+    header = struct.pack("<BBHI4s", HEADER_SIZE, PROTOCOL_VERSION, PROFILE_VERSION,
+                         len(data), b".FIT")
+    header += struct.pack("<H", crc16(header))
+    with open(fname, "wb") as f:
+        f.write(header + data + struct.pack("<H", crc16(data, crc16(header))))
+
+def read_fit_messages(fname):
+    '''
+    Reads a FIT file, and returns a list of (global message number, {field number: value})
+    tuples for all data messages. Invalid values are returned as None.
+    '''
+    with open(fname, "rb") as f:
+        data = f.read()
+    if len(data) < 12 or data[8:12] != b".FIT":
+        raise FitError("{} is not a FIT file".format(fname))
+    header_size = data[0]
+    data_size = struct.unpack_from("<I", data, 4)[0]
+    end = header_size + data_size
+    if len(data) < end + 2:
+        raise FitError("{} is truncated".format(fname))
+    if crc16(data[:end + 2]) != 0:
+        raise FitError("CRC error in {}".format(fname))
+
+    definitions = {}
+    messages = []
+    pos = header_size
+    while pos < end:
+        header = data[pos]
+        pos += 1
+        if header & 0x80:
+            raise FitError("Compressed timestamp headers are not supported")
+        local_num = header & 0x0F
+        if header & 0x40:
+            if header & 0x20:
+                raise FitError("Developer data fields are not supported")
+            endian = ">" if data[pos + 1] else "<"
+            global_num, num_fields = struct.unpack_from(endian + "HB", data, pos + 2)
+            pos += 5
+            fields = []
+            fmt = endian
+            for _ in range(num_fields):
+                field_num, size, type_code = struct.unpack_from("<BBB", data, pos)
+                pos += 3
+                base_type = BASE_TYPES.get(type_code)
+                if base_type and struct.calcsize(base_type[1]) == size:
+                    fmt += base_type[1]
+                    fields.append((field_num, base_type[2]))
+                else:
+                    fmt += "{}x".format(size) # Skip unsupported field types
+            definitions[local_num] = (global_num, fields, struct.Struct(fmt))
+        else:
+            if local_num not in definitions:
+                raise FitError("Data message with no definition at byte {}".format(pos))
+            global_num, fields, fmt = definitions[local_num]
+            values = fmt.unpack_from(data, pos)
+            pos += fmt.size
+            messages.append((global_num, {
+                field_num: (None if val == invalid else val)
+                for (field_num, invalid), val in zip(fields, values)}))
+    return messages
+
+def read_fit(fname):
+    '''
+    Reads the record messages from a FIT file into a TrackpointBuffer.
+    '''
+    columns = {f[2]: [] for f in RECORD_FIELDS}
+    for global_num, values in read_fit_messages(fname):
+        if global_num == MESG_RECORD:
+            for field_num, _, column, _, _ in RECORD_FIELDS:
+                val = values.get(field_num)
+                columns[column].append(np.nan if val is None else val)
+    for _, _, column, scale, offset in RECORD_FIELDS:
+        columns[column] = np.array(columns[column], dtype=float) / scale - offset
+    return TrackpointBuffer.from_columns(columns)
@@ -0,0 +1,152 @@
+"""
+Connects the sensors for group sessions, with a heartrate monitor and
+power meter for each rider on one ANT+ dongle.
+
+The sensor manager opens a heartrate and a power meter channel for each
+rider, up to the dongle's channel limit, and routes each channel's
+callbacks straight to its rider's sensor state. Paired devices are kept in
+a table keyed by device type and number (device numbers are only unique
+within a device type), so the rider for any device can be looked up
+directly. Each rider is a sensor source for their session on a
+SessionServer.
+
+Copyright (C) 2021  Robert Ussery
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import functools
+from pmtrainer.ant_sensors import (RiderSensors, UsbAntDriver, SAMPLE_BUFFER_SIZE,
+                                   HEARTRATE_DEVICE_TYPE, POWER_DEVICE_TYPE)
+
+# Channels on an ANT USB2 or USB-m dongle. Each rider takes two:
+ANT_CHANNEL_LIMIT = 8
+CHANNELS_PER_RIDER = 2
+
+class Rider(RiderSensors):
+    """
+    One rider in a group session: their sensor data, the device numbers of
+    their sensors (0 to pair with any device found), and their settings.
+    """
+    def __init__(self, name, heartrate_device_number=0, power_device_number=0,
+                 weight_kg=80, ftp_watts=230, buffer_size=SAMPLE_BUFFER_SIZE):
+        super().__init__(buffer_size=buffer_size)
+        self.name = name
+        self.heartrate_device_number = heartrate_device_number
+        self.power_device_number = power_device_number
+        self.weight_kg = weight_kg
+        self.ftp_watts = ftp_watts
+        self.driver = None # Set when added to a sensor manager
+        self.heartrate_channel = None
+        self.power_channel = None
+
+    def update(self, elapsed_s):
+        """
+        Lets drivers that aren't driven by the clock catch up to the elapsed time.
+        """
+        if self.driver:
+            self.driver.update(elapsed_s)
+
+    def _on_channel_closed(self, device):
+        if device == self.heartrate_channel:
+            self._heart_rate_status.make_disconnected()
+        elif device == self.power_channel:
+            self._power_meter_status.make_disconnected()
+        print("Channel closed for {:s} on {:s}".format(self.name, device.name))
+
+    def _on_search_timeout(self, device):
+        # Unlike a single rider, the session carries on without the missing sensor:
+        print("Timed out searching for {:s} device for {:s}".format(device.name, self.name))
+
+
+class SensorManager():
+    """
+    Connects the sensors of several riders through one ANT+ driver.
+    """
+    def __init__(self, ant_driver=None, max_channels=ANT_CHANNEL_LIMIT, search_timeout_sec=120):
+        self.driver = ant_driver if ant_driver else UsbAntDriver()
+        self.max_channels = max_channels
+        self.search_timeout_sec = search_timeout_sec
+        self.riders = []
+        self._riders_by_device = {} # (Device type, device number) -> rider
+
+    def add_rider(self, rider):
+        '''
+        Adds a rider, and creates channels for their sensors. Raises ValueError
+        if there aren't enough channels left on the dongle.
+        '''
+        if (len(self.riders) + 1) * CHANNELS_PER_RIDER > self.max_channels:
+            raise ValueError("No ANT+ channels left for rider {} ({} channels)".format(
+                rider.name, self.max_channels))
+        rider.driver = self.driver
+        rider.clock = self.driver.clock
+        paired = functools.partial(self._on_device_found, rider)
+        rider.heartrate_channel = self.driver.heart_rate(
+            callbacks = {'onDevicePaired': paired,
+                         'onHeartRateData': rider._on_heartrate_data,
+                         'onChannelClosed': rider._on_channel_closed,
+                         'onSearchTimeout': rider._on_search_timeout})
+        rider.power_channel = self.driver.power_meter(
+            callbacks = {'onDevicePaired': paired,
+                         'onPowerData': rider._on_power_data,
+                         'onChannelClosed': rider._on_channel_closed,
+                         'onSearchTimeout': rider._on_search_timeout})
+        for device_type, device_number in [
+                (HEARTRATE_DEVICE_TYPE, rider.heartrate_device_number),
+                (POWER_DEVICE_TYPE, rider.power_device_number)]:
+            if device_number:
+                self._riders_by_device[(device_type, device_number)] = rider
+        self.riders.append(rider)
+        return rider
+
+    def rider(self, device_type, device_number):
+        '''
+        Returns the rider paired with a device of an ANT+ device type and number, or None.
+        '''
+        return self._riders_by_device.get((device_type, device_number))
+
+    def connect(self):
+        '''
+        Attaches to the ANT+ dongle and begins searching for every rider's sensors.
+        '''
+        self.driver.start()
+        for rider in self.riders:
+            rider.reset()
+            self.driver.open_device(rider.heartrate_channel, self.search_timeout_sec,
+                                    rider.heartrate_device_number)
+            self.driver.open_device(rider.power_channel, self.search_timeout_sec,
+                                    rider.power_device_number)
+
+    def close(self):
+        '''
+        Closes every channel and releases the dongle.
+        '''
+        for rider in self.riders:
+            self.driver.close_device(rider.heartrate_channel)
+            self.driver.close_device(rider.power_channel)
+        self.driver.stop()
+
+    def update(self, elapsed_s):
+        '''
+        Lets drivers that aren't driven by the clock catch up to the elapsed time.
+        '''
+        self.driver.update(elapsed_s)
+
+    def _on_device_found(self, rider, device, ch_id):
+        if ch_id.deviceType == HEARTRATE_DEVICE_TYPE:
+            rider.heartrate_device_number = ch_id.deviceNumber
+        else:
+            rider.power_device_number = ch_id.deviceNumber
+        self._riders_by_device[(ch_id.deviceType, ch_id.deviceNumber)] = rider
+        print("Found a {:s} device for {:s}, device number: {:d}".format(
+            device.name, rider.name, ch_id.deviceNumber))
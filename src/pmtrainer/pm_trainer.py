@@ -21,21 +21,27 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import argparse
 import os
+import sqlite3
 import sys
 import time
 import datetime as dt
 import PySimpleGUI as sg
 
-import profile_plotter as profile_plotter
-import settings as settings
-from strava_api import StravaApi, StravaData
-from ant_sensors import AntSensors
-import assets.icons as icons
-from workout_profile import Workout
-from tcx_file import Tcx, Point
-from bug_indicator import BugIndicator
-from bike_sim import BikeSim
-from settings_dialog import settings_dialog_popup, \
+from pmtrainer import profile_plotter
+from pmtrainer import settings
+from pmtrainer.strava_api import StravaApi, StravaData
+from pmtrainer.assets import icons
+from pmtrainer.workout_library import get_library
+from pmtrainer.tcx_file import Tcx, SampleJournal, recover_journal
+from pmtrainer.fit_file import FitError
+from pmtrainer.bug_indicator import BugIndicator
+from pmtrainer.course import Course
+from pmtrainer.sensors import SensorStatus, ReplaySensors
+from pmtrainer.trainer_engine import TrainerEngine, Timer
+from pmtrainer.replay import replay_rides, SUMMARY_FILE_NAME
+from pmtrainer.ride_history import RideHistory
+from pmtrainer.session_server import SessionServer
+from pmtrainer.settings_dialog import settings_dialog_popup, \
                                       set_strava_status, handle_strava_auth_button
 
 DFT_PMTRAINER_DIR = os.path.expanduser("~/pmtrainer/")
@@ -46,132 +52,156 @@ DEFAULT_SETTINGS = {
    "RiderWeightKg": 70,
    "BikeWeightKg": 10,
    "Workout": "workouts/short_stack.yaml",
+   "Course": "", # TCX or GPX file with the elevation profile to ride, or empty for a flat road
+   "UploadFormat": "fit", # "fit" to convert the log before uploading, or "tcx"
+   "LogFormat": "tcx", # "tcx", or "tcx.gz" for compressed logs
 
    # Window / system settings
    "LogDirectory": DFT_PMTRAINER_DIR+"logs",
    "SettingsFile": DFT_PMTRAINER_DIR+"pm_trainer_settings.ini",
+   "HistoryFile": DFT_PMTRAINER_DIR+"ride_history.db",
 }
 
 PLOT_MARGINS_PERCENT = 10 # Percent of plot to show beyond limits
 HEART_RATE_LIMITS = (100, 200)
 POWER_BUG_LIMITS_WATTS = 100 # Vertical size of power bug in watts
 UPDATE_RATE_MS = 100
+FONT = "Helvetica 22"
+LABEL_FONT = "Helvetica 14"
 
-parser = argparse.ArgumentParser(description='Command line options')
-parser.add_argument("-r", "--replay", default=None,
-                    help="Enable replay mode and pass in file to replay")
-parser.add_argument("-s", "--speed", default=1.0, type=float,
-                    help="Enable replay mode and pass in file to replay")
-args = parser.parse_args()
-if args.replay:
-    REPLAY_MODE = True
-    if not os.path.isfile(args.replay):
-        print("\nERROR: Invalid file {}".format(args.replay))
+def _parse_args():
+    parser = argparse.ArgumentParser(description='Command line options')
+    parser.add_argument("-r", "--replay", default=None, nargs="+",
+                        help="Enable replay mode and pass in file(s) to replay")
+    parser.add_argument("-s", "--speed", default=1.0, type=float,
+                        help="Replay speed multiplier")
+    parser.add_argument("--headless", action="store_true",
+                        help="Replay without the GUI, as fast as possible")
+    parser.add_argument("-o", "--output", default=None,
+                        help="Directory for headless replay logs (default: log directory)")
+    parser.add_argument("--server", default=None, type=int, metavar="RIDERS",
+                        help="Host sessions for a number of riders without the GUI")
+    parser.add_argument("--simulate", action="store_true",
+                        help="Use simulated ANT+ sensors in server mode")
+    parser.add_argument("--import-history", default=None, metavar="LOG_DIR",
+                        help="Add the logs in a directory to the ride history, and exit")
+    args = parser.parse_args()
+    if args.simulate and not args.server:
+        print("\nERROR: --simulate needs --server")
         sys.exit()
-    print("\nReplaying {} at {:2.1f}x speed".format(args.replay, args.speed))
-else:
-    REPLAY_MODE = False
-
-class Timer():
-    '''
-    A timer that returns time as a datetime timedelta. The timer only updates
-    when the update() method is called, so that the same time can be used in
-    multiple places in a loop.
-    '''
-    def __init__(self, replay=False, tick_ms=100.0):
-        self.replay=replay
-        self.start_time = None
-        self.elapsed_time = None
-        self.tick_ms = tick_ms
-
-    def start(self, current_time=dt.datetime.now()):
-        '''
-        Start the timer.
-        '''
-        self.start_time = current_time
-        self.elapsed_time = dt.timedelta(seconds=0)
-
-    def get_time(self):
-        '''
-        Return the timedelta from when the timer was started to
-        when it was updated.
-        '''
-        return self.elapsed_time
-
-    def update(self):
-        '''
-        Update the elapsed time.
-        '''
-        if self.replay:
-            self.elapsed_time += dt.timedelta(seconds=self.tick_ms / 1000.0)
+    if args.replay:
+        for fname in args.replay:
+            if not os.path.isfile(fname):
+                print("\nERROR: Invalid file {}".format(fname))
+                sys.exit()
+        if args.headless:
+            print("\nReplaying {} file(s) headless".format(len(args.replay)))
+        elif len(args.replay) > 1:
+            print("\nERROR: Only one file can be replayed with the GUI, use --headless")
+            sys.exit()
         else:
-            self.elapsed_time = dt.datetime.now() - self.start_time
-
-def _avg_val(running_avg_val, new_val, avg_window=10):
-    '''
-    Keeps a running average of values, weighted by the window length
-    '''
-    diff = new_val - running_avg_val
-    return running_avg_val + (diff / avg_window)
-
-def _convert_string_time(strtime):
-    '''
-    Convert string time to datetime
-    '''
-    return dt.datetime.strptime(strtime, "%Y-%m-%dT%H:%M:%SZ")
+            print("\nReplaying {} at {:2.1f}x speed".format(args.replay[0], args.speed))
+    elif args.headless:
+        print("\nERROR: --headless needs files to --replay")
+        sys.exit()
+    return args
 
-def _exit_app(status=0):
+def _exit_app(window=None, sensors=None, status=0):
     '''
     Exit cleanly, closing window, writing logfile, and freeing ANT+ resources.
     '''
-    try:
+    if window:
         window.close()
-    except NameError:
-        pass
-    try:
+    if sensors:
         sensors.close()
-    except NameError:
-        pass
     sys.exit(status)
 
 def _update_sensor_status_indicator(element, sensor_status):
     '''
     Change color of the selected element based on the status of an ANT+ sensor.
     '''
-    if sensor_status == AntSensors.SensorStatus.State.NOTCONNECTED:
+    if sensor_status == SensorStatus.State.NOTCONNECTED:
         element.update(background_color="red")
-    elif sensor_status == AntSensors.SensorStatus.State.CONNECTED:
+    elif sensor_status == SensorStatus.State.CONNECTED:
         element.update(background_color=sg.theme_background_color())
-    elif sensor_status == AntSensors.SensorStatus.State.STALE:
+    elif sensor_status == SensorStatus.State.STALE:
         element.update(background_color="yellow")
 
 def _get_workout_from_config(config):
     '''
     Initialize workout plot with workout profile
     '''
-    wkout = Workout(config.get("Workout"))
-    min_p, max_p = wkout.get_min_max_power()
+    library = get_library()
+    wkout = library.get(config.get("Workout"))
+    min_p, max_p = library.get_min_max_power(config.get("Workout"))
     return wkout, min_p, max_p
 
-def _start_log(ldir):
+def _get_course_from_config(config):
+    '''
+    Load the course to ride, or return None to ride a flat road.
+    '''
+    fname = config.get("Course")
+    if not fname:
+        return None
+    try:
+        return Course.from_file(os.path.expanduser(fname))
+    except (OSError, ValueError) as e:
+        print("Could not load course {}, riding a flat road: {}".format(fname, e))
+        return None
+
+def _start_log(ldir, log_format="tcx"):
     '''
     Initialize and return a TCX logfile.
     '''
     if not os.path.exists(ldir):
         os.makedirs(ldir)
     lfile = Tcx()
-    lfile.start_log("{}/{}.tcx".format(
-        ldir, dt.datetime.now().strftime("%Y%m%d_%H%M%S")))
+    lfile.start_log("{}/{}.{}".format(
+        ldir, dt.datetime.now().strftime("%Y%m%d_%H%M%S"), log_format),
+        streaming=True, journal=True)
     lfile.start_activity(activity_type=Tcx.ActivityType.OTHER)
     return lfile
 
-def _upload_activity(config, logfile, workout):
+def _recover_logs(ldir):
+    '''
+    Rebuild any logs that weren't closed cleanly last time, from their journals.
+    '''
+    for journal in SampleJournal.find_unfinished(ldir):
+        try:
+            print("Recovered log {}".format(recover_journal(journal)))
+        except SampleJournal.JournalError as e:
+            print("Could not recover log from {}: {}".format(journal, e))
+
+def _get_upload_file(config, logfile):
+    '''
+    Returns the file to upload and its Strava data type, converting the log
+    to the much smaller FIT format if configured to. Falls back to the log
+    itself if it can't be converted.
+    '''
+    if config.get("UploadFormat").lower() == "fit":
+        fit_file = logfile.file_name.split(".tcx")[0] + ".fit"
+        try:
+            logfile.export_fit(fit_file)
+            return fit_file, "fit"
+        except FitError as e:
+            print("Could not convert {} to FIT, uploading it as TCX: {}".format(
+                logfile.file_name, e))
+    return logfile.file_name, "tcx.gz" if logfile.file_name.endswith(".gz") else "tcx"
+
+def _upload_activity(config, logfile, workout, load=None):
+    '''
+    Offer to upload a finished activity to Strava, showing the training load
+    before and after it if given. Returns the upload status, and the Strava
+    activity id if it was uploaded.
+    '''
+    status, activity_id = RideHistory.UploadStatus.NOT_UPLOADED, None
     layout = [[sg.T("Upload activity to Strava?")],
               [sg.B("Strava Connect", key="-STRAVA-BTTN-"),
                sg.T("Auth status", (30,1), key="-STRAVA-AUTH-STATUS-")],
               [sg.Frame("Summary", layout=[
                   [sg.T("Distance", (24,1), key="-DIST-"),
                    sg.T("Time", (24,1), key="-TIME-")],
+                  [sg.T(_load_text(*load) if load else "", (48,1), key="-FORM-")],
                   [sg.T("Activity Name:", (15,1)),
                    sg.I(workout.name, text_color="gray",
                         size=(40,1), key="-NAME-", metadata="default")],
@@ -202,6 +232,7 @@ def _upload_activity(config, logfile, workout):
         e, _ = window.read()
         if e in [sg.WIN_CLOSED, "-DISCARD-"]:
             if sg.PopupYesNo("Really discard this activity?") == "Yes":
+                status = RideHistory.UploadStatus.DISCARDED
                 break
         elif e == "-STRAVA-BTTN-":
             handle_strava_auth_button(strava_api, config)
@@ -215,16 +246,52 @@ def _upload_activity(config, logfile, workout):
                 window[e].metadata = ""
         elif e == "-UPLOAD-":
             try:
-                StravaData(strava_api).upload_activity(activity_file=logfile.file_name,
+                upload_file, data_type = _get_upload_file(config, logfile)
+                resp = StravaData(strava_api).upload_activity(activity_file=upload_file,
+                                        data_type=data_type,
                                         name=window["-NAME-"].get(),
                                         description=window["-DESC-"].get(),
                                         trainer=True, commute=False,
                                         activity_type="VirtualRide", gear_id="PM Trainer")
+                status, activity_id = RideHistory.UploadStatus.UPLOADED, resp.get("id")
                 sg.Popup("Uploaded successfully!")
             except StravaApi.AuthError as e:
+                status = RideHistory.UploadStatus.FAILED
                 sg.Popup("Upload failed: \r\n{}".format(e.message))
             break
     window.close()
+    return status, activity_id
+
+def _load_text(before, after):
+    '''
+    Describe the change in training load from a ride.
+    '''
+    return "Form: {:+.0f} -> {:+.0f} (fitness {:.0f}, fatigue {:.0f})".format(
+        before.tsb, after.tsb, after.ctl, after.atl)
+
+def _record_ride(config, logfile, workout):
+    '''
+    Add a finished ride to the ride history. Returns the history and the training
+    load before and after the ride, or Nones if it failed.
+    '''
+    try:
+        history = RideHistory(config.get("HistoryFile"))
+        before = history.training_load()
+        history.add_ride(logfile.file_name, ftp_watts=float(config.get("FTPWatts")),
+                         workout=workout.name)
+        return history, (before, history.training_load(before.day))
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print("Could not add {} to the ride history: {}".format(logfile.file_name, e))
+        return None, None
+
+def _import_history(config, log_dir):
+    '''
+    Add the logs in a directory to the ride history.
+    '''
+    history = RideHistory(config.get("HistoryFile"))
+    added = history.import_logs(log_dir, ftp_watts=float(config.get("FTPWatts")))
+    print("Added {} rides to {} ({} rides)".format(len(added), history.db_file, len(history)))
+    history.close()
 
 def _scale_plot_margins(y_lims):
     '''
@@ -248,231 +315,332 @@ def _plot_trace(graph, val, y_lims, size=3, color='red'):
     y_lims = _scale_plot_margins(y_lims)
     profile_plotter.plot_trace(graph, val, y_lims, size=size, color=color)
 
-# Load settings
-cfg = settings.Settings()
-if os.path.isfile(DEFAULT_SETTINGS["SettingsFile"]):
-    print("Loading config from file")
-    cfg.load_settings(filename=DEFAULT_SETTINGS["SettingsFile"])
-else:
-    print("Loading default config")
-    cfg.load_settings(defaults=DEFAULT_SETTINGS)
-    cfg.write_settings(filename=DEFAULT_SETTINGS["SettingsFile"])
-
-sg.theme("DarkBlack")
-
-# Attach to ANT+ dongle and start searching for sensors
-if not REPLAY_MODE:
+def _load_settings():
+    '''
+    Load settings from the settings file, creating it from the defaults if it doesn't exist.
+    '''
+    cfg = settings.Settings()
+    if os.path.isfile(DEFAULT_SETTINGS["SettingsFile"]):
+        print("Loading config from file")
+        # Load defaults first, so settings added since the file was written are present:
+        cfg.load_settings(defaults=DEFAULT_SETTINGS)
+        cfg.load_settings(filename=DEFAULT_SETTINGS["SettingsFile"])
+    else:
+        print("Loading default config")
+        cfg.load_settings(defaults=DEFAULT_SETTINGS)
+        cfg.write_settings(filename=DEFAULT_SETTINGS["SettingsFile"])
+    return cfg
+
+def _connect_sensors():
+    '''
+    Attach to ANT+ dongle and start searching for sensors.
+    '''
+    # Imported here, so replay mode works without the ANT+ library:
+    from pmtrainer.ant_sensors import AntSensors
     while True:
         try:
             sensors = AntSensors()
             sensors.connect()
-            break
+            return sensors
         except AntSensors.SensorError as e:
             if e.err_type == AntSensors.SensorError.ErrorType.USB:
                 sg.Popup("USB Dongle Error", "Could not connect to ANT+ dongle "
                  "- check USB connection and try again",
                     custom_text="Exit", line_width=50, keep_on_top=True, any_key_closes=True)
                 # TODO: Keep the application open and try again - this should be recoverable
-                _exit_app(-1)
+                _exit_app(status=-1)
             else:
                 print("Caught sensor error {}".format(e.err_type))
-                _exit_app(-1)
+                _exit_app(status=-1)
         time.sleep(1)
         sensors.close()
         del sensors
 
-# Set up main window
-FONT = "Helvetica 22"
-LABEL_FONT = "Helvetica 14"
-layout = [[sg.T("HH:MM:SS", (8,1), pad=((20,20),(5,0)),
-                key="-TIME-",justification="L", font="Helvetica 30"),
-           sg.Frame("Sensors", pad=(5,0), layout=[
-           [sg.T("HR:", key="-HR-LABEL-", pad=((10,0),(0,0)), font=LABEL_FONT),
-                sg.T("000",(3,1),
-                     key="-HEARTRATE-",justification="L", font=FONT),
-           sg.T("Watts:", key="-PWR-LABEL-", pad=((10,0),(0,0)), font=LABEL_FONT),
-                sg.T("0000",(4,1),
-                     key="-POWER-",justification="L", font=FONT)]]),
-           sg.Frame("Performance", pad=(5,0), layout=[
-           [sg.T("Speed:", pad=((10,0),(0,0)), font=LABEL_FONT),
-                sg.T("0.0",(4,1),
-                     key="-SPEED-",justification="L", font=FONT),
-           sg.T("Distance:", pad=((10,0),(0,0)), font=LABEL_FONT),
-                sg.T("000",(4,1),
-                     key="-DISTANCE-",justification="L", font=FONT)]]),
-           sg.Frame("Workout", pad=(5,0), layout=[
-            [sg.T("Target Power:", pad=((10,0),(0,0)), font=LABEL_FONT),
-                sg.T("0000",(4,1),
-                     key="-TARGET-",justification="L", font=FONT),
-           sg.T("Remaining:", pad=((10,0),(0,0)), font=LABEL_FONT),
-                sg.T("MM:SS",(5,1),
-                     key="-REMAINING-",justification="L", font=FONT)]]),
-           sg.Button('', pad=((5,5),(10,0)), image_data=icons.settings,
-                button_color=(sg.theme_background_color(),sg.theme_background_color()),
-                border_width=0, key="-SETTINGS-")],
-           [sg.Graph(canvas_size=(30,60), graph_bottom_left=(0,0), graph_top_right=(20,60),
-                     background_color="black", key="-BUG-"),
-           sg.Graph(canvas_size=(1000,60), graph_bottom_left=(0,0),
-                     graph_top_right=(1000,60), background_color="black",
-                     key="-PROFILE-")]]
-window = sg.Window("PM Trainer", layout, keep_on_top=True, use_ttk_buttons=True,
-    alpha_channel=0.9, finalize=True, element_padding=(0,0))
-power_bug = BugIndicator(window["-BUG-"])
-power_bug.add_bug("TARGET_POWER", level_percent=0.5, color="blue")
-power_bug.add_bug("CURRENT_POWER", level_percent=0.5,
-                  height_px=20, width_px=25, left=False, color="red")
-
-workout, min_power, max_power = _get_workout_from_config(cfg)
-_plot_workout(window["-PROFILE-"], workout, (min_power, max_power))
-
-log_dir = cfg.get("LogDirectory")
-logfile = _start_log(log_dir)
-
-# Main loop
-t = Timer(replay=REPLAY_MODE, tick_ms=args.speed * UPDATE_RATE_MS)
-if REPLAY_MODE:
-    replay_data = Tcx()
-    replay_data.open_log(args.replay)
-    p = replay_data.get_next_point()
-    t.start(current_time=_convert_string_time(p.time))
-else:
-    t.start()
-
-total_weight_kg = (float(cfg.get("RiderWeightKg"))+float(cfg.get("BikeWeightKg")))
-sim = BikeSim(weight_kg=total_weight_kg)
-
-iters = 0
-avg_hr = None
-avg_power = None
-ftp_watts = float(cfg.get("FTPWatts"))
-last_log_time = t.get_time()
-
-while True:
-    try:
-        # Handle window events
-        event, _ = window.read(timeout=UPDATE_RATE_MS)
-        if event == sg.WIN_CLOSED:
-            if logfile:
-                logfile.flush()
-                time_s, _ = logfile.get_lap_stats()
-                if time_s and float(time_s) > 30:
-                    _upload_activity(cfg, logfile, workout)
-            _exit_app()
-        if event == "-SETTINGS-":
-            settings_dialog_popup(cfg)
-            cfg.write_settings(cfg.get("SettingsFile"))
-            # Update workout plot and start new workout if changed:
-            w_new, min_new, max_new = _get_workout_from_config(cfg)
-            if w_new.name != workout.name:
-                workout, min_power, max_power = w_new, min_new, max_new
-                _plot_workout(window["-PROFILE-"], workout, (min_power, max_power))
-                #TODO: popup asking if we want to restart the workout or continue from the current time
-            # Update log directory and start new log if it's changed:
-            dir_new = cfg.get("LogDirectory")
-            if dir_new != log_dir:
-                log_dir = dir_new
-                logfile = _start_log(log_dir)
-            # Update other values:
-            ftp_watts = float(cfg.get("FTPWatts"))
-            new_total_weight_kg = float(cfg.get("RiderWeightKg"))+float(cfg.get("BikeWeightKg"))
-            if total_weight_kg != new_total_weight_kg:
-                total_weight_kg = new_total_weight_kg
-                sim.weight_kg = new_total_weight_kg
-
-        # Update current time:
-        t.update()
-
-        # Update sensor variables:
-        if not REPLAY_MODE:
-            heartrate = sensors.heartrate_bpm
-            power = sensors.power_watts
-            cadence = sensors.cadence_rpm
-            hr_status = sensors.heart_rate_status
-            pwr_status = sensors.power_meter_status
-        else:
-            while (p is not None) and (
-                (_convert_string_time(p.time) - t.start_time) <= t.get_time()):
-                heartrate = p.heartrate_bpm
-                if heartrate:
-                    hr_status = AntSensors.SensorStatus.State.CONNECTED
-                else:
-                    hr_status = AntSensors.SensorStatus.State.NOTCONNECTED
-                power = p.power_watts
-                if power:
-                    pwr_status = AntSensors.SensorStatus.State.CONNECTED
-                else:
-                    pwr_status = AntSensors.SensorStatus.State.NOTCONNECTED
-                cadence = p.cadence_rpm
-                p = replay_data.get_next_point()
-
-        # Update speed and distance simulator:
-        if pwr_status == AntSensors.SensorStatus.State.CONNECTED:
-            sim.update(power, t.get_time().seconds)
+class TrainerWindow():
+    '''
+    The main window, which displays the state of a TrainerEngine after each step.
+    '''
+    def __init__(self):
+        layout = [[sg.T("HH:MM:SS", (8,1), pad=((20,20),(5,0)),
+                        key="-TIME-",justification="L", font="Helvetica 30"),
+                   sg.Frame("Sensors", pad=(5,0), layout=[
+                   [sg.T("HR:", key="-HR-LABEL-", pad=((10,0),(0,0)), font=LABEL_FONT),
+                        sg.T("000",(3,1),
+                             key="-HEARTRATE-",justification="L", font=FONT),
+                   sg.T("Watts:", key="-PWR-LABEL-", pad=((10,0),(0,0)), font=LABEL_FONT),
+                        sg.T("0000",(4,1),
+                             key="-POWER-",justification="L", font=FONT)]]),
+                   sg.Frame("Performance", pad=(5,0), layout=[
+                   [sg.T("Speed:", pad=((10,0),(0,0)), font=LABEL_FONT),
+                        sg.T("0.0",(4,1),
+                             key="-SPEED-",justification="L", font=FONT),
+                   sg.T("Distance:", pad=((10,0),(0,0)), font=LABEL_FONT),
+                        sg.T("000",(4,1),
+                             key="-DISTANCE-",justification="L", font=FONT)]]),
+                   sg.Frame("Power", pad=(5,0), layout=[
+                   [sg.T("3s:", pad=((10,0),(0,0)), font=LABEL_FONT),
+                        sg.T("0000",(4,1),
+                             key="-POWER-3S-",justification="L", font=FONT),
+                   sg.T("NP:", pad=((10,0),(0,0)), font=LABEL_FONT),
+                        sg.T("0000",(4,1),
+                             key="-NP-",justification="L", font=FONT),
+                   sg.T("IF:", pad=((10,0),(0,0)), font=LABEL_FONT),
+                        sg.T("0.00",(4,1),
+                             key="-IF-",justification="L", font=FONT),
+                   sg.T("TSS:", pad=((10,0),(0,0)), font=LABEL_FONT),
+                        sg.T("000",(3,1),
+                             key="-TSS-",justification="L", font=FONT)]]),
+                   sg.Frame("Workout", pad=(5,0), layout=[
+                    [sg.T("Target Power:", pad=((10,0),(0,0)), font=LABEL_FONT),
+                        sg.T("0000",(4,1),
+                             key="-TARGET-",justification="L", font=FONT),
+                   sg.T("Remaining:", pad=((10,0),(0,0)), font=LABEL_FONT),
+                        sg.T("MM:SS",(5,1),
+                             key="-REMAINING-",justification="L", font=FONT)]]),
+                   sg.Button('', pad=((5,5),(10,0)), image_data=icons.settings,
+                        button_color=(sg.theme_background_color(),sg.theme_background_color()),
+                        border_width=0, key="-SETTINGS-")],
+                   [sg.Graph(canvas_size=(30,60), graph_bottom_left=(0,0), graph_top_right=(20,60),
+                             background_color="black", key="-BUG-"),
+                   sg.Graph(canvas_size=(1000,60), graph_bottom_left=(0,0),
+                             graph_top_right=(1000,60), background_color="black",
+                             key="-PROFILE-")]]
+        self.window = sg.Window("PM Trainer", layout, keep_on_top=True, use_ttk_buttons=True,
+            alpha_channel=0.9, finalize=True, element_padding=(0,0))
+        self.power_bug = BugIndicator(self.window["-BUG-"])
+        self.power_bug.add_bug("TARGET_POWER", level_percent=0.5, color="blue")
+        self.power_bug.add_bug("CURRENT_POWER", level_percent=0.5,
+                               height_px=20, width_px=25, left=False, color="red")
+        self.min_power = None
+        self.max_power = None
+
+    def plot_workout(self, workout, min_power, max_power):
+        '''
+        Plot a new workout profile.
+        '''
+        self.min_power, self.max_power = min_power, max_power
+        _plot_workout(self.window["-PROFILE-"], workout, (min_power, max_power))
+
+    def update(self, engine):
+        '''
+        Update the display from the engine state. Subscribed to the engine.
+        '''
+        window = self.window
+        elapsed_s = engine.elapsed.seconds
 
         # Update text display:
-        window["-HEARTRATE-"].update(heartrate)
-        window["-POWER-"].update(power)
+        window["-HEARTRATE-"].update(engine.heartrate_bpm)
+        window["-POWER-"].update(engine.power_watts)
         window["-TIME-"].update("{:02d}:{:02d}:{:02d}".format(
-            int(t.get_time().seconds/3600) % 24,
-            int(t.get_time().seconds/60) % 60,
-            t.get_time().seconds % 60))
-        window["-SPEED-"].update("{:3.1f}".format(sim.speed_miph))
-        window["-DISTANCE-"].update("{:3.1f}".format(sim.total_distance_mi))
+            int(elapsed_s/3600) % 24,
+            int(elapsed_s/60) % 60,
+            elapsed_s % 60))
+        window["-SPEED-"].update("{:3.1f}".format(engine.sim.speed_miph))
+        window["-DISTANCE-"].update("{:3.1f}".format(engine.sim.total_distance_mi))
+        metrics = engine.metrics
+        if metrics.average_watts(3) is not None:
+            window["-POWER-3S-"].update("{:4.0f}".format(metrics.average_watts(3)))
+        if metrics.normalized_power_watts is not None:
+            window["-NP-"].update("{:4.0f}".format(metrics.normalized_power_watts))
+            window["-IF-"].update("{:4.2f}".format(metrics.intensity_factor))
+            window["-TSS-"].update("{:3.0f}".format(metrics.tss))
 
         # Handle sensor status:
-        _update_sensor_status_indicator(window["-HR-LABEL-"], hr_status)
-        _update_sensor_status_indicator(window["-PWR-LABEL-"], pwr_status)
+        _update_sensor_status_indicator(window["-HR-LABEL-"], engine.heart_rate_status)
+        _update_sensor_status_indicator(window["-PWR-LABEL-"], engine.power_meter_status)
 
         # Update workout params:
-        power_target = workout.power_target(t.get_time().seconds)
-        if power_target is not None:
-            power_target = power_target * ftp_watts
-        window['-TARGET-'].update(
-            " " if power_target is None else "{:4.0f}".format(power_target))
-        remain_s = workout.block_time_remaining(t.get_time().seconds)
+        window['-TARGET-'].update("{:4.0f}".format(engine.power_target_watts))
+        remain_s = engine.block_remaining_s
         window['-REMAINING-'].update("{:2.0f}:{:02.0f}".format(
             int(remain_s / 60) % 60, remain_s % 60))
 
         # Update plot:
-        norm_time = t.get_time().seconds / workout.duration_s
-        if heartrate:
-            if avg_hr is None:
-                avg_hr = heartrate
-            avg_hr = _avg_val(avg_hr, heartrate, avg_window=3)
+        norm_time = elapsed_s / engine.workout.duration_s
+        if engine.heartrate_bpm:
             _plot_trace(window["-PROFILE-"],
-                (norm_time, (avg_hr-HEART_RATE_LIMITS[0])/HEART_RATE_LIMITS[1]),
+                (norm_time, (engine.avg_heartrate_bpm-HEART_RATE_LIMITS[0])/HEART_RATE_LIMITS[1]),
                 (0,0.5), color="cyan")
-        if power:
-            if avg_power is None:
-                avg_power = power
-            avg_power = _avg_val(avg_power, power, avg_window=10)
+        if engine.power_watts:
             _plot_trace(window["-PROFILE-"],
-                (norm_time, avg_power / ftp_watts),
-                (min_power, max_power), color="red")
-
-        # Update power bug
-        if power:
-            power_bug.update("CURRENT_POWER",
-                             (power - float(power_target))/POWER_BUG_LIMITS_WATTS + 0.5)
-
-        # Update log file
-        iters += 1
-        if t.get_time().seconds - last_log_time.seconds >= 1.0:  # Log at 1Hz.
-            if pwr_status == AntSensors.SensorStatus.State.CONNECTED:
-                logfile.add_point(Point(heartrate_bpm=heartrate,
-                                        cadence_rpm=cadence,
-                                        power_watts=power,
-                                        distance_m=sim.total_distance_m,
-                                        speed_mps=sim.speed_mps))
-                logfile.set_lap_stats(total_time_s=t.get_time().seconds, distance_m=sim.total_distance_m)
-                logfile.flush()
-
-    except AntSensors.SensorError as e:
-        if e.err_type == AntSensors.SensorError.ErrorType.USB:
-            print("Could not connect to ANT+ dongle - check USB connection")
-        elif e.err_type == AntSensors.SensorError.ErrorType.TIMEOUT:
-            print("Starting search for sensors again...")
-            sensors.connect()
-            continue
-        else:
-            print("Caught sensor error {}".format(e.err_type))
+                (norm_time, engine.avg_power_watts / engine.ftp_watts),
+                (self.min_power, self.max_power), color="red")
+
+            # Update power bug
+            self.power_bug.update("CURRENT_POWER",
+                (engine.power_watts - engine.power_target_watts)/POWER_BUG_LIMITS_WATTS + 0.5)
+
+def _replay_headless(cfg, fnames, out_dir):
+    '''
+    Replay rides without the GUI, writing regenerated logs and summary stats to out_dir.
+    '''
+    workout, _, _ = _get_workout_from_config(cfg)
+    log_format = cfg.get("LogFormat")
+    for summary in replay_rides(fnames, out_dir, workout,
+            weight_kg=float(cfg.get("RiderWeightKg"))+float(cfg.get("BikeWeightKg")),
+            ftp_watts=float(cfg.get("FTPWatts")), log_format=log_format):
+        print("{}: {} points, {:4.0f} minutes, {:4.1f}miles, replayed in {:4.2f}s".format(
+            summary["output"], summary["points"], summary["time_s"] / 60,
+            summary["distance_m"] / 1609.34, summary["replay_s"]))
+    print("Summary written to {}".format(os.path.join(out_dir, SUMMARY_FILE_NAME)))
+
+def _session_uploader(cfg, workout):
+    '''
+    Returns a function that uploads a session's finished log to Strava, for
+    the session server, or None if Strava isn't connected.
+    '''
+    strava_api = StravaApi(cfg)
+    if not strava_api.is_authed():
+        print("Strava isn't connected, so logs won't be uploaded")
+        return None
+    def upload(session, _):
+        upload_file, data_type = _get_upload_file(cfg, session.engine.logfile.logfile)
+        StravaData(strava_api).upload_activity(activity_file=upload_file, data_type=data_type,
+                                               name="{} ({})".format(workout.name, session.name),
+                                               description=workout.description,
+                                               trainer=True, commute=False,
+                                               activity_type="VirtualRide",
+                                               gear_id="PM Trainer")
+        print("Uploaded {} for {}".format(upload_file, session.name))
+    return upload
+
+def _serve(cfg, num_riders, simulate=False):
+    '''
+    Host a session for each rider without the GUI, until the workout is over.
+    '''
+    # Imported here, so the other modes don't need them:
+    from pmtrainer.ant_sensors import AntSensors
+    from pmtrainer.multi_rider import Rider, SensorManager, CHANNELS_PER_RIDER
+    from pmtrainer.simulated_ant import SimulatedAntDriver
+    if simulate:
+        manager = SensorManager(SimulatedAntDriver(num_devices=num_riders, time_scale=1.0),
+                                max_channels=num_riders * CHANNELS_PER_RIDER)
+    else:
+        manager = SensorManager()
+    workout, _, _ = _get_workout_from_config(cfg)
+    course = _get_course_from_config(cfg)
+    _recover_logs(cfg.get("LogDirectory"))
+    try:
+        for i in range(num_riders):
+            manager.add_rider(Rider("rider{}".format(i + 1)))
+        manager.connect()
+    except (ValueError, AntSensors.SensorError) as e:
+        print("Could not start the server: {}".format(e))
+        return
+    server = SessionServer(log_dir=cfg.get("LogDirectory"), log_format=cfg.get("LogFormat"),
+                           uploader=_session_uploader(cfg, workout))
+    for rider in manager.riders:
+        server.add_session(rider.name, rider, workout,
+            weight_kg=float(cfg.get("RiderWeightKg"))+float(cfg.get("BikeWeightKg")),
+            ftp_watts=float(cfg.get("FTPWatts")), duration_s=workout.duration_s,
+            course=course)
+    print("Hosting {} riders, Ctrl-C to stop".format(num_riders))
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        pass
+    server.close()
+    manager.close()
+    for session in server.sessions:
+        for e in session.upload_errors:
+            print("Upload failed for {}: {}".format(session.name, e))
+    print("Tick latency: " + ", ".join("p{:g} {:.2f}ms".format(p, v * 1000)
+                                       for p, v in server.latency_percentiles().items()))
+
+def main():
+    '''
+    Run the PM Trainer GUI.
+    '''
+    args = _parse_args()
+    cfg = _load_settings()
+    if args.headless:
+        _replay_headless(cfg, args.replay, args.output or cfg.get("LogDirectory"))
+        return
+    if args.server:
+        _serve(cfg, args.server, args.simulate)
+        return
+    if args.import_history:
+        _import_history(cfg, args.import_history)
+        return
+    sg.theme("DarkBlack")
+
+    if args.replay:
+        sensors = ReplaySensors(args.replay[0])
+        start_time = dt.datetime.utcfromtimestamp(sensors.start_time_s)
+        sensor_errors = ()
+    else:
+        sensors = _connect_sensors()
+        start_time = None
+        sensor_errors = type(sensors).SensorError
+
+    gui = TrainerWindow()
+    workout, min_power, max_power = _get_workout_from_config(cfg)
+    gui.plot_workout(workout, min_power, max_power)
+
+    log_dir = cfg.get("LogDirectory")
+    _recover_logs(log_dir)
+    logfile = _start_log(log_dir, cfg.get("LogFormat"))
+    course_file = cfg.get("Course")
+
+    engine = TrainerEngine(sensors, workout, logfile,
+        timer=Timer(replay=bool(args.replay), tick_ms=args.speed * UPDATE_RATE_MS),
+        weight_kg=float(cfg.get("RiderWeightKg"))+float(cfg.get("BikeWeightKg")),
+        ftp_watts=float(cfg.get("FTPWatts")), course=_get_course_from_config(cfg))
+    engine.subscribe(gui.update)
+    engine.start(start_time)
+
+    # Main loop
+    while True:
+        try:
+            # Handle window events
+            event, _ = gui.window.read(timeout=UPDATE_RATE_MS)
+            if event == sg.WIN_CLOSED:
+                if engine.logfile:
+                    engine.logfile.close_log()
+                    time_s, _ = engine.logfile.get_lap_stats()
+                    if time_s and float(time_s) > 30:
+                        history, load = _record_ride(cfg, engine.logfile, engine.workout)
+                        status, activity_id = _upload_activity(cfg, engine.logfile,
+                                                               engine.workout, load)
+                        if history:
+                            history.set_upload_status(engine.logfile.file_name, status,
+                                                      activity_id)
+                            history.close()
+                _exit_app(gui.window, sensors)
+            if event == "-SETTINGS-":
+                settings_dialog_popup(cfg)
+                cfg.write_settings(cfg.get("SettingsFile"))
+                # Update workout plot and start new workout if changed:
+                w_new, min_new, max_new = _get_workout_from_config(cfg)
+                if w_new.name != engine.workout.name:
+                    engine.workout = w_new
+                    gui.plot_workout(w_new, min_new, max_new)
+                    #TODO: popup asking if we want to restart the workout or continue from the current time
+                # Update log directory and start new log if it's changed:
+                dir_new = cfg.get("LogDirectory")
+                if dir_new != log_dir:
+                    log_dir = dir_new
+                    engine.logfile.close_log()
+                    engine.logfile = _start_log(log_dir, cfg.get("LogFormat"))
+                # Update other values:
+                # Change course if it's changed:
+                if cfg.get("Course") != course_file:
+                    course_file = cfg.get("Course")
+                    engine.course = _get_course_from_config(cfg)
+                engine.ftp_watts = float(cfg.get("FTPWatts"))
+                engine.weight_kg = float(cfg.get("RiderWeightKg"))+float(cfg.get("BikeWeightKg"))
+
+            engine.step()
+
+        except sensor_errors as e:
+            if e.err_type == e.ErrorType.USB:
+                print("Could not connect to ANT+ dongle - check USB connection")
+            elif e.err_type == e.ErrorType.TIMEOUT:
+                print("Starting search for sensors again...")
+                sensors.connect()
+                continue
+            else:
+                print("Caught sensor error {}".format(e.err_type))
+
+if __name__ == "__main__":
+    main()
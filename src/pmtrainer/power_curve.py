@@ -0,0 +1,109 @@
+"""
+Mean-maximal power curves: the best average power a ride held for each of
+a set of durations.
+
+For a whole ride, the average over every window of a duration is found at
+once from the differences of a prefix sum of the 1Hz power, so each
+duration is O(n) however long it is. During a ride, the curve is updated
+every second from a rolling sum for each duration, without going back
+over the ride.
+
+Copyright (C) 2021  Robert Ussery
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import math
+import numpy as np
+from pmtrainer.power_metrics import RollingMean
+
+CURVE_DURATIONS_S = (1, 5, 60, 300, 1200, 3600)
+MAX_HOLD_S = 10 # Longest gap between logged points that their power is held across
+
+def resample_1hz(times_s, power_watts, max_hold_s=MAX_HOLD_S):
+    '''
+    Resamples logged power to one value per second from the first point,
+    holding each point's power until the next. Seconds more than max_hold_s
+    after the last point with power (gaps in the log) are zero.
+    '''
+    times_s = np.asarray(times_s, dtype=float)
+    power_watts = np.asarray(power_watts, dtype=float)
+    valid = np.isfinite(times_s) & np.isfinite(power_watts)
+    times_s, power_watts = times_s[valid], power_watts[valid]
+    if len(times_s) == 0:
+        return np.zeros(0)
+    order = np.argsort(times_s, kind="stable")
+    times_s, power_watts = times_s[order] - times_s[order[0]], power_watts[order]
+    seconds = np.arange(int(times_s[-1]) + 1, dtype=float)
+    last = np.searchsorted(times_s, seconds, side="right") - 1
+    return np.where(seconds - times_s[last] < max_hold_s, np.maximum(power_watts[last], 0), 0.0)
+
+def mean_max_power(power_watts, durations_s=CURVE_DURATIONS_S):
+    '''
+    Returns a dict of the best average power for each duration, from 1Hz power
+    (NaN counts as zero). Durations longer than the ride are None.
+    '''
+    power_watts = np.nan_to_num(np.asarray(power_watts, dtype=float))
+    cumulative = np.concatenate(([0.0], np.cumsum(power_watts)))
+    curve = {}
+    for duration_s in durations_s:
+        if duration_s > len(power_watts):
+            curve[duration_s] = None
+        else:
+            sums = cumulative[duration_s:] - cumulative[:-duration_s]
+            curve[duration_s] = float(np.max(sums)) / duration_s
+    return curve
+
+class PowerCurve():
+    '''
+    Mean-maximal power curve of a ride, updated one second of power at a time.
+    '''
+    def __init__(self, durations_s=CURVE_DURATIONS_S):
+        self.durations_s = tuple(durations_s)
+        self._averages = [RollingMean(d) for d in self.durations_s]
+        self.reset()
+
+    def reset(self):
+        '''
+        Starts the curve over, for a new ride.
+        '''
+        for avg in self._averages:
+            avg.clear()
+        self._best = [None] * len(self.durations_s)
+
+    def add(self, power_watts):
+        '''
+        Adds one second of power. Seconds without power (None or NaN) count as zero,
+        so a window can't span a gap with its average overstated.
+        '''
+        if power_watts is None or math.isnan(power_watts):
+            power_watts = 0.0
+        power_watts = max(float(power_watts), 0.0)
+        for i, avg in enumerate(self._averages):
+            avg.add(power_watts)
+            if avg.full and (self._best[i] is None or avg.mean > self._best[i]):
+                self._best[i] = avg.mean
+
+    def best(self, duration_s):
+        '''
+        Returns the best average power for one of the durations, or None until
+        the ride has lasted that long.
+        '''
+        return self._best[self.durations_s.index(duration_s)]
+
+    @property
+    def curve(self):
+        '''
+        Returns a dict of the best average power for each duration.
+        '''
+        return dict(zip(self.durations_s, self._best))
@@ -0,0 +1,129 @@
+"""
+Reconstructs power from the event count and accumulated power in ANT+
+power meter events, so events missed to RF dropouts or a slow reader
+still count towards the average.
+
+Each power event increments the event count (an 8 bit rollover counter)
+and adds its power to the accumulated power (a 16 bit rollover counter),
+so the average power over any run of events, including missed ones, is
+the accumulated power delta divided by the event count delta.
+
+Copyright (C) 2021  Robert Ussery
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import math
+import numpy as np
+
+EVENT_COUNT_ROLLOVER = 256
+ACCUMULATED_POWER_ROLLOVER = 65536
+# Longer gaps could hide a full rollover of the event count (64s at 4Hz):
+MAX_GAP_S = 60.0
+
+def interval_power(event_counts, accumulated_power):
+    '''
+    Returns the number of events and their average power for each interval between
+    consecutive samples, as a tuple of arrays one shorter than the inputs.
+    Intervals with no new events have a power of NaN.
+    '''
+    d_events = np.diff(np.asarray(event_counts, dtype=float)) % EVENT_COUNT_ROLLOVER
+    d_accumulated = np.diff(np.asarray(accumulated_power, dtype=float)) % \
+                    ACCUMULATED_POWER_ROLLOVER
+    power = np.full(len(d_events), np.nan)
+    new = d_events > 0
+    power[new] = d_accumulated[new] / d_events[new]
+    return d_events, power
+
+class PowerReconstructor():
+    '''
+    Follows batches of power meter samples (as drained from a sensor, with "time",
+    "event_count" and "accumulated_power_watts" fields), and reconstructs the
+    average power across them, and a 1Hz power stream.
+    '''
+    def __init__(self, max_gap_s=MAX_GAP_S):
+        self.max_gap_s = max_gap_s
+        self.missed_events = 0
+        # Running totals of all events, and the sum of their powers, without rollover:
+        self.total_events = 0
+        self.total_accumulated_power = 0.0
+        self._last = None # (time, event count, accumulated power) of the last sample
+        self._second = None # Start time of the second being accumulated
+        self._energy_j = 0.0
+        self._covered_s = 0.0
+        self._times = []
+        self._powers = []
+
+    def update(self, samples):
+        '''
+        Adds a batch of samples, and returns the average power over all the events
+        since the previous batch, or None if there were none.
+        '''
+        times = samples["time"]
+        event_counts = samples["event_count"]
+        accumulated = samples["accumulated_power_watts"]
+        valid = np.isfinite(times) & np.isfinite(event_counts) & np.isfinite(accumulated)
+        times, event_counts, accumulated = times[valid], event_counts[valid], accumulated[valid]
+        if len(times) == 0:
+            return None
+        if self._last is not None:
+            times = np.concatenate(([self._last[0]], times))
+            event_counts = np.concatenate(([self._last[1]], event_counts))
+            accumulated = np.concatenate(([self._last[2]], accumulated))
+        self._last = (times[-1], event_counts[-1], accumulated[-1])
+
+        d_events, power = interval_power(event_counts, accumulated)
+        new = d_events > 0
+        if not np.any(new):
+            return None
+        self.missed_events += int(np.sum(d_events[new] - 1))
+        self.total_events += int(np.sum(d_events[new]))
+        self.total_accumulated_power += float(np.sum(d_events[new] * power[new]))
+        for t0, t1, p in zip(times[:-1][new], times[1:][new], power[new]):
+            self._add_interval(t0, t1, np.nan if t1 - t0 > self.max_gap_s else p)
+        return float(np.sum(d_events[new] * power[new]) / np.sum(d_events[new]))
+
+    def _add_interval(self, t0, t1, power):
+        '''
+        Spreads a constant power over the seconds between t0 and t1.
+        '''
+        while t0 < t1:
+            second = math.floor(t0)
+            end = min(t1, second + 1)
+            if second != self._second:
+                self._finish_second()
+                self._second = second
+            if not np.isnan(power):
+                self._energy_j += power * (end - t0)
+                self._covered_s += end - t0
+            if end == second + 1:
+                self._finish_second()
+                self._second = None
+            t0 = end
+
+    def _finish_second(self):
+        if self._second is not None:
+            self._times.append(self._second)
+            self._powers.append(self._energy_j / self._covered_s if self._covered_s else np.nan)
+        self._energy_j = 0.0
+        self._covered_s = 0.0
+
+    def drain_1hz(self):
+        '''
+        Returns the whole seconds completed since the last call, as a tuple of
+        arrays: (start time of each second, average power during it). Seconds in
+        gaps too long to reconstruct have a power of NaN.
+        '''
+        out = (np.array(self._times, dtype=float), np.array(self._powers, dtype=float))
+        self._times, self._powers = [], []
+        return out
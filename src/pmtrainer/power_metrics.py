@@ -0,0 +1,201 @@
+"""
+Live power metrics for a ride: 3s, 10s and 30s average power, Normalized
+Power, Intensity Factor and Training Stress Score.
+
+Metrics are fed one power value per second, and each value is added to
+running sums over circular buffers in O(1), so they can be updated every
+second of a long ride without going back over its history.
+
+Copyright (C) 2021  Robert Ussery
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import math
+import numpy as np
+
+AVERAGE_WINDOWS_S = (3, 10, 30)
+NP_WINDOW_S = 30 # Normalized Power is the 4th-power mean of the 30s rolling average
+
+class RollingMean():
+    '''
+    Mean of the last window values added, kept as a running sum over a
+    circular buffer. The sum is recomputed from the buffer each time it wraps,
+    so rounding errors from adding and removing values don't build up.
+    '''
+    def __init__(self, window):
+        self.window = int(window)
+        self._values = [0.0] * self.window
+        self._index = 0
+        self._count = 0
+        self._sum = 0.0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def full(self):
+        '''
+        True once a whole window of values has been added.
+        '''
+        return self._count == self.window
+
+    @property
+    def mean(self):
+        '''
+        Returns the mean of the values in the window, or None if there aren't any.
+        '''
+        if self._count == 0:
+            return None
+        return self._sum / self._count
+
+    def add(self, value):
+        '''
+        Adds a value, dropping the oldest one if the window is full.
+        '''
+        self._sum += value - self._values[self._index]
+        self._values[self._index] = value
+        self._index += 1
+        if self._index == self.window:
+            self._index = 0
+            self._sum = math.fsum(self._values)
+        if self._count < self.window:
+            self._count += 1
+
+    def clear(self):
+        '''
+        Removes all the values.
+        '''
+        self._values = [0.0] * self.window
+        self._index = 0
+        self._count = 0
+        self._sum = 0.0
+
+class PowerMetrics():
+    '''
+    Power metrics of a ride, updated from a 1Hz power stream. Intensity Factor
+    and TSS are against ftp_watts, which can be changed at any time.
+    '''
+    def __init__(self, ftp_watts=230, windows_s=AVERAGE_WINDOWS_S):
+        self.ftp_watts = ftp_watts
+        self._averages = {w: RollingMean(w) for w in windows_s}
+        self._np_average = RollingMean(NP_WINDOW_S)
+        self.reset()
+
+    @classmethod
+    def from_ride(cls, power_watts, ftp_watts=230):
+        '''
+        Returns the metrics of a whole ride's 1Hz power array, computed all at
+        once with the same results as adding each second. Seconds without power
+        (NaN) are skipped. Only the whole-ride metrics are set, not the rolling averages.
+        '''
+        power_watts = np.asarray(power_watts, dtype=float)
+        power_watts = np.maximum(power_watts[np.isfinite(power_watts)], 0.0)
+        metrics = cls(ftp_watts=ftp_watts)
+        if len(power_watts) == 0:
+            return metrics
+        metrics.duration_s = len(power_watts)
+        metrics.max_power_watts = float(np.max(power_watts))
+        metrics._power_sum = float(np.sum(power_watts))
+        if len(power_watts) >= NP_WINDOW_S:
+            cumulative = np.concatenate(([0.0], np.cumsum(power_watts)))
+            rolling = (cumulative[NP_WINDOW_S:] - cumulative[:-NP_WINDOW_S]) / NP_WINDOW_S
+            metrics._np_sum = float(np.sum(rolling ** 4))
+            metrics._np_count = len(rolling)
+        return metrics
+
+    def reset(self):
+        '''
+        Starts the metrics over, for a new ride.
+        '''
+        for avg in self._averages.values():
+            avg.clear()
+        self._np_average.clear()
+        self.duration_s = 0 # Seconds with power
+        self.max_power_watts = None
+        self._power_sum = 0.0
+        self._np_sum = 0.0 # Sum of the 4th powers of the 30s rolling average
+        self._np_count = 0
+
+    def add(self, power_watts):
+        '''
+        Adds one second of power. Seconds without power (None or NaN) are skipped.
+        '''
+        if power_watts is None or math.isnan(power_watts):
+            return
+        power_watts = max(float(power_watts), 0.0)
+        self.duration_s += 1
+        self._power_sum += power_watts
+        if self.max_power_watts is None or power_watts > self.max_power_watts:
+            self.max_power_watts = power_watts
+        for avg in self._averages.values():
+            avg.add(power_watts)
+        self._np_average.add(power_watts)
+        if self._np_average.full:
+            self._np_sum += self._np_average.mean ** 4
+            self._np_count += 1
+
+    def average_watts(self, window_s):
+        '''
+        Returns the average power over the last window_s seconds (one of the
+        windows the metrics were created with), or None before any power.
+        '''
+        return self._averages[window_s].mean
+
+    @property
+    def avg_power_watts(self):
+        '''
+        Returns the average power over the whole ride, or None before any power.
+        '''
+        if self.duration_s == 0:
+            return None
+        return self._power_sum / self.duration_s
+
+    @property
+    def normalized_power_watts(self):
+        '''
+        Returns the Normalized Power of the ride, or None until the first 30s of power.
+        '''
+        if self._np_count == 0:
+            return None
+        return (self._np_sum / self._np_count) ** 0.25
+
+    @property
+    def intensity_factor(self):
+        '''
+        Returns the Normalized Power as a fraction of FTP, or None until it's known.
+        '''
+        normalized = self.normalized_power_watts
+        if normalized is None or not self.ftp_watts:
+            return None
+        return normalized / self.ftp_watts
+
+    @property
+    def tss(self):
+        '''
+        Returns the Training Stress Score of the ride so far, where an hour at FTP is 100.
+        '''
+        intensity = self.intensity_factor
+        if intensity is None:
+            return None
+        return self.duration_s / 3600 * intensity * intensity * 100
+
+    def summary(self):
+        '''
+        Returns a dict of the whole-ride metrics, with None for any not known yet.
+        '''
+        return {"avg_power_watts": self.avg_power_watts,
+                "max_power_watts": self.max_power_watts,
+                "normalized_power_watts": self.normalized_power_watts,
+                "intensity_factor": self.intensity_factor,
+                "tss": self.tss}
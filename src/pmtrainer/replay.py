@@ -0,0 +1,112 @@
+"""
+Replays logged rides through the trainer engine as fast as possible,
+without a GUI, to regenerate their logs and summary stats.
+
+Copyright (C) 2021  Robert Ussery
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import csv
+import datetime as dt
+import os
+import time
+from xml.etree.ElementTree import ParseError
+import numpy as np
+from pmtrainer.sensors import ReplaySensors
+from pmtrainer.tcx_file import Tcx
+from pmtrainer.trackpoints import format_time
+from pmtrainer.trainer_engine import TrainerEngine, Timer
+
+REPLAY_TICK_S = 0.1
+SUMMARY_FILE_NAME = "replay_summary.csv"
+SUMMARY_FIELDS = ["file", "output", "points", "time_s", "distance_m", "avg_power_watts",
+                  "max_power_watts", "avg_heartrate_bpm", "max_heartrate_bpm", "replay_s"]
+
+def _column_stat(func, values):
+    '''
+    Applies a NumPy reduction to the valid values in a column, or returns None if there are none.
+    '''
+    values = values[~np.isnan(values)]
+    return float(func(values)) if len(values) else None
+
+def replay_output_name(fname, out_dir, log_format="tcx"):
+    '''
+    Returns the name of the regenerated log for a replayed file.
+    '''
+    base = os.path.basename(fname)
+    for ext in [".tcx.gz", ".tcx"]:
+        if base.endswith(ext):
+            base = base[:-len(ext)]
+            break
+    return os.path.join(out_dir, "{}_replay.{}".format(base, log_format))
+
+def replay_ride(fname, out_fname, workout, weight_kg=80, ftp_watts=230, tick_s=REPLAY_TICK_S):
+    '''
+    Replays a logged ride through the trainer engine, writing a regenerated
+    log to out_fname. Returns a dict of summary stats, with keys SUMMARY_FIELDS.
+    '''
+    start = time.perf_counter()
+    sensors = ReplaySensors(fname)
+    logfile = Tcx()
+    logfile.start_log(out_fname, streaming=True)
+    logfile.start_activity(activity_type=Tcx.ActivityType.OTHER,
+                           start_time=format_time(sensors.start_time_s))
+    engine = TrainerEngine(sensors, workout, logfile, timer=Timer(replay=True),
+                           weight_kg=weight_kg, ftp_watts=ftp_watts)
+    engine.start(dt.datetime.utcfromtimestamp(sensors.start_time_s))
+    engine.run(tick_s=tick_s, realtime=False)
+    logfile.close_log()
+    sensors.close()
+
+    time_s, distance_m = logfile.get_lap_stats()
+    power = logfile.trackpoints.column("power_watts")
+    heartrate = logfile.trackpoints.column("heartrate_bpm")
+    return {
+        "file": fname,
+        "output": out_fname,
+        "points": len(logfile.trackpoints),
+        "time_s": float(time_s) if time_s else 0.0,
+        "distance_m": float(distance_m) if distance_m else 0.0,
+        "avg_power_watts": _column_stat(np.mean, power),
+        "max_power_watts": _column_stat(np.max, power),
+        "avg_heartrate_bpm": _column_stat(np.mean, heartrate),
+        "max_heartrate_bpm": _column_stat(np.max, heartrate),
+        "replay_s": time.perf_counter() - start,
+    }
+
+def replay_rides(fnames, out_dir, workout, weight_kg=80, ftp_watts=230, tick_s=REPLAY_TICK_S,
+                 log_format="tcx"):
+    '''
+    Replays a list of logged rides, writing the regenerated logs and a CSV
+    of their summary stats to out_dir. Files that can't be replayed (including
+    truncated compressed logs) are reported and skipped. Returns the list of summaries.
+    '''
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    summaries = []
+    with open(os.path.join(out_dir, SUMMARY_FILE_NAME), "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        for fname in fnames:
+            try:
+                summary = replay_ride(fname, replay_output_name(fname, out_dir, log_format),
+                                      workout, weight_kg=weight_kg, ftp_watts=ftp_watts,
+                                      tick_s=tick_s)
+            except (ValueError, ParseError, EOFError, OSError) as e:
+                print("Could not replay {}: {}".format(fname, e))
+                continue
+            writer.writerow(summary)
+            f.flush()
+            summaries.append(summary)
+    return summaries
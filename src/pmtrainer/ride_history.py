@@ -0,0 +1,343 @@
+"""
+A history of finished rides, kept in an SQLite database so questions about
+past rides don't need every log to be parsed again.
+
+Each ride has a row of summary stats (including its power metrics, workout
+and Strava upload status), indexed by date, workout and power metrics, and
+a row of per-second data, with each column packed into a compressed blob of
+the smallest type that holds it. Existing logs can be imported in a batch,
+which skips logs that are already in the history and haven't changed. The
+training load of all the rides is stored too, and updated as each ride is
+added.
+
+Copyright (C) 2021  Robert Ussery
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import datetime as dt
+import glob
+import os
+import sqlite3
+import zlib
+from enum import Enum
+from xml.etree.ElementTree import ParseError
+import numpy as np
+from pmtrainer.power_metrics import PowerMetrics
+from pmtrainer.tcx_file import Tcx
+from pmtrainer.trackpoints import TrackpointBuffer
+from pmtrainer.training_load import TrainingLoad, ride_day
+from pmtrainer.sample_journal import JOURNAL_EXTENSION
+
+LOG_PATTERNS = ["*.tcx", "*.tcx.gz"]
+# Per-second columns, and the type each is stored as. Missing values are
+# stored as NaN, or the largest value of integer types:
+SAMPLE_COLUMNS = [
+    ("power_watts", "<u2"),
+    ("heartrate_bpm", "u1"),
+    ("cadence_rpm", "u1"),
+    ("speed_mps", "<f4"),
+    ("distance_m", "<f4"),
+    ("altitude_m", "<f4")]
+SUMMARY_COLUMNS = ["file", "file_mtime", "start_time", "duration_s", "distance_m", "workout",
+                   "ftp_watts", "avg_power_watts", "max_power_watts", "normalized_power_watts",
+                   "intensity_factor", "tss", "avg_heartrate_bpm", "max_heartrate_bpm"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rides (
+    id INTEGER PRIMARY KEY,
+    file TEXT UNIQUE NOT NULL,
+    file_mtime REAL,
+    start_time REAL NOT NULL, -- UTC epoch seconds
+    duration_s REAL,
+    distance_m REAL,
+    workout TEXT,
+    ftp_watts REAL,
+    avg_power_watts REAL,
+    max_power_watts REAL,
+    normalized_power_watts REAL,
+    intensity_factor REAL,
+    tss REAL,
+    avg_heartrate_bpm REAL,
+    max_heartrate_bpm REAL,
+    upload_status TEXT NOT NULL DEFAULT 'NOT_UPLOADED',
+    strava_activity_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS samples (
+    ride_id INTEGER PRIMARY KEY REFERENCES rides(id) ON DELETE CASCADE,
+    start_time REAL NOT NULL,
+    length INTEGER NOT NULL,
+    {}
+);
+-- Training load of every ride, kept up to date as rides are added:
+CREATE TABLE IF NOT EXISTS training_load (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    day INTEGER, -- Date ordinal, in local time
+    ctl REAL NOT NULL,
+    atl REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rides_start_time ON rides(start_time);
+CREATE INDEX IF NOT EXISTS rides_workout ON rides(workout, start_time);
+CREATE INDEX IF NOT EXISTS rides_normalized_power ON rides(normalized_power_watts);
+CREATE INDEX IF NOT EXISTS rides_avg_power ON rides(avg_power_watts);
+CREATE INDEX IF NOT EXISTS rides_tss ON rides(tss);
+""".format(",\n    ".join("{} BLOB".format(name) for name, _ in SAMPLE_COLUMNS))
+
+def pack_column(values, dtype):
+    '''
+    Packs an array of floats into a compressed blob of the given type.
+    '''
+    dtype = np.dtype(dtype)
+    values = np.asarray(values, dtype=float)
+    if dtype.kind in "iu":
+        info = np.iinfo(dtype)
+        missing = ~np.isfinite(values)
+        values = np.clip(np.round(np.where(missing, 0, values)), info.min, info.max - 1)
+        values[missing] = info.max
+    return zlib.compress(values.astype(dtype).tobytes())
+
+def unpack_column(blob, dtype):
+    '''
+    Unpacks a blob made by pack_column() into an array of floats, with NaN for missing values.
+    '''
+    dtype = np.dtype(dtype)
+    values = np.frombuffer(zlib.decompress(blob), dtype=dtype)
+    if dtype.kind in "iu":
+        missing = values == np.iinfo(dtype).max
+        values = values.astype(float)
+        values[missing] = np.nan
+        return values
+    return values.astype(float)
+
+def per_second(times_s, values):
+    '''
+    Returns an array of the values by whole second from the first time,
+    with NaN for seconds without a value.
+    '''
+    times_s = np.asarray(times_s, dtype=float)
+    index = np.round(times_s - times_s[0]).astype(int)
+    out = np.full(index[-1] + 1 if len(index) else 0, np.nan)
+    valid = index >= 0
+    out[index[valid]] = np.asarray(values, dtype=float)[valid]
+    return out
+
+def _epoch_s(time):
+    '''
+    Converts a datetime (naive datetimes are UTC) to UTC epoch seconds, or
+    returns epoch seconds unchanged.
+    '''
+    if isinstance(time, dt.datetime):
+        if time.tzinfo is None:
+            time = time.replace(tzinfo=dt.timezone.utc)
+        return time.timestamp()
+    return time
+
+def read_ride(fname, ftp_watts=230, workout=None):
+    '''
+    Reads a log, and returns its summary (a dict of SUMMARY_COLUMNS) and its
+    per-second data (the start time, and a dict of arrays of SAMPLE_COLUMNS).
+    Raises ValueError if the log has no points.
+    '''
+    log = Tcx()
+    log.open_log(fname, streaming=True)
+    points = TrackpointBuffer()
+    point = log.get_next_point()
+    while point is not None:
+        if point.time is not None:
+            points.append(point)
+        point = log.get_next_point()
+    if len(points) == 0:
+        raise ValueError("No points in {}".format(fname))
+    times = points.column("time")
+    order = np.argsort(times, kind="stable")
+    times = times[order]
+    columns = {name: per_second(times, points.column(name)[order])
+               for name, _ in SAMPLE_COLUMNS}
+
+    heartrate = columns["heartrate_bpm"]
+    has_heartrate = np.any(np.isfinite(heartrate))
+    summary = {
+        "file": os.path.abspath(fname),
+        "file_mtime": os.path.getmtime(fname),
+        "start_time": float(times[0]),
+        "duration_s": float(times[-1] - times[0]),
+        "distance_m": float(np.nanmax(columns["distance_m"]))
+                      if np.any(np.isfinite(columns["distance_m"])) else None,
+        "workout": workout,
+        "ftp_watts": ftp_watts,
+        "avg_heartrate_bpm": float(np.nanmean(heartrate)) if has_heartrate else None,
+        "max_heartrate_bpm": float(np.nanmax(heartrate)) if has_heartrate else None,
+    }
+    summary.update(PowerMetrics.from_ride(columns["power_watts"], ftp_watts).summary())
+    return summary, (float(times[0]), columns)
+
+class RideHistory():
+    '''
+    The ride history database in db_file, created if it doesn't exist.
+    '''
+    class UploadStatus(Enum):
+        '''
+        Whether a ride has been uploaded to Strava
+        '''
+        NOT_UPLOADED = 1
+        UPLOADED = 2
+        FAILED = 3
+        DISCARDED = 4
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        if os.path.dirname(db_file) and not os.path.exists(os.path.dirname(db_file)):
+            os.makedirs(os.path.dirname(db_file))
+        self.db = sqlite3.connect(db_file)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        '''
+        Closes the database.
+        '''
+        self.db.close()
+
+    def _insert(self, summary, samples):
+        '''
+        Adds or replaces a ride, without committing. Returns its id.
+        '''
+        old = self.db.execute("SELECT start_time, tss FROM rides WHERE file = ?",
+                              (summary["file"],)).fetchone()
+        load = self._stored_load()
+        if load is not None:
+            if old is not None:
+                load.add(ride_day(old["start_time"]), -(old["tss"] or 0))
+            load.add(ride_day(summary["start_time"]), summary["tss"] or 0)
+            self._store_load(load)
+        self.db.execute("DELETE FROM rides WHERE file = ?", (summary["file"],))
+        cursor = self.db.execute("INSERT INTO rides ({}) VALUES ({})".format(
+            ", ".join(SUMMARY_COLUMNS), ", ".join("?" * len(SUMMARY_COLUMNS))),
+            [summary[c] for c in SUMMARY_COLUMNS])
+        ride_id = cursor.lastrowid
+        start_time, columns = samples
+        self.db.execute("INSERT INTO samples VALUES ({})".format(
+            ", ".join("?" * (len(SAMPLE_COLUMNS) + 3))),
+            [ride_id, start_time, len(columns["power_watts"])] +
+            [pack_column(columns[name], dtype) for name, dtype in SAMPLE_COLUMNS])
+        return ride_id
+
+    def add_ride(self, fname, ftp_watts=230, workout=None):
+        '''
+        Reads a finished ride's log and adds it to the history, replacing it if
+        it's already there. Returns the ride's id.
+        '''
+        summary, samples = read_ride(fname, ftp_watts=ftp_watts, workout=workout)
+        with self.db:
+            return self._insert(summary, samples)
+
+    def import_logs(self, log_dir, ftp_watts=230):
+        '''
+        Adds every log in log_dir that isn't already in the history, or has changed
+        since it was added, in one transaction. Logs that can't be read (including
+        truncated compressed logs) are reported and skipped. Returns the list of files added.
+        '''
+        fnames = sorted(f for pattern in LOG_PATTERNS
+                        for f in glob.glob(os.path.join(log_dir, pattern))
+                        if not f.endswith(JOURNAL_EXTENSION))
+        known = dict(self.db.execute("SELECT file, file_mtime FROM rides").fetchall())
+        added = []
+        with self.db:
+            for fname in fnames:
+                if known.get(os.path.abspath(fname)) == os.path.getmtime(fname):
+                    continue
+                try:
+                    summary, samples = read_ride(fname, ftp_watts=ftp_watts)
+                except (ValueError, ParseError, EOFError, OSError) as e:
+                    print("Could not import {}: {}".format(fname, e))
+                    continue
+                self._insert(summary, samples)
+                added.append(fname)
+        return added
+
+    def _stored_load(self):
+        row = self.db.execute("SELECT day, ctl, atl FROM training_load").fetchone()
+        return TrainingLoad(row["day"], row["ctl"], row["atl"]) if row else None
+
+    def _store_load(self, load):
+        self.db.execute("INSERT OR REPLACE INTO training_load VALUES (1, ?, ?, ?)",
+                        (load.day, load.ctl, load.atl))
+
+    def training_load(self, day=None):
+        '''
+        Returns the training load of every ride in the history at the end of a
+        day (a date ordinal, today if None), which can't be before the last ride.
+        The load is computed from all the rides the first time, and kept up to
+        date as rides are added after that.
+        '''
+        load = self._stored_load()
+        if load is None:
+            rows = self.db.execute("SELECT start_time, tss FROM rides").fetchall()
+            load = TrainingLoad.from_rides([ride_day(r["start_time"]) for r in rows],
+                                           [r["tss"] for r in rows])
+            with self.db:
+                self._store_load(load)
+        if day is None:
+            day = max(dt.date.today().toordinal(), load.day or 0)
+        return load.at(day)
+
+    def set_upload_status(self, fname, status, activity_id=None):
+        '''
+        Records whether a ride's log has been uploaded, and its Strava activity id.
+        '''
+        assert isinstance(status, RideHistory.UploadStatus)
+        with self.db:
+            self.db.execute(
+                "UPDATE rides SET upload_status = ?, strava_activity_id = ? WHERE file = ?",
+                (status.name, activity_id, os.path.abspath(fname)))
+
+    def ride(self, fname):
+        '''
+        Returns the summary of the ride from a log as a dict, or None if it isn't in the history.
+        '''
+        row = self.db.execute("SELECT * FROM rides WHERE file = ?",
+                              (os.path.abspath(fname),)).fetchone()
+        return dict(row) if row else None
+
+    def rides(self, start=None, end=None, workout=None):
+        '''
+        Returns the summaries of the rides that started between start and end
+        (UTC datetimes or epoch seconds, either optional), optionally only of
+        one workout, oldest first.
+        '''
+        where, args = [], []
+        for op, value in [(">=", start), ("<", end)]:
+            if value is not None:
+                where.append("start_time {} ?".format(op))
+                args.append(_epoch_s(value))
+        if workout is not None:
+            where.append("workout = ?")
+            args.append(workout)
+        query = "SELECT * FROM rides{} ORDER BY start_time".format(
+            " WHERE " + " AND ".join(where) if where else "")
+        return [dict(row) for row in self.db.execute(query, args)]
+
+    def samples(self, ride_id):
+        '''
+        Returns the per-second data of a ride, as the start time (UTC epoch
+        seconds) and a dict of arrays, or None if there's no such ride.
+        '''
+        row = self.db.execute("SELECT * FROM samples WHERE ride_id = ?", (ride_id,)).fetchone()
+        if row is None:
+            return None
+        return row["start_time"], {name: unpack_column(row[name], dtype)
+                                   for name, dtype in SAMPLE_COLUMNS}
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM rides").fetchone()[0]
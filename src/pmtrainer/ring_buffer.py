@@ -0,0 +1,90 @@
+"""
+A bounded ring buffer of timestamped sensor samples, for handing samples
+from a sensor thread to the main loop without losing any between reads.
+
+Copyright (C) 2021  Robert Ussery
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import threading
+import time
+import numpy as np
+
+class RingBuffer():
+    '''
+    Holds up to capacity samples in a preallocated NumPy structured array, with
+    a "time" field (UTC epoch seconds) followed by the given fields. Samples can
+    be pushed from one thread and drained from another. When the buffer is full,
+    the oldest samples are overwritten and counted as dropped.
+    '''
+    def __init__(self, fields, capacity=256):
+        self.dtype = np.dtype([("time", "f8")] + [(f, "f8") for f in fields])
+        self._capacity = max(int(capacity), 1)
+        self._data = np.zeros(self._capacity, dtype=self.dtype)
+        self._head = 0 # Index of the next sample to write
+        self._count = 0
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def capacity(self):
+        '''
+        Returns the maximum number of samples held.
+        '''
+        return self._capacity
+
+    @property
+    def dropped(self):
+        '''
+        Returns the total number of samples overwritten before being drained.
+        '''
+        return self._dropped
+
+    def push(self, *values, time_s=None):
+        '''
+        Adds a sample, with one value per field (None is stored as NaN),
+        timestamped now unless time_s is given.
+        '''
+        row = (time.time() if time_s is None else time_s,) + tuple(
+            np.nan if v is None else v for v in values)
+        with self._lock:
+            self._data[self._head] = row
+            self._head = (self._head + 1) % self._capacity
+            if self._count == self._capacity:
+                self._dropped += 1
+            else:
+                self._count += 1
+
+    def drain(self):
+        '''
+        Removes and returns all samples as a structured array, oldest first.
+        '''
+        with self._lock:
+            start = (self._head - self._count) % self._capacity
+            if start + self._count <= self._capacity:
+                out = self._data[start:start + self._count].copy()
+            else:
+                out = np.concatenate((self._data[start:], self._data[:self._head]))
+            self._count = 0
+        return out
+
+    def clear(self):
+        '''
+        Discards all samples.
+        '''
+        with self._lock:
+            self._count = 0
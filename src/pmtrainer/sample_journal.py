@@ -0,0 +1,127 @@
+"""
+An append-only binary journal of logged samples, used to rebuild a log
+after a crash.
+
+Each sample is written as a fixed-size record, so the journal can be
+read back with a single NumPy call, and a record left partially written
+by a crash is simply ignored.
+
+Copyright (C) 2021  Robert Ussery
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import os
+import numpy as np
+from pmtrainer.trackpoints import COLUMNS, TrackpointBuffer, parse_time
+
+JOURNAL_EXTENSION = ".journal"
+MAGIC = b"PMTJ"
+VERSION = 1
+FSYNC_INTERVAL = 10 # Records between forcing the journal to disk
+
+# One record per sample, little endian. Fields that need the precision
+# (time, position, distance) are doubles, the rest are single floats.
+RECORD_DTYPE = np.dtype([(c, "<f8" if c in ["time", "lat_deg", "lon_deg", "distance_m"]
+                          else "<f4") for c in COLUMNS])
+HEADER = MAGIC + np.array([VERSION, RECORD_DTYPE.itemsize], dtype="<u2").tobytes()
+
+class SampleJournal():
+    '''
+    Appends samples to a journal file, forcing them to disk periodically.
+    '''
+    class JournalError(Exception):
+        '''
+        Exceptions for sample journals.
+        '''
+        def __init__(self, message=""):
+            super().__init__(message)
+
+    def __init__(self, fname, fsync_interval=FSYNC_INTERVAL):
+        self.file_name = fname
+        self._fsync_interval = fsync_interval
+        self._unsynced = 0
+        self._record = np.zeros(1, dtype=RECORD_DTYPE)
+        self._file = open(fname, "wb")
+        self._file.write(HEADER)
+        self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def append(self, point):
+        '''
+        Appends a Point to the journal. Missing values are stored as NaN.
+        '''
+        for c in COLUMNS:
+            val = getattr(point, c)
+            if val is None:
+                val = np.nan
+            elif c == "time":
+                val = parse_time(val)
+            self._record[c] = val
+        self._file.write(self._record.tobytes())
+        self._file.flush() # Hand the record to the OS, so it survives a crash of this process
+        self._unsynced += 1
+        if self._unsynced >= self._fsync_interval:
+            self._sync()
+
+    def close(self, remove=True):
+        '''
+        Closes the journal, and removes it unless told not to.
+        '''
+        if self._file:
+            self._file.close()
+            self._file = None
+        if remove and os.path.exists(self.file_name):
+            os.remove(self.file_name)
+
+    @staticmethod
+    def journal_name(log_name):
+        '''
+        Returns the journal file name for a log file.
+        '''
+        return log_name + JOURNAL_EXTENSION
+
+    @staticmethod
+    def find_unfinished(directory):
+        '''
+        Returns a list of the journals left in a directory, which are only
+        left behind when a log wasn't closed cleanly.
+        '''
+        if not os.path.isdir(directory):
+            return []
+        return sorted(os.path.join(directory, f) for f in os.listdir(directory)
+                      if f.endswith(JOURNAL_EXTENSION))
+
+    @staticmethod
+    def read(fname):
+        '''
+        Reads all complete records from a journal into a TrackpointBuffer.
+        '''
+        with open(fname, "rb") as f:
+            data = f.read()
+        if data[:len(MAGIC)] != MAGIC:
+            raise SampleJournal.JournalError("{} is not a sample journal".format(fname))
+        if len(data) < len(HEADER):
+            # A crash while the header was being written:
+            raise SampleJournal.JournalError("{} has an incomplete header".format(fname))
+        version, record_size = np.frombuffer(data, dtype="<u2", count=2, offset=len(MAGIC))
+        if version != VERSION or record_size != RECORD_DTYPE.itemsize:
+            raise SampleJournal.JournalError(
+                "Unsupported journal version {} in {}".format(version, fname))
+        count = (len(data) - len(HEADER)) // RECORD_DTYPE.itemsize
+        records = np.frombuffer(data, dtype=RECORD_DTYPE, count=count, offset=len(HEADER))
+        return TrackpointBuffer.from_columns({c: records[c] for c in COLUMNS})
@@ -0,0 +1,179 @@
+"""
+Sensor status tracking, and a sensor source that replays a logged ride.
+
+Sensor sources provide the heartrate_bpm, power_watts, cadence_rpm,
+heart_rate_status and power_meter_status properties, and an update()
+method that is called with the elapsed ride time before they are read.
+They can also buffer every sensor event, and return them in batches from
+drain_power_samples() and drain_heartrate_samples().
+
+Copyright (C) 2021  Robert Ussery
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from datetime import datetime as dt
+from enum import Enum
+from pmtrainer.ring_buffer import RingBuffer
+from pmtrainer.tcx_file import Tcx
+from pmtrainer.trackpoints import parse_time
+
+# Fields of the buffered sensor samples, after their "time" field:
+POWER_SAMPLE_FIELDS = ["event_count", "cadence_rpm", "accumulated_power_watts",
+                       "instantaneous_power_watts"]
+HEARTRATE_SAMPLE_FIELDS = ["heartrate_bpm", "event_time_ms", "rr_interval_ms"]
+
+class SensorStatus():
+    """
+    Tracks the status of a sensor device, whether it's connected
+    and if its data is fresh.
+    """
+    class State(Enum):
+        """
+        State of a sensor
+        """
+        NOTCONNECTED = 1
+        CONNECTED = 2
+        STALE = 3
+
+    def __init__(self, fresh_time_s=15):
+        self._connected = False
+        self._last_seen_time = None
+        self._fresh_time_s = fresh_time_s
+
+    def make_fresh(self):
+        """ Marks the sensor as connected and makes last seen time now"""
+        self._connected = True
+        self._last_seen_time = dt.now()
+
+    def make_disconnected(self):
+        """ Marks the sensor as disconnceted"""
+        self._connected = False
+
+    @property
+    def state(self):
+        """ Returns the state of the sensor
+        Returns:
+            SensorStatus.State representing current state
+        """
+        if not self._connected:
+            _s = self.State.NOTCONNECTED
+        elif (self._last_seen_time and
+              (dt.now() - self._last_seen_time).total_seconds() > self._fresh_time_s):
+            _s = self.State.STALE
+        else:
+            _s = self.State.CONNECTED
+        return _s
+
+class ReplaySensors():
+    """
+    Replays the heartrate, power and cadence from a TCX log as if they came
+    from sensors. A sensor is connected while the log has data for it.
+    """
+    def __init__(self, fname):
+        self._log = Tcx()
+        self._log.open_log(fname, streaming=True)
+        self._next_point = self._log.get_next_point()
+        if self._next_point is None:
+            raise ValueError("No points to replay in {}".format(fname))
+        self.start_time_s = parse_time(self._next_point.time)
+        self._heartrate_bpm = None
+        self._power_watts = None
+        self._cadence_rpm = None
+        self._power_samples = RingBuffer(POWER_SAMPLE_FIELDS)
+        self._heartrate_samples = RingBuffer(HEARTRATE_SAMPLE_FIELDS)
+
+    def update(self, elapsed_s):
+        """
+        Moves through the log to the last point at or before the elapsed time,
+        buffering a sample for each point passed.
+        """
+        while self._next_point is not None:
+            point_time_s = parse_time(self._next_point.time)
+            if point_time_s - self.start_time_s > elapsed_s:
+                break
+            self._heartrate_bpm = self._next_point.heartrate_bpm
+            self._power_watts = self._next_point.power_watts
+            self._cadence_rpm = self._next_point.cadence_rpm
+            if self._power_watts:
+                self._power_samples.push(None, self._cadence_rpm, None, self._power_watts,
+                                         time_s=point_time_s)
+            if self._heartrate_bpm:
+                self._heartrate_samples.push(self._heartrate_bpm, None, None,
+                                             time_s=point_time_s)
+            self._next_point = self._log.get_next_point()
+
+    def drain_power_samples(self):
+        """
+        Returns the power samples replayed since the last call.
+        """
+        return self._power_samples.drain()
+
+    def drain_heartrate_samples(self):
+        """
+        Returns the heartrate samples replayed since the last call.
+        """
+        return self._heartrate_samples.drain()
+
+    def close(self):
+        """
+        Releases the replayed log.
+        """
+        self._next_point = None
+        self._log = None
+
+    @property
+    def finished(self):
+        """
+        True once every point in the log has been replayed.
+        """
+        return self._next_point is None
+
+    @property
+    def heartrate_bpm(self):
+        """
+        Returns the replayed heartrate in beats per minute (BPM), or None.
+        """
+        return self._heartrate_bpm
+
+    @property
+    def power_watts(self):
+        """
+        Returns the replayed power in Watts, or None.
+        """
+        return self._power_watts
+
+    @property
+    def cadence_rpm(self):
+        """
+        Returns the replayed cadence in RPM, or None.
+        """
+        return self._cadence_rpm
+
+    @property
+    def heart_rate_status(self):
+        """
+        Returns status of the replayed heart rate sensor.
+        """
+        if self._heartrate_bpm:
+            return SensorStatus.State.CONNECTED
+        return SensorStatus.State.NOTCONNECTED
+
+    @property
+    def power_meter_status(self):
+        """
+        Returns status of the replayed power meter.
+        """
+        if self._power_watts:
+            return SensorStatus.State.CONNECTED
+        return SensorStatus.State.NOTCONNECTED
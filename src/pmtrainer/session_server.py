@@ -0,0 +1,325 @@
+"""
+Hosts many rider sessions in one process, stepping them all together on a
+fixed-rate scheduler.
+
+Each session has its own trainer engine (with its own workout and log) and
+its own queue of finished logs to upload. The sessions' bike sims are
+riders of a BikeSimBatch shared by every session on the same course, so
+every tick updates each batch's speeds and distances in one vectorized
+step, rather than one session at a time. Log writes are handed to a pool
+of writer threads, so slow disks don't hold up the tick. Like the single
+rider logs, each log has a sample journal, so it can be rebuilt by
+recover_journal() if the server crashes.
+Each log is always written by the same writer thread, so its writes stay
+in order.
+
+Copyright (C) 2021  Robert Ussery
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import datetime as dt
+import os
+import queue
+import threading
+import time
+import numpy as np
+from pmtrainer.bike_sim import BikeSimBatch
+from pmtrainer.tcx_file import Tcx
+from pmtrainer.trainer_engine import TrainerEngine, Timer, step_engines
+
+SERVER_TICK_S = 0.1
+WRITER_WORKERS = 2
+LATENCY_PERCENTILES = (50, 90, 99, 99.9)
+
+class WriterPool():
+    '''
+    Runs file writes on a pool of worker threads. Writes with the same key
+    always go to the same worker, so they happen in the order submitted.
+    '''
+    def __init__(self, num_workers=WRITER_WORKERS):
+        self.errors = [] # Exceptions raised by writes
+        self._queues = [queue.Queue() for _ in range(max(int(num_workers), 1))]
+        self._workers = {} # Key -> worker index
+        self._threads = [threading.Thread(target=self._work, args=(q,), daemon=True)
+                         for q in self._queues]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, key, func, *args, **kwargs):
+        '''
+        Queues func(*args, **kwargs) on the worker for key.
+        '''
+        if key not in self._workers:
+            self._workers[key] = len(self._workers) % len(self._queues)
+        self._queues[self._workers[key]].put((func, args, kwargs))
+
+    def release(self, key):
+        '''
+        Forgets the worker for key, once it has no more writes.
+        '''
+        self._workers.pop(key, None)
+
+    def join(self):
+        '''
+        Waits for every queued write to finish.
+        '''
+        for q in self._queues:
+            q.join()
+
+    def close(self):
+        '''
+        Finishes every queued write and stops the workers.
+        '''
+        for q in self._queues:
+            q.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self, q):
+        while True:
+            job = q.get()
+            try:
+                if job is None:
+                    return
+                func, args, kwargs = job
+                func(*args, **kwargs)
+            except Exception as e: # pylint: disable=broad-except
+                self.errors.append(e)
+            finally:
+                q.task_done()
+
+class PooledLog():
+    '''
+    Stands in for a log in a trainer engine, handing its writes to a writer pool.
+    '''
+    def __init__(self, logfile, pool):
+        self.logfile = logfile
+        self.file_name = logfile.file_name
+        self.closed = threading.Event() # Set once the log has been closed
+        self._pool = pool
+
+    def add_point(self, point):
+        '''
+        Queues a point to be added to the log.
+        '''
+        self._pool.submit(self, self.logfile.add_point, point)
+
+    def set_lap_stats(self, total_time_s=None, distance_m=None):
+        '''
+        Queues an update of the lap stats.
+        '''
+        self._pool.submit(self, self.logfile.set_lap_stats, total_time_s=total_time_s,
+                          distance_m=distance_m)
+
+    def set_lap_metrics(self, **metrics):
+        '''
+        Queues an update of the lap power metrics.
+        '''
+        self._pool.submit(self, self.logfile.set_lap_metrics, **metrics)
+
+    def flush(self):
+        '''
+        Queues a flush of the log to disk.
+        '''
+        self._pool.submit(self, self.logfile.flush)
+
+    def close_log(self):
+        '''
+        Queues closing the log. Its lap stats can be read once closed is set.
+        '''
+        self._pool.submit(self, self.logfile.close_log)
+        self._pool.submit(self, self.closed.set)
+        self._pool.release(self)
+
+    def get_lap_stats(self):
+        '''
+        Returns the lap stats of the log, once all its writes are done.
+        '''
+        return self.logfile.get_lap_stats()
+
+class Session():
+    '''
+    One rider's session on the server.
+    '''
+    def __init__(self, name, engine, duration_s=None):
+        self.name = name
+        self.engine = engine
+        self.duration_s = duration_s
+        self.uploads = queue.Queue() # Logs waiting to be uploaded
+        self.uploaded = []
+        self.upload_errors = []
+        self.active = True
+
+    @property
+    def done(self):
+        '''
+        True once the session has lasted its duration, or its sensors have run out of data.
+        '''
+        if getattr(self.engine.sensors, "finished", False):
+            return True
+        return (self.duration_s is not None and
+                self.engine.elapsed.total_seconds() >= self.duration_s)
+
+class SessionServer():
+    '''
+    Steps many sessions together every tick_s seconds, logging to log_dir.
+    Finished logs are uploaded by calling uploader(session, file_name) from
+    a background thread, if an uploader is given.
+    '''
+    def __init__(self, log_dir=None, tick_s=SERVER_TICK_S, writer_workers=WRITER_WORKERS,
+                 uploader=None, log_format="tcx"):
+        self.log_dir = log_dir
+        self.tick_s = tick_s
+        self.log_format = log_format
+        self.uploader = uploader
+        self.sessions = []
+        self.sims = {} # Course (None for flat) -> BikeSimBatch of its sessions' sims
+        self.writers = WriterPool(writer_workers)
+        self.tick_latencies_s = [] # Time spent in each tick
+        self.overruns = 0 # Ticks skipped because a tick took too long
+        self._running = False
+        self._upload_ready = queue.Queue() # Sessions with logs to upload
+        self._upload_thread = None
+        if uploader:
+            self._upload_thread = threading.Thread(target=self._upload, daemon=True)
+            self._upload_thread.start()
+
+    def add_session(self, name, sensors, workout, weight_kg=80, ftp_watts=230,
+                    duration_s=None, start_time=None, replay=False, course=None):
+        '''
+        Starts a session for a rider, at start_time (a naive UTC datetime) if
+        given or now, riding course if given or else a flat road. With replay,
+        the session's timer only advances by the ticks it's stepped, instead of
+        following the clock.
+        '''
+        logfile = None
+        if self.log_dir:
+            if not os.path.exists(self.log_dir):
+                os.makedirs(self.log_dir)
+            tcx = Tcx()
+            tcx.start_log(os.path.join(self.log_dir, "{}_{}.{}".format(
+                dt.datetime.now().strftime("%Y%m%d_%H%M%S"), name, self.log_format)),
+                streaming=True, journal=True)
+            tcx.start_activity(activity_type=Tcx.ActivityType.OTHER)
+            logfile = PooledLog(tcx, self.writers)
+        if course not in self.sims:
+            self.sims[course] = BikeSimBatch(course=course)
+        engine = TrainerEngine(sensors, workout, logfile,
+                               timer=Timer(replay=replay, tick_ms=self.tick_s * 1000),
+                               ftp_watts=ftp_watts,
+                               sim=self.sims[course].add_rider(weight_kg))
+        engine.start(start_time)
+        session = Session(name, engine, duration_s)
+        self.sessions.append(session)
+        return session
+
+    def end_session(self, session):
+        '''
+        Stops stepping a session, closes its log and queues it for upload.
+        '''
+        if not session.active:
+            return
+        session.active = False
+        session.engine.sim.release()
+        if session.engine.logfile:
+            session.engine.logfile.close_log()
+            session.uploads.put(session.engine.logfile.file_name)
+            if self.uploader:
+                self._upload_ready.put(session)
+
+    @property
+    def active_sessions(self):
+        '''
+        Returns the sessions still being stepped.
+        '''
+        return [s for s in self.sessions if s.active]
+
+    def tick(self, dt_s=None):
+        '''
+        Steps every active session once, by dt_s seconds if given, and ends any
+        that are done. The sims of all the sessions on a course are updated together.
+        '''
+        start = time.perf_counter()
+        active = self.active_sessions
+        step_engines([session.engine for session in active], dt_s)
+        for session in active:
+            if session.done:
+                self.end_session(session)
+        self.tick_latencies_s.append(time.perf_counter() - start)
+
+    def stop(self):
+        '''
+        Stops run() after the current tick.
+        '''
+        self._running = False
+
+    def run(self, duration_s=None, realtime=True):
+        '''
+        Ticks every tick_s seconds until stop() is called, every session has
+        ended, or the server has run for duration_s. Ticks that can't start on
+        time are skipped and counted as overruns, rather than run late. Without
+        realtime, ticks run back to back, each advancing the sessions by tick_s.
+        '''
+        self._running = True
+        ticks = 0
+        next_tick = time.monotonic()
+        while self._running and self.active_sessions:
+            self.tick(None if realtime else self.tick_s)
+            ticks += 1
+            if duration_s is not None and ticks * self.tick_s >= duration_s:
+                break
+            if realtime:
+                next_tick += self.tick_s
+                late_s = time.monotonic() - next_tick
+                if late_s > 0:
+                    skipped = int(late_s // self.tick_s) + 1
+                    self.overruns += skipped
+                    next_tick += skipped * self.tick_s
+                time.sleep(max(next_tick - time.monotonic(), 0))
+        self._running = False
+
+    def latency_percentiles(self, percentiles=LATENCY_PERCENTILES):
+        '''
+        Returns a dict of tick latency percentiles, in seconds.
+        '''
+        if not self.tick_latencies_s:
+            return {}
+        values = np.percentile(self.tick_latencies_s, percentiles)
+        return dict(zip(percentiles, (float(v) for v in values)))
+
+    def close(self):
+        '''
+        Ends every session, and waits for their logs to be written and uploaded.
+        '''
+        for session in self.sessions:
+            self.end_session(session)
+        self.writers.close()
+        if self._upload_thread:
+            self._upload_ready.put(None)
+            self._upload_thread.join()
+
+    def _upload(self):
+        while True:
+            session = self._upload_ready.get()
+            if session is None:
+                return
+            # Logs are only complete once their writes are done:
+            session.engine.logfile.closed.wait()
+            while not session.uploads.empty():
+                file_name = session.uploads.get()
+                try:
+                    self.uploader(session, file_name)
+                    session.uploaded.append(file_name)
+                except Exception as e: # pylint: disable=broad-except
+                    session.upload_errors.append(e)
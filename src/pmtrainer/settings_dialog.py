@@ -20,8 +20,9 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import os
 import PySimpleGUI as sg
 from pmtrainer.profile_plotter import plot_blocks
-from pmtrainer.workout_profile import Workout
+from pmtrainer.workout_library import get_library
 from pmtrainer.strava_api import StravaApi, StravaData
+from pmtrainer.ride_history import RideHistory
 
 def _validate_int_range(val, val_name, val_range, error_list):
     '''
@@ -37,11 +38,26 @@ def _validate_int_range(val, val_name, val_range, error_list):
             val_name, val, val_range[0], val_range[-1]))
 
 def _set_workout_fields(window, workout_path):
-    wkt = Workout(workout_path)
+    wkt = get_library().get(workout_path)
     window["-WKT-NAME-"].update("Name: " + wkt.name)
     window["-WKT-DUR-"].update("Duration: {:d}min".format(int(wkt.duration_s / 60)))
     window["-WKT-DESC-"].update(wkt.description)
 
+def _training_load_text(config):
+    '''
+    Describes today's training load from the ride history, if there is one.
+    '''
+    try:
+        history_file = config.get("HistoryFile")
+    except KeyError:
+        history_file = None
+    if not history_file or not os.path.isfile(history_file):
+        return "No ride history yet"
+    history = RideHistory(history_file)
+    load = history.training_load()
+    history.close()
+    return "Fitness {:.0f}, fatigue {:.0f}, form {:+.0f}".format(load.ctl, load.atl, load.tsb)
+
 def set_strava_status(window, strava):
     if strava.is_authed():
         athlete_name = StravaData(strava).get_athlete_name()
@@ -109,15 +125,13 @@ def workout_selection_popup(workout_path):
     and allow the user to select one.
     '''
 
-    # Find all the valid workout files:
+    # Find all the valid workout files, including those in subdirectories:
     workout_dir = os.path.dirname(workout_path)
-    all_files = os.listdir(workout_dir)
+    all_workouts, errors = get_library().scan(workout_dir or ".", recursive=True)
     workouts = {}
-    for f in all_files:
-        if f.endswith(".yaml"):
-            wpath = workout_dir + "/" + f
-            w = Workout(wpath)
-            workouts[w.name] = {"workout": w, "path": wpath}
+    for abs_path, w in all_workouts.items():
+        wpath = os.path.join(workout_dir, os.path.relpath(abs_path, os.path.abspath(workout_dir)))
+        workouts[w.name] = {"workout": w, "path": wpath}
 
     # Create a window with frames for each workout file:
     layout = []
@@ -139,6 +153,10 @@ def workout_selection_popup(workout_path):
                            enable_events=True)]])
                     ]])
         layout.extend([[frame]])
+    if errors:
+        layout.extend([[sg.T("Skipped {} invalid workout file(s)".format(len(errors)),
+                             tooltip="\n".join("{}: {}".format(os.path.relpath(p), err)
+                                               for p, err in errors.items()))]])
     layout.extend([[sg.B("Select", key="-SELECT-", bind_return_key=True),
                     sg.B("Cancel", key="-CANCEL-")]])
     window = sg.Window("Select a Workout", layout,
@@ -187,7 +205,8 @@ def settings_dialog_popup(config):
                 initial_value=config.get("RiderWeightKg"), size=(5,1)) ],
               [sg.T("Bike kilograms:", (12,1)),
               sg.Spin(values=list(WEIGHT_RANGE), key="-BIKE-KG-",
-                initial_value=config.get("BikeWeightKg"), size=(5,1)) ]],
+                initial_value=config.get("BikeWeightKg"), size=(5,1)) ],
+              [sg.T(_training_load_text(config), (30,1), key="-LOAD-")]],
               vertical_alignment="t"),
         sg.Frame("Workout",
             [[sg.T("name", (30,1), key="-WKT-NAME-"), sg.B("Select", key="-WKT-SEL-BTTN-")],
@@ -0,0 +1,346 @@
+"""
+A simulated ANT+ driver, for running AntSensors without a dongle or sensors.
+
+The driver broadcasts synthetic heart rate and bicycle power pages from any
+number of simulated devices, at configurable page rates, with timing jitter
+and dropped pages. Each channel opened on it searches for, and pairs with,
+the first unpaired device of its type (or with a given device number), as
+an ANT+ search would, and the pages are delivered to the same callbacks as
+python-ant's devices.
+
+Time runs time_scale times faster than the clock, with pages sent from a
+background thread like the ANT node's message thread. Without a time scale
+the driver is stepped by AntSensors.update() instead, so a ride can be
+simulated as fast as the engine can step, and the results are repeatable
+for a given seed.
+
+Copyright (C) 2021  Robert Ussery
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import heapq
+import random
+import threading
+import time
+from collections import namedtuple
+from enum import Enum
+from pmtrainer.ant_sensors import HEARTRATE_DEVICE_TYPE, POWER_DEVICE_TYPE
+
+# Channel periods of the ANT+ device profiles, in 1/32768s:
+HEARTRATE_PAGE_HZ = 32768 / 8070
+POWER_PAGE_HZ = 32768 / 8182
+EVENT_COUNT_ROLLOVER = 256
+ACCUMULATED_POWER_ROLLOVER = 65536
+
+ChannelID = namedtuple("ChannelID", ["deviceNumber", "deviceType", "transmissionType"])
+
+class ChannelState(Enum):
+    """
+    State of a simulated channel
+    """
+    CLOSED = 1
+    SEARCHING = 2
+    TRACKING = 3
+
+class SimulatedChannel():
+    """
+    A channel opened on the simulated driver, standing in for python-ant's
+    HeartRate and BicyclePower devices.
+    """
+    def __init__(self, ant_driver, device_type, name, callbacks):
+        self.driver = ant_driver
+        self.device_type = device_type
+        self.name = name
+        self.callbacks = callbacks
+        self.state = None
+        self.device = None # The simulated device paired with, once found
+        self.device_number = 0 # Device number searched for, or 0 for any
+        self.search_deadline_s = None
+
+    def open(self, searchTimeout=30, device_number=0):
+        """
+        Starts searching for a device, for up to searchTimeout seconds.
+        """
+        self.driver.open_channel(self, searchTimeout, device_number)
+
+    def close(self):
+        """
+        Closes the channel, releasing any paired device.
+        """
+        self.driver.close_channel(self)
+
+    def _callback(self, name, *args):
+        callback = self.callbacks.get(name)
+        if callback:
+            callback(*args)
+
+class SimulatedDevice():
+    """
+    A simulated sensor, which broadcasts a page each time it's sent.
+    """
+    def __init__(self, device_number, device_type, page_hz, rng):
+        self.device_number = device_number
+        self.device_type = device_type
+        self.page_hz = page_hz
+        self.rng = rng
+        self.channel = None
+        # Power meter state:
+        self.event_count = 0
+        self.accumulated_power_watts = 0
+        # Heart rate monitor state:
+        self.beat_time_s = 0.0
+        self.next_beat_s = None
+        self.rr_interval_s = None
+
+    @property
+    def channel_id(self):
+        '''
+        Returns the ChannelID reported when the device is paired.
+        '''
+        return ChannelID(self.device_number, self.device_type, 1)
+
+    def power_page(self, power_watts, cadence_rpm):
+        '''
+        Counts a new power event, and returns its page as the arguments of onPowerData.
+        '''
+        power_watts = max(int(round(power_watts)), 0)
+        self.event_count = (self.event_count + 1) % EVENT_COUNT_ROLLOVER
+        self.accumulated_power_watts = (self.accumulated_power_watts + power_watts) % \
+                                       ACCUMULATED_POWER_ROLLOVER
+        return (self.event_count, None, max(int(round(cadence_rpm)), 0),
+                self.accumulated_power_watts, power_watts)
+
+    def heartrate_page(self, t_s, heartrate_bpm):
+        '''
+        Counts any beats up to t_s, and returns the page as the arguments of onHeartRateData.
+        '''
+        if self.next_beat_s is None:
+            self.next_beat_s = t_s
+        while self.next_beat_s <= t_s:
+            self.rr_interval_s = 60.0 / max(heartrate_bpm, 1)
+            self.beat_time_s = self.next_beat_s
+            self.next_beat_s += self.rr_interval_s
+        return (int(round(heartrate_bpm)), int(self.beat_time_s * 1000),
+                int(self.rr_interval_s * 1000))
+
+class SimulatedAntDriver():
+    """
+    Simulated ANT+ stack, with the same methods as ant_sensors.UsbAntDriver.
+
+    The power and heartrate are either constants or functions of the simulated
+    time in seconds, with Gaussian noise added to every page. Page intervals
+    vary uniformly by up to jitter_s, and each page is dropped with probability
+    dropout, although power meters still count the events of dropped pages.
+    """
+    def __init__(self, num_devices=1, power_watts=200, heartrate_bpm=140, cadence_rpm=90,
+                 power_noise_watts=10, heartrate_noise_bpm=1, cadence_noise_rpm=2,
+                 power_page_hz=POWER_PAGE_HZ, heartrate_page_hz=HEARTRATE_PAGE_HZ,
+                 jitter_s=0.005, dropout=0.0, time_scale=None, seed=None):
+        self.power_watts = power_watts
+        self.heartrate_bpm = heartrate_bpm
+        self.cadence_rpm = cadence_rpm
+        self.power_noise_watts = power_noise_watts
+        self.heartrate_noise_bpm = heartrate_noise_bpm
+        self.cadence_noise_rpm = cadence_noise_rpm
+        self.jitter_s = jitter_s
+        self.dropout = dropout
+        self.time_scale = time_scale
+        self.rng = random.Random(seed)
+        self.devices = []
+        for i in range(num_devices):
+            self.devices.append(SimulatedDevice(
+                1000 + i, POWER_DEVICE_TYPE, power_page_hz, self.rng))
+            self.devices.append(SimulatedDevice(
+                2000 + i, HEARTRATE_DEVICE_TYPE, heartrate_page_hz, self.rng))
+        self.channels = []
+        self.pages_sent = 0
+        self.pages_dropped = 0
+        self.errors = [] # Exceptions raised by callbacks
+        self.start_epoch_s = time.time()
+        self._now_s = 0.0 # Simulated time since start
+        self._start_monotonic = None
+        self._schedule = [] # Heap of (time, sequence, device) pages to send
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts the devices broadcasting, from a background thread if there's a time scale.
+        """
+        with self._lock:
+            self._schedule = []
+            for seq, device in enumerate(self.devices):
+                heapq.heappush(self._schedule, (
+                    self._now_s + self.rng.uniform(0, 1.0 / device.page_hz), seq, device))
+        if self.time_scale and self._thread is None:
+            self._start_monotonic = time.monotonic() - self._now_s / self.time_scale
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """
+        Stops broadcasting.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def heart_rate(self, callbacks):
+        """
+        Returns a heart rate monitor channel, calling back to callbacks.
+        """
+        return self._add_channel(HEARTRATE_DEVICE_TYPE, "heart rate", callbacks)
+
+    def power_meter(self, callbacks):
+        """
+        Returns a bicycle power meter channel, calling back to callbacks.
+        """
+        return self._add_channel(POWER_DEVICE_TYPE, "bicycle power", callbacks)
+
+    def _add_channel(self, device_type, name, callbacks):
+        channel = SimulatedChannel(self, device_type, name, callbacks)
+        with self._lock:
+            self.channels.append(channel)
+        return channel
+
+    @staticmethod
+    def open_device(device, search_timeout_s, device_number=0):
+        """
+        Opens a device channel, searching for the given device number,
+        or any device of its type if it's 0.
+        """
+        device.open(searchTimeout=search_timeout_s, device_number=device_number)
+
+    @staticmethod
+    def close_device(device):
+        """
+        Closes a device channel, if it's open.
+        """
+        if device.state and device.state != ChannelState.CLOSED:
+            device.close()
+
+    def open_channel(self, channel, search_timeout_s, device_number=0):
+        """
+        Starts a channel searching for a device.
+        """
+        with self._lock:
+            channel.state = ChannelState.SEARCHING
+            channel.device_number = device_number
+            channel.search_deadline_s = self._now_s + search_timeout_s
+
+    def close_channel(self, channel):
+        """
+        Closes a channel and releases its device.
+        """
+        with self._lock:
+            if channel.device is not None:
+                channel.device.channel = None
+                channel.device = None
+            channel.state = ChannelState.CLOSED
+            self._call(channel, "onChannelClosed", channel)
+
+    def clock(self):
+        """
+        Returns the simulated time, in UTC epoch seconds.
+        """
+        if self.time_scale and self._start_monotonic is not None:
+            return self.start_epoch_s + (time.monotonic() - self._start_monotonic) * \
+                   self.time_scale
+        return self.start_epoch_s + self._now_s
+
+    def update(self, elapsed_s):
+        """
+        Without a time scale, sends every page up to elapsed_s seconds after the start.
+        """
+        if not self.time_scale:
+            self._send_until(elapsed_s)
+
+    def _run(self):
+        while not self._stop.is_set():
+            now_s = (time.monotonic() - self._start_monotonic) * self.time_scale
+            next_s = self._send_until(now_s)
+            self._stop.wait(max(next_s - now_s, 0) / self.time_scale)
+
+    def _send_until(self, t_s):
+        '''
+        Sends every page and search timeout due by t_s, and returns the time of the next one.
+        '''
+        with self._lock:
+            while self._schedule and self._schedule[0][0] <= t_s:
+                page_s, seq, device = heapq.heappop(self._schedule)
+                self._now_s = page_s
+                self._check_searches(page_s)
+                self._send_page(device, page_s)
+                interval_s = 1.0 / device.page_hz + self.rng.uniform(-self.jitter_s,
+                                                                     self.jitter_s)
+                heapq.heappush(self._schedule, (page_s + max(interval_s, 0), seq, device))
+            self._now_s = max(self._now_s, t_s)
+            self._check_searches(self._now_s)
+            next_s = self._schedule[0][0] if self._schedule else t_s + 1
+            for channel in self.channels:
+                if channel.state == ChannelState.SEARCHING:
+                    next_s = min(next_s, channel.search_deadline_s)
+            return next_s
+
+    def _check_searches(self, t_s):
+        for channel in self.channels:
+            if channel.state == ChannelState.SEARCHING and channel.search_deadline_s < t_s:
+                channel.state = ChannelState.CLOSED
+                self._call(channel, "onSearchTimeout", channel)
+
+    def _send_page(self, device, t_s):
+        if device.channel is None:
+            # Pair with a channel searching for this device number, or else the
+            # first channel searching for any device of this type:
+            searching = [c for c in self.channels if c.state == ChannelState.SEARCHING and
+                         c.device_type == device.device_type and
+                         c.device_number in (0, device.device_number)]
+            searching.sort(key=lambda c: c.device_number != device.device_number)
+            if searching:
+                channel = searching[0]
+                channel.state = ChannelState.TRACKING
+                channel.device = device
+                device.channel = channel
+                self._call(channel, "onDevicePaired", channel, device.channel_id)
+        if device.device_type == POWER_DEVICE_TYPE:
+            page = device.power_page(
+                self._value(self.power_watts, t_s, self.power_noise_watts),
+                self._value(self.cadence_rpm, t_s, self.cadence_noise_rpm))
+            callback = "onPowerData"
+        else:
+            page = device.heartrate_page(
+                t_s, self._value(self.heartrate_bpm, t_s, self.heartrate_noise_bpm))
+            callback = "onHeartRateData"
+        if device.channel is None:
+            return
+        if self.rng.random() < self.dropout:
+            self.pages_dropped += 1
+            return
+        self.pages_sent += 1
+        self._call(device.channel, callback, *page)
+
+    def _value(self, value, t_s, noise):
+        if callable(value):
+            value = value(t_s)
+        return value + self.rng.gauss(0, noise) if noise else value
+
+    def _call(self, channel, name, *args):
+        # Like the ANT node's message thread, carry on if a callback raises:
+        try:
+            channel._callback(name, *args)
+        except Exception as e: # pylint: disable=broad-except
+            self.errors.append(e)
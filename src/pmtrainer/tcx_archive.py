@@ -0,0 +1,139 @@
+"""
+Converts a directory of TCX logs into NumPy .npz archives, one per log with
+one array per Trackpoint field, so analysis code can load a year of rides
+without parsing any XML.
+
+Logs are read with the streaming Tcx reader, so memory use doesn't grow
+with the length of a ride, and converted in parallel across a pool of
+processes. Logs whose archive is newer than the log are skipped, so
+converting the log directory again only converts new or changed logs.
+
+Run as pmtrainer-convert LOG_DIR, or load archives with load_archive().
+
+Copyright (C) 2021  Robert Ussery
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import argparse
+import concurrent.futures
+import glob
+import os
+from xml.etree.ElementTree import ParseError
+import numpy as np
+from pmtrainer.ride_history import LOG_PATTERNS
+from pmtrainer.sample_journal import JOURNAL_EXTENSION
+from pmtrainer.tcx_file import Tcx
+from pmtrainer.trackpoints import COLUMNS, TrackpointBuffer
+
+ARCHIVE_EXTENSION = ".npz"
+# Columns that need more precision than float32, which everything else is stored as:
+FLOAT64_COLUMNS = ["time", "lat_deg", "lon_deg"]
+
+def archive_name(fname, out_dir):
+    '''
+    Returns the name of the archive for a log in out_dir: the log's whole file
+    name plus .npz, so ride.tcx and ride.tcx.gz don't share an archive.
+    '''
+    return os.path.join(out_dir, os.path.basename(fname) + ARCHIVE_EXTENSION)
+
+def is_converted(fname, out_fname):
+    '''
+    True if out_fname exists and is newer than the log fname.
+    '''
+    return (os.path.exists(out_fname) and
+            os.path.getmtime(out_fname) >= os.path.getmtime(fname))
+
+def read_columns(fname):
+    '''
+    Streams the Trackpoints from all activities in a log, and returns a dict
+    of an array for each column, with NaN for missing values.
+    '''
+    log = Tcx()
+    log.open_log(fname, streaming=True)
+    points = TrackpointBuffer()
+    point = log.get_next_point()
+    while point is not None:
+        points.append(point)
+        point = log.get_next_point()
+    return {c: points.column(c).astype(np.float64 if c in FLOAT64_COLUMNS else np.float32)
+            for c in COLUMNS}
+
+def convert_log(fname, out_fname):
+    '''
+    Converts a log to an archive. The archive is written to a temporary file
+    first, so a conversion that fails part way can't leave an archive that
+    looks newer than the log.
+    '''
+    columns = read_columns(fname)
+    tmp_fname = out_fname + ".tmp"
+    try:
+        with open(tmp_fname, "wb") as f:
+            np.savez_compressed(f, **columns)
+        os.replace(tmp_fname, out_fname)
+    finally:
+        if os.path.exists(tmp_fname):
+            os.remove(tmp_fname) # The save failed
+    return out_fname
+
+def convert_dir(log_dir, out_dir=None, workers=None):
+    '''
+    Converts every log in log_dir that hasn't already been converted, or has
+    changed since, into an archive in out_dir (log_dir if None), across a pool
+    of workers processes (one per CPU if None). Logs that can't be read are
+    reported and skipped. Returns the list of archives written.
+    '''
+    out_dir = out_dir or log_dir
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    jobs = [(f, archive_name(f, out_dir))
+            for f in sorted(f for pattern in LOG_PATTERNS
+                            for f in glob.glob(os.path.join(log_dir, pattern))
+                            if not f.endswith(JOURNAL_EXTENSION))]
+    jobs = [(f, out) for f, out in jobs if not is_converted(f, out)]
+    converted = []
+    if not jobs:
+        return converted
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(convert_log, f, out): f for f, out in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                converted.append(future.result())
+            except (OSError, EOFError, ValueError, ParseError) as e:
+                print("Could not convert {}: {}".format(futures[future], e))
+    return sorted(converted)
+
+def load_archive(fname):
+    '''
+    Loads an archive, and returns a dict of an array for each column.
+    '''
+    with np.load(fname) as archive:
+        return {c: archive[c] for c in archive.files}
+
+def main():
+    '''
+    Convert a directory of TCX logs to archives from the command line.
+    '''
+    parser = argparse.ArgumentParser(
+        description="Convert a directory of TCX logs to NumPy .npz archives")
+    parser.add_argument("log_dir", help="Directory of TCX logs")
+    parser.add_argument("-o", "--output", default=None,
+                        help="Directory for the archives (default: the log directory)")
+    parser.add_argument("-j", "--jobs", default=None, type=int,
+                        help="Number of processes (default: one per CPU)")
+    args = parser.parse_args()
+    converted = convert_dir(args.log_dir, args.output, args.jobs)
+    print("Converted {} log(s) into {}".format(len(converted), args.output or args.log_dir))
+
+if __name__ == "__main__":
+    main()
@@ -17,10 +17,20 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
+import gzip
+import os
+import re
+import zlib
 import xml.etree.ElementTree as et
 from xml.dom import minidom
+from xml.sax.saxutils import quoteattr
 from enum import Enum
 from datetime import datetime as dt
+import numpy as np
+from pmtrainer.trackpoints import TrackpointBuffer, format_time, parse_time
+from pmtrainer.fit_file import write_fit
+from pmtrainer.power_curve import mean_max_power, resample_1hz, CURVE_DURATIONS_S
+from pmtrainer.sample_journal import SampleJournal, JOURNAL_EXTENSION
 
 NAMESPACES = {
     "": "http://www.garmin.com/xmlschemas/TrainingCenterDatabase/v2",
@@ -30,12 +40,133 @@ NAMESPACES = {
     "xsi": "http://www.w3.org/2001/XMLSchema-instance"
 }
 
+TRACKPOINT_TAG = "{{{}}}Trackpoint".format(NAMESPACES[""])
+# Maps the tags found inside a Trackpoint to Point attributes, and their types:
+POINT_FIELDS = {
+    "{{{}}}{}".format(NAMESPACES[ns], tag): field for ns, tag, field in [
+        ("", "Time", ("time", str)),
+        ("", "LatitudeDegrees", ("lat_deg", float)),
+        ("", "LongitudeDegrees", ("lon_deg", float)),
+        ("", "AltitudeMeters", ("altitude_m", float)),
+        ("", "DistanceMeters", ("distance_m", float)),
+        ("", "Value", ("heartrate_bpm", int)), # Only appears inside HeartRateBpm
+        ("", "Cadence", ("cadence_rpm", int)),
+        ("ns3", "Speed", ("speed_mps", float)),
+        ("ns3", "Watts", ("power_watts", int))]}
+
+READ_CHUNK_BYTES = 64 * 1024
+GZIP_LEVEL = 6 # Level 9 is barely smaller for xml, and much slower
+GZIP_SYNC_FLUSHES = 10 # Make compressed data readable every this many flushes
+INDENT = "    "
+TRACKPOINT_LEVEL = 5 # Depth of Trackpoints: TrainingCenterDatabase/Activities/Activity/Lap/Track
+# Order of the lap stats written after the Track:
+LAP_FIELDS = ["TotalTimeSeconds", "DistanceMeters", "Notes", "Extensions"]
+LAP_NOTES_FORMAT = "NP {:.0f}W, IF {:.2f}, TSS {:.1f}"
+LAP_NOTES_PATTERN = re.compile(r"NP (\d+)W, IF ([\d.]+), TSS ([\d.]+)")
+
 def _time_stamp():
     '''
     Returns a UTC timestamp string
     '''
     return dt.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
 
+def _point_element(point):
+    '''
+    Creates a Trackpoint element from a Point.
+    '''
+    point_record = et.Element("Trackpoint")
+    et.SubElement(point_record, "Time").text = point.time
+    if (point.lat_deg is not None) and (point.lon_deg is not None):
+        position = et.SubElement(point_record, "Position")
+        et.SubElement(position, "LatitudeDegrees").text = str(point.lat_deg)
+        et.SubElement(position, "LongitudeDegrees").text = str(point.lon_deg)
+    if point.altitude_m is not None:
+        et.SubElement(point_record, "AltitudeMeters").text = str(point.altitude_m)
+    if point.distance_m is not None:
+        et.SubElement(point_record, "DistanceMeters").text = str(point.distance_m)
+    if point.heartrate_bpm is not None:
+        hr = et.SubElement(point_record, "HeartRateBpm")
+        et.SubElement(hr, "Value").text = str(point.heartrate_bpm)
+    if point.cadence_rpm is not None:
+        et.SubElement(point_record, "Cadence").text = str(point.cadence_rpm)
+    if (point.speed_mps is not None) or (point.power_watts is not None):
+        ext = et.SubElement(et.SubElement(point_record, "Extensions"),"TPX")
+        ext.set("xmlns", "http://www.garmin.com/xmlschemas/ActivityExtension/v2")
+        if point.speed_mps is not None:
+            et.SubElement(ext, "Speed").text = str(point.speed_mps)
+        if point.power_watts is not None:
+            et.SubElement(ext, "Watts").text = str(point.power_watts)
+    return point_record
+
+def _indent(elem, level=0):
+    '''
+    Indents an element and its children in place, matching the layout
+    that minidom's toprettyxml produces for the whole document.
+    '''
+    if len(elem):
+        elem.text = "\n" + INDENT * (level + 1)
+        for child in elem:
+            _indent(child, level + 1)
+            child.tail = "\n" + INDENT * (level + 1)
+        child.tail = "\n" + INDENT * level
+
+def _serialize(elem, level):
+    '''
+    Returns a pretty-printed line (or lines) of xml for an element at the given depth.
+    '''
+    _indent(elem, level)
+    elem.tail = None
+    return INDENT * level + et.tostring(elem, encoding="unicode") + "\n"
+
+def _start_tag(elem, level):
+    '''
+    Returns the opening tag of an element, including its attributes.
+    '''
+    attrs = "".join(" {}={}".format(k, quoteattr(v)) for k, v in elem.items())
+    return "{}<{}{}>\n".format(INDENT * level, elem.tag, attrs)
+
+def _end_tag(tag, level):
+    '''
+    Returns the closing tag of an element.
+    '''
+    return "{}</{}>\n".format(INDENT * level, tag)
+
+def _open_file(fname, mode):
+    '''
+    Opens a log file, compressing or decompressing it if it's a .gz file.
+    '''
+    if fname.endswith(".gz"):
+        return gzip.open(fname, mode, compresslevel=GZIP_LEVEL)
+    return open(fname, mode)
+
+def repair_log(fname):
+    '''
+    Repairs a log that was left incomplete by a crash while streaming, by
+    dropping any partially written Trackpoint and closing all open tags.
+    Compressed logs are read up to the last sync point.
+    Returns True if the file needed repairing.
+    '''
+    with open(fname, "rb") as f:
+        data = f.read()
+    if fname.endswith(".gz"):
+        # Unlike gzip.open(), this doesn't fail on a truncated file:
+        data = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS).decompress(data)
+    if data.rstrip().endswith(b"</TrainingCenterDatabase>"):
+        return False
+    end = data.rfind(b"</Trackpoint>")
+    if end >= 0:
+        end += len(b"</Trackpoint>")
+    else:
+        end = data.find(b"<Track>")
+        if end < 0:
+            raise ValueError("No Track found in {}".format(fname))
+        end += len(b"<Track>")
+    trailer = "\n" + "".join(_end_tag(tag, level) for level, tag in reversed(list(enumerate(
+        ["TrainingCenterDatabase", "Activities", "Activity", "Lap", "Track"]))))
+    with _open_file(fname, "wb") as f:
+        f.write(data[:end] + trailer.encode("utf-8"))
+    return True
+
 class Point():
     '''
     Holds all the possible data for a TCX TrackPoint, and implements
@@ -76,6 +207,65 @@ class Point():
 
         return out
 
+def _point_from_record(point_record):
+    '''
+    Creates a Point from a Trackpoint element, with a single pass over its children.
+    '''
+    point = Point()
+    for elem in point_record.iter():
+        field = POINT_FIELDS.get(elem.tag)
+        if field and elem.text is not None:
+            setattr(point, field[0], field[1](elem.text))
+    if point.lat_deg is None or point.lon_deg is None:
+        point.lat_deg, point.lon_deg = None, None # Only valid as a pair
+    return point
+
+class _TrackpointTarget():
+    '''
+    XMLParser target that collects Points from Trackpoint tags as they are parsed.
+    '''
+    def __init__(self):
+        self.points = []
+        self._point = None
+        self._field = None
+        self._text = []
+
+    def start(self, tag, _):
+        '''
+        Starts a new Point, or starts collecting text for one of its fields.
+        '''
+        if tag == TRACKPOINT_TAG:
+            self._point = Point()
+        elif self._point is not None:
+            self._field = POINT_FIELDS.get(tag)
+            self._text = []
+
+    def data(self, text):
+        '''
+        Collects text for the current field.
+        '''
+        if self._field:
+            self._text.append(text)
+
+    def end(self, tag):
+        '''
+        Sets the field that just ended, or finishes off the current Point.
+        '''
+        if self._field:
+            name, conv = self._field
+            setattr(self._point, name, conv("".join(self._text)))
+            self._field = None
+        elif tag == TRACKPOINT_TAG:
+            if self._point.lat_deg is None or self._point.lon_deg is None:
+                self._point.lat_deg, self._point.lon_deg = None, None
+            self.points.append(self._point)
+            self._point = None
+
+    def close(self):
+        '''
+        Called by the parser when done.
+        '''
+
 class Tcx():
     '''
     Creates a TCX xml tree, allows adding points to it, and handles
@@ -97,17 +287,69 @@ class Tcx():
         self.current_lap = None
         self.current_track = None
         self.points = None
+        self.trackpoints = TrackpointBuffer()
+        self._loaded_activity = None
+        self._reader = None
+        self._stream = None
+        self._compressed = False
+        self._trailer_pos = None
+        self._written = 0
+        self._flush_count = 0
+        self._journal = None
 
-    def open_log(self, fname):
+    def open_log(self, fname, streaming=False):
         '''
-        Opens an existing log file for reading or writing
+        Opens an existing log file for reading or writing.
+        If streaming is set, the file is read incrementally by get_next_point()
+        instead of being loaded into memory. Streamed files are read-only, and
+        return the Trackpoints from all activities and laps in file order.
         '''
-        self.tcx = et.parse(fname).getroot()
         self.file_name = fname
+        self.activity = None
+        self.current_lap = None
+        self.current_track = None
+        self.points = None
+        self.trackpoints.clear()
+        self._loaded_activity = None
+        if streaming:
+            open(fname, "rb").close() # Fail now, rather than on the first read
+            self.tcx = None
+            self._reader = self._iter_points()
+        else:
+            with _open_file(fname, "rb") as f:
+                self.tcx = et.parse(f).getroot()
+            self._reader = None
+
+    def _iter_points(self):
+        '''
+        Generator that parses the file a chunk at a time, building Points directly
+        from the parser events without creating an element tree, so memory use
+        doesn't grow with file size.
+        '''
+        target = _TrackpointTarget()
+        parser = et.XMLParser(target=target)
+        with _open_file(self.file_name, "rb") as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK_BYTES), b""):
+                parser.feed(chunk)
+                yield from target.points
+                target.points = []
+        parser.close()
+        yield from target.points
 
-    def start_log(self, fname):
+    def start_log(self, fname, streaming=False, journal=False):
         '''
-        Starts a new log
+        Starts a new log.
+        If streaming is set, the file is kept open and each flush() only appends
+        the Trackpoints added since the last flush, rather than rewriting the
+        whole document. The closing tags and lap stats are rewritten after the
+        new points on every flush, so the file on disk is always complete.
+        If fname ends in .gz the log is gzip compressed. Compressed logs can't be
+        rewritten, so when streaming the closing tags and lap stats are only
+        written by close_log(). A sync point is written every GZIP_SYNC_FLUSHES
+        flushes, and repair_log() can recover everything up to the last one.
+        If journal is set, every point is also appended to a binary sample journal
+        as it's added, which is removed by close_log(). If the log isn't closed
+        cleanly, recover_journal() will rebuild it from the journal.
         '''
         self.tcx = et.Element("TrainingCenterDatabase")
         for prefix, uri in NAMESPACES.items():
@@ -120,6 +362,16 @@ class Tcx():
         self.current_track = None
         self.current_lap = None
         self.points = None
+        self.trackpoints.clear()
+        self._reader = None
+        self._written = 0
+        self._flush_count = 0
+        self._trailer_pos = None
+        self._compressed = fname.endswith(".gz")
+        if streaming:
+            self._stream = _open_file(fname, "wb")
+        if journal:
+            self._journal = SampleJournal(SampleJournal.journal_name(fname))
 
     @property
     def activities(self):
@@ -134,47 +386,122 @@ class Tcx():
         '''
         self.activity = self.activities.findall("Activity", NAMESPACES)[activity_index]
 
-    def start_activity(self, activity_type):
+    def start_activity(self, activity_type, start_time=None):
         '''
-        Starts an activity, track and lap.
+        Starts an activity, track and lap. The activity Id is its start time,
+        which is now unless a timestamp string is given.
         Assumes only one track and lap per activity.
         TODO: handle multiple tracks and laps?
         '''
         assert isinstance(activity_type, Tcx.ActivityType)
         self.activity.set("Sport", activity_type.name)
-        et.SubElement(self.activity, "Id").text = _time_stamp()
+        et.SubElement(self.activity, "Id").text = start_time if start_time else _time_stamp()
         self.current_lap = et.SubElement(self.activity, "Lap")
         self.current_track = et.SubElement(self.current_lap, "Track")
+        if self._stream:
+            self._write_header()
+
+    def _header(self):
+        '''
+        Returns the xml for everything up to and including the opening Track tag.
+        '''
+        header = '<?xml version="1.0" ?>\n'
+        header += _start_tag(self.tcx, 0)
+        header += _start_tag(self.tcx.find("Activities"), 1)
+        header += _start_tag(self.activity, 2)
+        for elem in self.activity:
+            if elem is self.current_lap:
+                break
+            header += _serialize(elem, 3)
+        header += _start_tag(self.current_lap, 3)
+        header += _start_tag(self.current_track, 4)
+        return header
+
+    def _trailer(self):
+        '''
+        Returns the xml for the closing Track tag, lap stats and remaining closing tags.
+        '''
+        trailer = _end_tag("Track", 4)
+        for elem in self.current_lap:
+            if elem is not self.current_track:
+                trailer += _serialize(elem, 4)
+        trailer += _end_tag("Lap", 3) + _end_tag("Activity", 2) + \
+            _end_tag("Activities", 1) + _end_tag("TrainingCenterDatabase", 0)
+        return trailer
+
+    def _points_xml(self, start):
+        '''
+        Returns the xml for all points from index start onwards.
+        '''
+        return "".join(
+            _serialize(_point_element(Point(**self.trackpoints.row(i))), TRACKPOINT_LEVEL)
+            for i in range(start, len(self.trackpoints)))
+
+    def _write_header(self):
+        '''
+        Writes everything up to and including the opening Track tag, followed
+        by the closing tags.
+        '''
+        header = self._header().encode("utf-8")
+        if self._compressed:
+            self._stream.write(header)
+            self._stream.flush(zlib.Z_SYNC_FLUSH)
+            self._trailer_pos = len(header)
+            return
+        self._stream.seek(0)
+        self._stream.write(header)
+        self._trailer_pos = self._stream.tell()
+        self._write_trailer()
+
+    def _write_trailer(self, out=""):
+        '''
+        Writes the given xml at the end of the track, followed by the lap stats
+        and closing tags, and truncates anything left over from the previous trailer.
+        '''
+        out = out.encode("utf-8")
+        self._stream.seek(self._trailer_pos)
+        self._stream.write(out + self._trailer().encode("utf-8"))
+        self._stream.truncate()
+        self._trailer_pos += len(out)
+        self._stream.flush()
+
+    def _write_compressed(self, out):
+        '''
+        Appends xml to a compressed log, adding a sync point every GZIP_SYNC_FLUSHES calls.
+        '''
+        out = out.encode("utf-8")
+        self._stream.write(out)
+        self._trailer_pos += len(out)
+        self._flush_count += 1
+        if self._flush_count % GZIP_SYNC_FLUSHES == 0:
+            self._stream.flush(zlib.Z_SYNC_FLUSH)
 
     def add_point(self, point):
         '''
         Adds an activity point, including position, speed, altitude, heartrate,
         power, etc. (all optional).
+        Points are stored in self.trackpoints, and only converted to xml when
+        the file is written.
         '''
         if point.time is None:
             point.time = _time_stamp() # Use current time if not provided
-        point_record = et.SubElement(self.current_track, "Trackpoint")
-        et.SubElement(point_record, "Time").text = point.time
-        if (point.lat_deg is not None) and (point.lon_deg is not None):
-            position = et.SubElement(point_record, "Position")
-            et.SubElement(position, "LatitudeDegrees").text = str(point.lat_deg)
-            et.SubElement(position, "LongitudeDegrees").text = str(point.lon_deg)
-        if point.altitude_m is not None:
-            et.SubElement(point_record, "AltitudeMeters").text = str(point.altitude_m)
-        if point.distance_m is not None:
-            et.SubElement(point_record, "DistanceMeters").text = str(point.distance_m)
-        if point.heartrate_bpm is not None:
-            hr = et.SubElement(point_record, "HeartRateBpm")
-            et.SubElement(hr, "Value").text = str(point.heartrate_bpm)
-        if point.cadence_rpm is not None:
-            et.SubElement(point_record, "Cadence").text = str(point.cadence_rpm)
-        if (point.speed_mps is not None) or (point.power_watts is not None):
-            ext = et.SubElement(et.SubElement(point_record, "Extensions"),"TPX")
-            ext.set("xmlns", "http://www.garmin.com/xmlschemas/ActivityExtension/v2")
-            if point.speed_mps is not None:
-                et.SubElement(ext, "Speed").text = str(point.speed_mps)
-            if point.power_watts is not None:
-                et.SubElement(ext, "Watts").text = str(point.power_watts)
+        self.trackpoints.append(point)
+        if self._journal:
+            self._journal.append(point)
+
+    def _load_points(self):
+        '''
+        Loads the points from the current activity of an opened file.
+        '''
+        if not self.activity:
+            self.set_current_activity()
+        assert self.activity is not None
+        if self._loaded_activity is not self.activity:
+            self.trackpoints.clear()
+            for point_record in self.activity.find("Lap", NAMESPACES).find(
+                    "Track", NAMESPACES).iterfind("Trackpoint", NAMESPACES):
+                self.trackpoints.append(_point_from_record(point_record))
+            self._loaded_activity = self.activity
 
     def get_next_point(self):
         '''
@@ -182,61 +509,24 @@ class Tcx():
         Note that if points are added while iterating through points,
         the new points will not be returned.
         '''
-        point = Point()
-        if not self.points:
-            # If not already set, grab the first point from the activity
-            if not self.activity:
-                self.set_current_activity()
-            assert self.activity is not None
-            self.points = self.activity.find("Lap", NAMESPACES).find(
-                "Track", NAMESPACES).iterfind("Trackpoint", NAMESPACES)
+        if self._reader:
+            try:
+                return next(self._reader)
+            except StopIteration:
+                # Start from the beginning again on the next call
+                self._reader = self._iter_points()
+                return None
+        if self.points is None:
+            # If not already set, start from the first point
+            if self.current_track is None:
+                self._load_points()
+            self.points = iter(range(len(self.trackpoints)))
         try:
-            point_record = next(self.points)
+            index = next(self.points)
         except StopIteration:
             self.points = None
             return None
-        point.time = point_record.find("Time", NAMESPACES).text
-        try:
-            lat = point_record.find("Position", NAMESPACES).find("LatitudeDegrees", NAMESPACES)
-            lon = point_record.find("Position", NAMESPACES).find("LongitudeDegrees", NAMESPACES)
-            if lat is not None and lon is not None:
-                point.lat_deg, point.lon_deg = float(lat.text), float(lon.text)
-        except AttributeError:
-            pass
-        alt = point_record.find("AltitudeMeters", NAMESPACES)
-        if alt is not None:
-            point.altitude_m = float(alt.text)
-        dist = point_record.find("DistanceMeters", NAMESPACES)
-        if dist is not None:
-            point.distance_m = float(dist.text)
-        try:
-            hr = point_record.find("HeartRateBpm", NAMESPACES).find("Value", NAMESPACES)
-            if hr is not None:
-                point.heartrate_bpm = int(hr.text)
-        except AttributeError:
-            pass
-        cad = point_record.find("Cadence", NAMESPACES)
-        if cad is not None:
-            point.cadence_rpm = int(cad.text)
-        try:
-            spd = point_record.find("Extensions", NAMESPACES)
-            if spd is not None:
-                spd = spd.find("TPX", {"": NAMESPACES["ns3"]}).find(
-                    "Speed", {"": NAMESPACES["ns3"]})
-                if spd is not None:
-                    point.speed_mps = float(spd.text)
-        except AttributeError:
-            pass
-        try:
-            pwr = point_record.find("Extensions", NAMESPACES)
-            if pwr is not None:
-                pwr = pwr.find("TPX", {"": NAMESPACES["ns3"]}).find(
-                    "Watts", {"": NAMESPACES["ns3"]})
-                if pwr is not None:
-                    point.power_watts = int(pwr.text)
-        except AttributeError:
-            pass
-        return point
+        return Point(**self.trackpoints.row(index))
 
     def set_lap_stats(self, total_time_s=None, distance_m=None):
         '''
@@ -244,15 +534,64 @@ class Tcx():
         or updates them if already present.
         '''
         if total_time_s:
-            time_tag = self.current_lap.find("TotalTimeSeconds", "")
-            if time_tag is None:
-                time_tag = et.SubElement(self.current_lap, "TotalTimeSeconds")
-            time_tag.text = str(total_time_s)
+            self._lap_field("TotalTimeSeconds").text = str(total_time_s)
         if distance_m:
-            dist_tag = self.current_lap.find("DistanceMeters", "")
-            if dist_tag is None:
-                dist_tag = et.SubElement(self.current_lap, "DistanceMeters")
-            dist_tag.text = str(distance_m)
+            self._lap_field("DistanceMeters").text = str(distance_m)
+
+    def _lap_field(self, tag):
+        '''
+        Returns the lap stats element with the given tag, adding it in LAP_FIELDS order if needed.
+        '''
+        elem = self.current_lap.find(tag, "")
+        if elem is None:
+            elem = et.Element(tag)
+            later = [i for i, child in enumerate(self.current_lap) if child.tag in
+                     LAP_FIELDS[LAP_FIELDS.index(tag) + 1:]]
+            self.current_lap.insert(later[0] if later else len(self.current_lap), elem)
+        return elem
+
+    def set_lap_metrics(self, avg_power_watts=None, max_power_watts=None,
+                        normalized_power_watts=None, intensity_factor=None, tss=None):
+        '''
+        Adds power metrics to the Lap field, or updates them if already present.
+        Average and max power go in the lap extensions, and the Normalized Power,
+        Intensity Factor and TSS (which TCX has no fields for) in the lap notes.
+        '''
+        if avg_power_watts is not None or max_power_watts is not None:
+            ext = self._lap_field("Extensions").find("LX", "")
+            if ext is None:
+                ext = et.SubElement(self.current_lap.find("Extensions", ""), "LX")
+                ext.set("xmlns", NAMESPACES["ns3"])
+            for tag, value in [("AvgWatts", avg_power_watts), ("MaxWatts", max_power_watts)]:
+                if value is not None:
+                    watts_tag = ext.find(tag, "")
+                    if watts_tag is None:
+                        watts_tag = et.SubElement(ext, tag)
+                    watts_tag.text = str(int(round(value)))
+        if normalized_power_watts is not None:
+            self._lap_field("Notes").text = LAP_NOTES_FORMAT.format(
+                normalized_power_watts, intensity_factor or 0, tss or 0)
+
+    def get_lap_metrics(self):
+        '''
+        Gets the power metrics for the current lap, with None for any not set.
+        '''
+        metrics = dict.fromkeys(["avg_power_watts", "max_power_watts",
+            "normalized_power_watts", "intensity_factor", "tss"])
+        ext = self.current_lap.find("Extensions/LX", "")
+        if ext is not None:
+            for tag, key in [("AvgWatts", "avg_power_watts"), ("MaxWatts", "max_power_watts")]:
+                watts_tag = ext.find(tag, "")
+                if watts_tag is not None:
+                    metrics[key] = int(watts_tag.text)
+        notes_tag = self.current_lap.find("Notes", "")
+        if notes_tag is not None:
+            match = LAP_NOTES_PATTERN.match(notes_tag.text or "")
+            if match:
+                metrics["normalized_power_watts"] = int(match.group(1))
+                metrics["intensity_factor"] = float(match.group(2))
+                metrics["tss"] = float(match.group(3))
+        return metrics
 
     def get_lap_stats(self):
         '''
@@ -269,11 +608,88 @@ class Tcx():
 
         return total_time_s, distance_m
 
+    def power_curve(self, durations_s=CURVE_DURATIONS_S):
+        '''
+        Returns a dict of the best average power for each duration in the log,
+        from its power resampled to 1Hz. Durations longer than the log are None.
+        '''
+        if self._reader:
+            times, power = [], []
+            point = self.get_next_point()
+            while point is not None:
+                times.append(np.nan if point.time is None else parse_time(point.time))
+                power.append(np.nan if point.power_watts is None else point.power_watts)
+                point = self.get_next_point()
+        else:
+            if self.current_track is None:
+                self._load_points()
+            times = self.trackpoints.column("time")
+            power = self.trackpoints.column("power_watts")
+        return mean_max_power(resample_1hz(times, power), durations_s)
+
+    def export_fit(self, fname):
+        '''
+        Writes the points and lap stats from this log to a binary FIT file.
+        '''
+        total_time_s, distance_m = self.get_lap_stats()
+        write_fit(fname, self.trackpoints,
+                  total_time_s=None if total_time_s is None else float(total_time_s),
+                  distance_m=None if distance_m is None else float(distance_m))
+
     def flush(self):
         '''
         Writes tcx file to disk.
         '''
-        out = et.tostring(self.tcx, xml_declaration=True, encoding="utf-8")
-        out = minidom.parseString(out).toprettyxml(indent="    ")
-        with open(self.file_name, "w") as f:
-            f.write(out)
+        if self._stream:
+            if self._trailer_pos is None:
+                return # Nothing to write until the activity is started
+            out = self._points_xml(self._written)
+            self._written = len(self.trackpoints)
+            if self._compressed:
+                self._write_compressed(out)
+            else:
+                self._write_trailer(out)
+        elif self.current_track is not None:
+            with _open_file(self.file_name, "wt") as f:
+                f.write(self._header() + self._points_xml(0) + self._trailer())
+        else:
+            # Log that was opened from a file, write back the whole tree:
+            out = et.tostring(self.tcx, xml_declaration=True, encoding="utf-8")
+            out = minidom.parseString(out).toprettyxml(indent="    ")
+            with _open_file(self.file_name, "wt") as f:
+                f.write(out)
+
+    def close_log(self):
+        '''
+        Writes any remaining data to disk and closes the file if streaming.
+        '''
+        self.flush()
+        if self._stream:
+            if self._compressed and self._trailer_pos is not None:
+                self._stream.write(self._trailer().encode("utf-8"))
+            self._stream.close()
+            self._stream = None
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+
+def recover_journal(journal_name):
+    '''
+    Rebuilds the log for a journal left behind by a log that wasn't closed,
+    overwriting anything already in the log, and removes the journal.
+    Returns the name of the rebuilt log.
+    '''
+    trackpoints = SampleJournal.read(journal_name)
+    log = Tcx()
+    log.start_log(journal_name[:-len(JOURNAL_EXTENSION)])
+    log.start_activity(activity_type=Tcx.ActivityType.OTHER)
+    log.trackpoints = trackpoints
+    if len(trackpoints):
+        times = trackpoints.column("time")
+        log.activity.find("Id").text = format_time(times[0])
+        distance = trackpoints.column("distance_m")
+        log.set_lap_stats(total_time_s=int(round(times[-1] - times[0])),
+            distance_m=None if np.all(np.isnan(distance)) else float(np.nanmax(distance)))
+    log.flush()
+    os.remove(journal_name)
+    return log.file_name
@@ -0,0 +1,140 @@
+"""
+Array-backed storage for activity track points.
+
+Copyright (C) 2021  Robert Ussery
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from datetime import datetime as dt, timezone
+import numpy as np
+
+# One column per Point attribute. Missing values are stored as NaN, and
+# time is stored as UTC seconds since the epoch.
+COLUMNS = ["time", "lat_deg", "lon_deg", "altitude_m", "distance_m",
+           "heartrate_bpm", "cadence_rpm", "speed_mps", "power_watts"]
+INT_COLUMNS = ["heartrate_bpm", "cadence_rpm", "power_watts"]
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+def parse_time(strtime):
+    '''
+    Converts a TCX timestamp string to UTC seconds since the epoch.
+    '''
+    if len(strtime) == 20 and strtime[-1] == "Z":
+        # Fast path for the format written by this module, strptime is slow:
+        t = dt(int(strtime[0:4]), int(strtime[5:7]), int(strtime[8:10]),
+               int(strtime[11:13]), int(strtime[14:16]), int(strtime[17:19]))
+    else:
+        # Fractional seconds and/or a UTC offset:
+        t = dt.fromisoformat(strtime.strip().replace("Z", "+00:00"))
+    if t.tzinfo is None:
+        t = t.replace(tzinfo=timezone.utc)
+    return t.timestamp()
+
+def format_time(time_s):
+    '''
+    Converts UTC seconds since the epoch to a TCX timestamp string.
+    '''
+    t = dt.fromtimestamp(time_s, tz=timezone.utc)
+    if t.microsecond:
+        return t.strftime("%Y-%m-%dT%H:%M:%S.") + "{:03d}Z".format(t.microsecond // 1000)
+    return t.strftime(TIME_FORMAT)
+
+class TrackpointBuffer():
+    '''
+    Holds track points as a set of growable NumPy columns, one per field.
+    '''
+    def __init__(self, capacity=3600):
+        self._capacity = max(int(capacity), 1)
+        self._len = 0
+        self._data = {c: np.full(self._capacity, np.nan) for c in COLUMNS}
+
+    @classmethod
+    def from_columns(cls, columns):
+        '''
+        Creates a buffer from a dict of {field: array}, with times as UTC epoch
+        seconds. Fields that aren't given are left empty.
+        '''
+        length = len(columns["time"])
+        buffer = cls(capacity=length)
+        for c, values in columns.items():
+            buffer._data[c][:length] = values
+        buffer._len = length
+        return buffer
+
+    def __len__(self):
+        return self._len
+
+    def _grow(self):
+        '''
+        Doubles the capacity of all columns, so appending is amortized O(1).
+        '''
+        self._capacity *= 2
+        for c in COLUMNS:
+            col = np.full(self._capacity, np.nan)
+            col[:self._len] = self._data[c][:self._len]
+            self._data[c] = col
+
+    def append(self, point):
+        '''
+        Adds a Point to the end of the buffer, and returns its index.
+        '''
+        if self._len == self._capacity:
+            self._grow()
+        i = self._len
+        for c in COLUMNS:
+            val = getattr(point, c)
+            if val is None:
+                continue
+            if c == "time":
+                val = parse_time(val)
+            self._data[c][i] = val
+        self._len += 1
+        return i
+
+    def row(self, index):
+        '''
+        Returns the values at index as a dict of {field: value}, with None for
+        missing values. The keys match the Point constructor arguments.
+        '''
+        if not -self._len <= index < self._len:
+            raise IndexError("Trackpoint index {} out of range".format(index))
+        row = {}
+        for c in COLUMNS:
+            val = self._data[c][index]
+            if np.isnan(val):
+                val = None
+            elif c == "time":
+                val = format_time(val)
+            elif c in INT_COLUMNS and val.is_integer():
+                val = int(val)
+            else:
+                val = float(val)
+            row[c] = val
+        return row
+
+    def column(self, name):
+        '''
+        Returns a read-only view of a column, covering all points in the buffer.
+        '''
+        col = self._data[name][:self._len]
+        col.flags.writeable = False
+        return col
+
+    def clear(self):
+        '''
+        Removes all points, keeping the allocated capacity.
+        '''
+        for c in COLUMNS:
+            self._data[c][:self._len] = np.nan
+        self._len = 0
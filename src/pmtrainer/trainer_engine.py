@@ -0,0 +1,370 @@
+"""
+Runs a trainer session independently of any user interface.
+
+The engine samples the sensors, updates the bike simulator and the workout
+targets, and logs points at 1Hz. User interfaces (or anything else that
+wants to follow the ride) subscribe to the engine, and are called with it
+after every step. Engines whose sims are riders of the same BikeSimBatch
+can be stepped together with step_engines(), which updates each batch's
+sim once for all of its riders.
+
+Copyright (C) 2021  Robert Ussery
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import datetime as dt
+import math
+import time
+import numpy as np
+from pmtrainer.bike_sim import BikeSim
+from pmtrainer.power_events import PowerReconstructor
+from pmtrainer.power_curve import PowerCurve
+from pmtrainer.power_metrics import PowerMetrics
+from pmtrainer.sensors import SensorStatus
+from pmtrainer.tcx_file import Point
+from pmtrainer.trackpoints import format_time
+
+LOG_INTERVAL_S = 1.0
+
+class Timer():
+    '''
+    A timer that returns time as a datetime timedelta. The timer only updates
+    when the update() method is called, so that the same time can be used in
+    multiple places in a loop.
+    '''
+    def __init__(self, replay=False, tick_ms=100.0):
+        self.replay=replay
+        self.start_time = None
+        self.elapsed_time = None
+        self.tick_ms = tick_ms
+
+    def start(self, current_time=None):
+        '''
+        Start the timer, at current_time (a naive UTC datetime) if given, or now.
+        '''
+        self.start_time = dt.datetime.utcnow() if current_time is None else current_time
+        self.elapsed_time = dt.timedelta(seconds=0)
+
+    def get_time(self):
+        '''
+        Return the timedelta from when the timer was started to
+        when it was updated.
+        '''
+        return self.elapsed_time
+
+    def update(self, dt_s=None):
+        '''
+        Update the elapsed time. If a time step is given, the timer advances by
+        that step instead of following the clock.
+        '''
+        if dt_s is not None:
+            self.elapsed_time += dt.timedelta(seconds=dt_s)
+        elif self.replay:
+            self.elapsed_time += dt.timedelta(seconds=self.tick_ms / 1000.0)
+        else:
+            self.elapsed_time = dt.datetime.utcnow() - self.start_time
+
+def _avg_val(running_avg_val, new_val, avg_window=10):
+    '''
+    Keeps a running average of values, weighted by the window length
+    '''
+    diff = new_val - running_avg_val
+    return running_avg_val + (diff / avg_window)
+
+class TrainerEngine():
+    '''
+    Owns the timer, sensors, bike simulator, workout and log for a ride, and
+    advances them all together one step at a time.
+    '''
+    def __init__(self, sensors, workout, logfile=None, timer=None,
+                 weight_kg=80, ftp_watts=230, log_interval_s=LOG_INTERVAL_S, course=None,
+                 sim=None):
+        self.sensors = sensors
+        self.workout = workout
+        self.logfile = logfile
+        self.timer = timer if timer else Timer()
+        # A sim given in place of the engine's own (e.g. a rider of a BikeSimBatch)
+        # brings its own weight and course:
+        self.sim = sim if sim is not None else BikeSim(weight_kg=weight_kg, course=course)
+        self.metrics = PowerMetrics(ftp_watts=ftp_watts)
+        self.power_curve = PowerCurve()
+        self.log_interval_s = log_interval_s
+        self.power_reconstructor = PowerReconstructor()
+        self._subscribers = []
+        self._running = False
+        self._last_log_s = None
+        self._metrics_s = 0 # Elapsed seconds fed to the metrics
+        self._start_epoch_s = None
+        self._log_power_totals = (0, 0.0) # Reconstructed power totals at the last log point
+
+        # Latest state, updated on every step:
+        self.heartrate_bpm = None
+        self.power_watts = None
+        self.cadence_rpm = None
+        self.heart_rate_status = SensorStatus.State.NOTCONNECTED
+        self.power_meter_status = SensorStatus.State.NOTCONNECTED
+        self.power_samples = None # Sensor events since the last step, if the sensors buffer them
+        self.heartrate_samples = None
+        self.power_1hz = None # Reconstructed (times, powers) for seconds completed in the step
+        self.avg_heartrate_bpm = None
+        self.avg_power_watts = None
+        self.power_target_watts = None
+        self.block_remaining_s = None
+        self.grade = 0.0 # Grade of the course at the current distance
+
+    @property
+    def course(self):
+        '''
+        Returns the course being ridden, or None if it's flat.
+        '''
+        return self.sim.course
+
+    @course.setter
+    def course(self, course):
+        '''
+        Sets the course to ride, or None for a flat course.
+        '''
+        self.sim.course = course
+
+    def subscribe(self, callback):
+        '''
+        Registers a function to be called with the engine after every step.
+        '''
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        '''
+        Removes a function registered with subscribe().
+        '''
+        self._subscribers.remove(callback)
+
+    def start(self, start_time=None):
+        '''
+        Starts the ride timer, at start_time (a naive UTC datetime) if given or now.
+        Logged points are timestamped from the start time.
+        '''
+        self.timer.start(current_time=start_time)
+        self._start_epoch_s = self.timer.start_time.replace(tzinfo=dt.timezone.utc).timestamp()
+        self._last_log_s = 0
+        self._metrics_s = 0
+        self.metrics.reset()
+        self.power_curve.reset()
+
+    @property
+    def elapsed(self):
+        '''
+        Returns the elapsed ride time as a timedelta.
+        '''
+        return self.timer.get_time()
+
+    @property
+    def ftp_watts(self):
+        '''
+        Returns the FTP used for workout targets and power metrics.
+        '''
+        return self.metrics.ftp_watts
+
+    @ftp_watts.setter
+    def ftp_watts(self, ftp_watts):
+        '''
+        Sets the FTP.
+        '''
+        self.metrics.ftp_watts = ftp_watts
+
+    @property
+    def weight_kg(self):
+        '''
+        Returns the bike+rider weight used for the sim.
+        '''
+        return self.sim.weight_kg
+
+    @weight_kg.setter
+    def weight_kg(self, weight_kg):
+        '''
+        Sets the combined bike+rider weight.
+        '''
+        self.sim.weight_kg = weight_kg
+
+    def _drain_samples(self, method):
+        drain = getattr(self.sensors, method, None)
+        return drain() if drain else None
+
+    def step(self, dt_s=None):
+        '''
+        Advances the ride by one step: by dt_s seconds if given, otherwise as
+        the timer decides. Then samples the sensors, updates the sim, workout
+        targets and log, and calls the subscribers.
+        '''
+        power_watts = self.begin_step(dt_s)
+        if power_watts is not None:
+            self.sim.update(power_watts, self.timer.get_time().total_seconds())
+        self.finish_step()
+
+    def begin_step(self, dt_s=None):
+        '''
+        The first half of step(): advances the timer and samples the sensors.
+        Returns the power to update the sim with, or None if there's no power
+        meter connected. The sim is left for the caller to update, before
+        finishing the step with finish_step().
+        '''
+        if self.timer.start_time is None:
+            self.start()
+        self.timer.update(dt_s)
+        elapsed_s = self.timer.get_time().seconds
+
+        # Update sensor variables:
+        self.sensors.update(self.timer.get_time().total_seconds())
+        self.heartrate_bpm = self.sensors.heartrate_bpm
+        self.power_watts = self.sensors.power_watts
+        self.cadence_rpm = self.sensors.cadence_rpm
+        self.heart_rate_status = self.sensors.heart_rate_status
+        self.power_meter_status = self.sensors.power_meter_status
+        # Drain every buffered sensor event since the last step, and use the average
+        # power over all of them rather than just the latest. The average is
+        # reconstructed from the accumulated power if the sensors provide it, so
+        # it includes events that were never received:
+        self.power_samples = self._drain_samples("drain_power_samples")
+        self.heartrate_samples = self._drain_samples("drain_heartrate_samples")
+        if self.power_samples is not None and len(self.power_samples):
+            power = self.power_reconstructor.update(self.power_samples)
+            if power is None:
+                power = np.mean(self.power_samples["instantaneous_power_watts"])
+            self.power_watts = int(round(power))
+        self.power_1hz = self.power_reconstructor.drain_1hz()
+        power_connected = self.power_meter_status == SensorStatus.State.CONNECTED
+
+        # Feed the power metrics and curve a value per second, from the reconstructed
+        # 1Hz power if the sensors provide it, otherwise the latest power:
+        if self.power_reconstructor.total_events:
+            seconds = self.power_1hz[1].tolist()
+        elif power_connected:
+            seconds = [self.power_watts] * (elapsed_s - self._metrics_s)
+        else:
+            seconds = []
+        for power in seconds:
+            self.metrics.add(power)
+            self.power_curve.add(power)
+        self._metrics_s = elapsed_s
+        if not power_connected or self.power_watts is None or math.isnan(self.power_watts):
+            return None # A NaN would stay in the sim's speed and distance for good
+        return self.power_watts
+
+    def finish_step(self):
+        '''
+        The second half of step(), once the sim has been updated: updates the
+        workout targets and log, and calls the subscribers.
+        '''
+        elapsed_s = self.timer.get_time().seconds
+        power_connected = self.power_meter_status == SensorStatus.State.CONNECTED
+        self.grade = self.sim.grade
+
+        # Update workout params:
+        self.power_target_watts = self.workout.power_target(elapsed_s) * self.ftp_watts
+        self.block_remaining_s = self.workout.block_time_remaining(elapsed_s)
+
+        # Update running averages:
+        if self.heartrate_bpm:
+            if self.avg_heartrate_bpm is None:
+                self.avg_heartrate_bpm = self.heartrate_bpm
+            self.avg_heartrate_bpm = _avg_val(self.avg_heartrate_bpm, self.heartrate_bpm,
+                                              avg_window=3)
+        if self.power_watts:
+            self.avg_power_watts = self.metrics.average_watts(10)
+            if self.avg_power_watts is None:
+                self.avg_power_watts = self.power_watts
+
+        # Update log file at the log interval:
+        if self.logfile and elapsed_s - self._last_log_s >= self.log_interval_s:
+            # Log the reconstructed average power over all events since the last point,
+            # if there were any:
+            events = self.power_reconstructor.total_events - self._log_power_totals[0]
+            log_power = self.power_watts
+            if events > 0:
+                log_power = int(round((self.power_reconstructor.total_accumulated_power -
+                                       self._log_power_totals[1]) / events))
+            self._log_power_totals = (self.power_reconstructor.total_events,
+                                      self.power_reconstructor.total_accumulated_power)
+            if power_connected:
+                altitude_m, lat_deg, lon_deg = None, None, None
+                if self.course is not None:
+                    altitude_m = self.course.altitude_at(self.sim.total_distance_m)
+                    lat_deg, lon_deg = self.course.position_at(self.sim.total_distance_m)
+                self.logfile.add_point(Point(
+                    time=format_time(self._start_epoch_s + self.elapsed.total_seconds()),
+                    lat_deg=lat_deg,
+                    lon_deg=lon_deg,
+                    altitude_m=altitude_m,
+                    heartrate_bpm=self.heartrate_bpm,
+                    cadence_rpm=self.cadence_rpm,
+                    power_watts=log_power,
+                    distance_m=self.sim.total_distance_m,
+                    speed_mps=self.sim.speed_mps))
+                self.logfile.set_lap_stats(total_time_s=elapsed_s,
+                                           distance_m=self.sim.total_distance_m)
+                self.logfile.set_lap_metrics(**self.metrics.summary())
+                self.logfile.flush()
+            self._last_log_s = elapsed_s
+
+        for callback in self._subscribers:
+            callback(self)
+
+    def stop(self):
+        '''
+        Stops run() after the current step.
+        '''
+        self._running = False
+
+    def run(self, tick_s=0.1, duration_s=None, realtime=True):
+        '''
+        Steps the ride every tick_s seconds until stop() is called, the ride has
+        lasted duration_s, or the sensors run out of data. Without realtime,
+        steps run back to back, advancing the timer by tick_s each time.
+        '''
+        self._running = True
+        next_tick = time.monotonic()
+        while self._running:
+            self.step(None if realtime else tick_s)
+            if duration_s is not None and self.timer.get_time().total_seconds() >= duration_s:
+                break
+            if getattr(self.sensors, "finished", False):
+                break
+            if realtime:
+                next_tick += tick_s
+                time.sleep(max(next_tick - time.monotonic(), 0))
+        self._running = False
+
+def step_engines(engines, dt_s=None):
+    '''
+    Steps every engine once, as step() would. Engines whose sims are riders of
+    a BikeSimBatch have their batch updated once for all of them, rather than
+    one rider at a time. Any other sims are updated on their own.
+    '''
+    batches = {} # Batch -> (rider indexes, powers, times)
+    for engine in engines:
+        power_watts = engine.begin_step(dt_s)
+        if power_watts is None:
+            continue
+        time_s = engine.timer.get_time().total_seconds()
+        batch = getattr(engine.sim, "batch", None)
+        if batch is None:
+            engine.sim.update(power_watts, time_s)
+        else:
+            riders, powers, times = batches.setdefault(batch, ([], [], []))
+            riders.append(engine.sim.index)
+            powers.append(power_watts)
+            times.append(time_s)
+    for batch, (riders, powers, times) in batches.items():
+        batch.update(powers, times, riders=riders)
+    for engine in engines:
+        engine.finish_step()
@@ -0,0 +1,126 @@
+"""
+Training load: the chronic (fitness) and acute (fatigue) training loads,
+exponentially weighted averages of daily TSS, and the training stress
+balance (form) between them.
+
+Each day's load decays by the same factor, so a ride's contribution to the
+load on any later day is its TSS times the decay factor raised to the
+number of days since. The load is a sum of these contributions, so a ride
+can be added to (or removed from) the load in O(1), on any day, without
+going back over the rides before it.
+
+Copyright (C) 2021  Robert Ussery
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+import datetime as dt
+import math
+import numpy as np
+
+CTL_DAYS = 42 # Time constant of the chronic training load
+ATL_DAYS = 7 # Time constant of the acute training load
+
+def ride_day(start_time_s):
+    '''
+    Returns the day (as a date ordinal) a ride starting at UTC epoch seconds
+    counts towards, in local time.
+    '''
+    return dt.datetime.fromtimestamp(start_time_s).date().toordinal()
+
+def _gain(days):
+    '''
+    Returns the fraction of each day's TSS added to a load with a time constant of days.
+    '''
+    return 1 - math.exp(-1 / days)
+
+class TrainingLoad():
+    '''
+    Chronic and acute training load at the end of a day (a date ordinal).
+    '''
+    def __init__(self, day=None, ctl=0.0, atl=0.0, ctl_days=CTL_DAYS, atl_days=ATL_DAYS):
+        self.day = day
+        self.ctl = ctl
+        self.atl = atl
+        self.ctl_days = ctl_days
+        self.atl_days = atl_days
+
+    @classmethod
+    def from_rides(cls, days, tss, ctl_days=CTL_DAYS, atl_days=ATL_DAYS):
+        '''
+        Returns the load at the end of the last day of an archive of rides,
+        from arrays of their days and TSS, in one vectorized pass.
+        '''
+        days = np.asarray(days, dtype=float)
+        tss = np.nan_to_num(np.asarray(tss, dtype=float))
+        if len(days) == 0:
+            return cls(ctl_days=ctl_days, atl_days=atl_days)
+        day = int(np.max(days))
+        ctl, atl = (float(np.sum(_gain(d) * tss * (1 - _gain(d)) ** (day - days)))
+                    for d in (ctl_days, atl_days))
+        return cls(day, ctl, atl, ctl_days, atl_days)
+
+    @property
+    def tsb(self):
+        '''
+        Returns the training stress balance (form): chronic minus acute load.
+        '''
+        return self.ctl - self.atl
+
+    def at(self, day):
+        '''
+        Returns the load at the end of a day on or after this one, with no more rides.
+        '''
+        if self.day is None:
+            return TrainingLoad(day, 0.0, 0.0, self.ctl_days, self.atl_days)
+        if day < self.day:
+            raise ValueError("Can't find the load on day {} from day {}".format(day, self.day))
+        return TrainingLoad(day,
+                            self.ctl * (1 - _gain(self.ctl_days)) ** (day - self.day),
+                            self.atl * (1 - _gain(self.atl_days)) ** (day - self.day),
+                            self.ctl_days, self.atl_days)
+
+    def add(self, day, tss):
+        '''
+        Adds a ride's TSS on a day. Rides on earlier days than the load add what's
+        left of their TSS by now, and a negative TSS removes a ride.
+        '''
+        if not tss:
+            return
+        if self.day is None or day > self.day:
+            decayed = self.at(day)
+            self.day, self.ctl, self.atl = day, decayed.ctl, decayed.atl
+        self.ctl += _gain(self.ctl_days) * tss * (1 - _gain(self.ctl_days)) ** (self.day - day)
+        self.atl += _gain(self.atl_days) * tss * (1 - _gain(self.atl_days)) ** (self.day - day)
+
+def daily_load(days, tss, first_day, last_day, ctl_days=CTL_DAYS, atl_days=ATL_DAYS):
+    '''
+    Returns arrays of the chronic load, acute load and balance at the end of
+    each day from first_day to last_day, from arrays of rides' days and TSS.
+    '''
+    days = np.asarray(days, dtype=int)
+    tss = np.nan_to_num(np.asarray(tss, dtype=float))
+    start = TrainingLoad.from_rides(days[days < first_day], tss[days < first_day],
+                                    ctl_days, atl_days).at(first_day - 1)
+    in_range = (days >= first_day) & (days <= last_day)
+    daily_tss = np.bincount(days[in_range] - first_day, weights=tss[in_range],
+                            minlength=last_day - first_day + 1)
+    loads = []
+    for d, start_load in [(ctl_days, start.ctl), (atl_days, start.atl)]:
+        gain, load = _gain(d), start_load
+        out = np.empty(len(daily_tss))
+        for i, day_tss in enumerate(daily_tss.tolist()):
+            load += (day_tss - load) * gain
+            out[i] = load
+        loads.append(out)
+    return loads[0], loads[1], loads[0] - loads[1]
@@ -0,0 +1,216 @@
+"""
+Keeps a persistent index of parsed workout files.
+
+Parsed and validated workouts are saved to a JSON index file, along with
+the modification time and size of the file they came from. A workout file
+is only parsed again when its modification time or size changes. Scanning
+a directory parses the new and changed files in parallel.
+
+Copyright (C) 2021  Robert Ussery
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import yaml
+from pmtrainer.workout_profile import Workout, YAML_LOADER
+
+DEFAULT_INDEX_FILE = os.path.expanduser("~/pmtrainer/workout_index.json")
+INDEX_VERSION = 2
+WORKOUT_EXTENSION = ".yaml"
+PARALLEL_MIN_FILES = 64 # Fewer files than this are parsed in this process
+PARALLEL_CHUNK_SIZE = 16
+
+def _index_fields(workout):
+    '''
+    Returns the validated fields of a workout that are kept in the index, as
+    plain JSON types. Any other fields in the workout file are left out.
+    '''
+    fields = workout.workout
+    return {"name": str(fields["name"]),
+            "description": None if fields["description"] is None else str(fields["description"]),
+            "duration_s": workout.duration_s,
+            "blocks": [{"duration": float(d), "start": float(s), "end": float(e)}
+                       for d, s, e in workout.get_all_blocks()]}
+
+def _parse_workout_file(path):
+    '''
+    Parses and validates a workout file, and returns its index entry. Module level
+    so it can run in a worker process.
+    '''
+    stat = os.stat(path)
+    entry = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+    try:
+        with open(path) as f:
+            workout = Workout.from_dict(yaml.load(f, Loader=YAML_LOADER))
+        min_power, max_power = workout.get_min_max_power()
+        entry.update({"workout": _index_fields(workout), "min_power": min_power,
+                      "max_power": max_power, "duration_s": workout.duration_s})
+    except (Workout.WorkoutError, yaml.YAMLError, OSError, UnicodeDecodeError) as e:
+        entry["error"] = str(e)
+    return entry
+
+def _find_workout_files(directory, recursive):
+    '''
+    Returns the absolute paths of all workout files in a directory.
+    '''
+    if not recursive:
+        return [os.path.join(directory, f) for f in os.listdir(directory)
+                if f.endswith(WORKOUT_EXTENSION)]
+    paths = []
+    for root, _, files in os.walk(directory):
+        paths.extend(os.path.join(root, f) for f in files if f.endswith(WORKOUT_EXTENSION))
+    return paths
+
+class WorkoutLibrary():
+    '''
+    Loads workouts through a persistent index, parsing only new or changed files.
+    '''
+    def __init__(self, index_file=DEFAULT_INDEX_FILE):
+        self.index_file = index_file
+        self._entries = {} # Index entries by absolute workout path
+        self._workouts = {} # Workouts created from index entries, by absolute path
+        self._dirty = False
+        self._load_index()
+
+    def _load_index(self):
+        if not self.index_file or not os.path.isfile(self.index_file):
+            return
+        try:
+            with open(self.index_file) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return # An unreadable index is rebuilt as workouts are loaded
+        if isinstance(index, dict) and index.get("version") == INDEX_VERSION:
+            self._entries = index.get("workouts", {})
+
+    def save(self):
+        '''
+        Writes the index file, if anything has changed since it was loaded.
+        '''
+        if not self._dirty or not self.index_file:
+            return
+        dirname = os.path.dirname(self.index_file)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        # Write to a temporary file first, so a crash can't leave a partial index:
+        tmp_name = self.index_file + ".tmp"
+        try:
+            with open(tmp_name, "w") as f:
+                json.dump({"version": INDEX_VERSION, "workouts": self._entries}, f)
+            os.replace(tmp_name, self.index_file)
+        finally:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name) # The dump failed
+        self._dirty = False
+
+    def _is_current(self, path):
+        '''
+        Returns True if a workout file is indexed and hasn't changed since.
+        '''
+        stat = os.stat(path)
+        entry = self._entries.get(path)
+        return bool(entry) and entry["mtime_ns"] == stat.st_mtime_ns and \
+               entry["size"] == stat.st_size
+
+    def _update_entry(self, path, entry):
+        self._entries[path] = entry
+        self._workouts.pop(path, None)
+        self._dirty = True
+
+    def _entry(self, path):
+        '''
+        Returns the index entry for a workout file, parsing the file if it isn't
+        indexed or has changed since it was indexed.
+        '''
+        if not self._is_current(path):
+            self._update_entry(path, _parse_workout_file(path))
+        return self._entries[path]
+
+    def _get(self, path):
+        entry = self._entry(path)
+        if "error" in entry:
+            raise Workout.WorkoutError(message=entry["error"])
+        workout = self._workouts.get(path)
+        if workout is None:
+            workout = Workout.from_dict(entry["workout"])
+            self._workouts[path] = workout
+        return workout
+
+    def get(self, path):
+        '''
+        Returns the Workout for a workout file. Raises a WorkoutError if the file
+        isn't a valid workout.
+        '''
+        try:
+            return self._get(os.path.abspath(path))
+        finally:
+            self.save()
+
+    def get_min_max_power(self, path):
+        '''
+        Returns the minimum and maximum power of a workout file.
+        '''
+        self.get(path)
+        entry = self._entries[os.path.abspath(path)]
+        return entry["min_power"], entry["max_power"]
+
+    def scan(self, directory, recursive=False, max_workers=None):
+        '''
+        Returns a dict of {path: Workout} for all valid workout files in a directory,
+        sorted by workout name, and a dict of {path: error message} for invalid ones,
+        sorted by path. New and changed files are parsed in a pool of max_workers
+        processes when there are enough of them to be worth it.
+        Index entries for files that no longer exist in the directory are removed.
+        '''
+        directory = os.path.abspath(directory)
+        paths = set(_find_workout_files(directory, recursive))
+        for path in [p for p in self._entries if p not in paths and (
+                     p.startswith(directory + os.sep) if recursive
+                     else os.path.dirname(p) == directory)]:
+            del self._entries[path]
+            self._workouts.pop(path, None)
+            self._dirty = True
+
+        changed = sorted(p for p in paths if not self._is_current(p))
+        if len(changed) >= PARALLEL_MIN_FILES and max_workers != 1:
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                entries = pool.map(_parse_workout_file, changed, chunksize=PARALLEL_CHUNK_SIZE)
+                for path, entry in zip(changed, entries):
+                    self._update_entry(path, entry)
+        else:
+            for path in changed:
+                self._update_entry(path, _parse_workout_file(path))
+
+        workouts = []
+        errors = {}
+        for path in sorted(paths):
+            try:
+                workouts.append((path, self._get(path)))
+            except Workout.WorkoutError as e:
+                errors[path] = str(e)
+        self.save()
+        return dict(sorted(workouts, key=lambda w: (str(w[1].name), w[0]))), errors
+
+_library = None
+
+def get_library():
+    '''
+    Returns the workout library shared by all callers, using the default index file.
+    '''
+    global _library
+    if _library is None:
+        _library = WorkoutLibrary()
+    return _library
@@ -16,8 +16,14 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 '''
+from bisect import bisect_left
+from itertools import accumulate
+import numpy as np
 import yaml
 
+# Use the much faster libyaml parser when it's available:
+YAML_LOADER = getattr(yaml, "CFullLoader", yaml.FullLoader)
+
 ZONES = [0, 0.6, 0.75, 0.9, 1.05, 1.18]
 def get_zone(pwr):
     '''
@@ -42,61 +48,124 @@ class Workout():
         def __init__(self, message=""):
             super().__init__(message)
 
-    def __init__(self, workout_file):
-        with open(workout_file) as f:
-            self.workout = yaml.full_load(f)
+    def __init__(self, workout_file=None, workout=None):
+        if workout is None:
+            with open(workout_file) as f:
+                workout = yaml.load(f, Loader=YAML_LOADER)
+        Workout.validate(workout)
+        self.workout = workout
+
+        self._duration_s = self.workout["duration_s"]
+
+        # Block end times in seconds, so the current block can be found by binary search:
+        self._block_ends_s = [d * self._duration_s for d in accumulate(
+            b["duration"] for b in self.workout["blocks"])]
+        # The same block data as arrays, for evaluating many times at once:
+        blocks = self.workout["blocks"]
+        self._ends_arr = np.array(self._block_ends_s, dtype=float)
+        self._durations_arr = np.array([b["duration"] * self._duration_s for b in blocks])
+        self._start_power_arr = np.array([b["start"] for b in blocks], dtype=float)
+        self._end_power_arr = np.array([b["end"] for b in blocks], dtype=float)
+        self._targets_1hz = None
+
+    @classmethod
+    def from_dict(cls, workout):
+        '''
+        Creates a workout from an already parsed workout description.
+        '''
+        return cls(workout=workout)
+
+    @staticmethod
+    def validate(workout):
+        '''
+        Checks a parsed workout description, and raises a WorkoutError if it is invalid.
+        '''
+        if not isinstance(workout, dict):
+            raise Workout.WorkoutError(message="Workout is not a dictionary")
+        for key in ["name", "description", "duration_s", "blocks"]:
+            if key not in workout:
+                raise Workout.WorkoutError(message="Workout is missing '{}'".format(key))
+        if not isinstance(workout["duration_s"], (int, float)) or workout["duration_s"] <= 0:
+            raise Workout.WorkoutError(
+                message="Invalid workout duration_s {}".format(workout["duration_s"]))
+        if not isinstance(workout["blocks"], list) or not workout["blocks"]:
+            raise Workout.WorkoutError(message="Workout has no blocks")
+        for b in workout["blocks"]:
+            if not isinstance(b, dict) or not all(
+                    isinstance(b.get(k), (int, float)) for k in ["duration", "start", "end"]):
+                raise Workout.WorkoutError(message="Invalid workout block {}".format(b))
 
         # Check workout duration:
         dur = 0
-        for b in self.workout["blocks"]:
+        for b in workout["blocks"]:
             dur += b["duration"]
         if abs(dur-1.0) > 0.001:
             raise Workout.WorkoutError(message="Invalid workout duration {} != 1.0".format(dur))
 
-        self._duration_s = self.workout["duration_s"]
+    def block_index(self, curr_time_s):
+        '''
+        Returns the index of the workout block at the given time. Times before
+        the start or after the end of the workout return the first or last block.
+        '''
+        return min(bisect_left(self._block_ends_s, curr_time_s), len(self._block_ends_s) - 1)
 
     def _get_current_block(self, curr_time_s):
-        complete_fraction = curr_time_s / self._duration_s
-        dur = 0
-        ind = 0
-        block = None
-        for block in self.workout["blocks"]:
-            dur += block["duration"]
-            if dur >= complete_fraction:
-                break
-            ind += 1
-        return ind, block
+        ind = self.block_index(curr_time_s)
+        return ind, self.workout["blocks"][ind]
+
+    def _time_remaining(self, ind, block_duration_s, curr_time_s):
+        if curr_time_s > self._duration_s:
+            return 0
+        if curr_time_s < 0:
+            return block_duration_s
+        return max(self._block_ends_s[ind] - curr_time_s, 0)
 
     def block_time_remaining(self, curr_time_s):
         '''
         Returns the time left in the current workout block in seconds
         '''
-        if curr_time_s > self._duration_s:
-            return 0
         ind, block = self._get_current_block(curr_time_s)
-        block_duration_s = block["duration"] * self._duration_s
-        if curr_time_s < 0:
-            return block_duration_s
-        dur = 0
-        for i in range(0,ind):
-            dur += self.workout["blocks"][i]["duration"]
-        block_elapsed_s = curr_time_s - dur * self._duration_s
-        return block_duration_s - block_elapsed_s
+        return self._time_remaining(ind, block["duration"] * self._duration_s, curr_time_s)
 
     def power_target(self, curr_time_s):
         '''
         Returns the target power for the current time in
         the current block.
         '''
-        _, block = self._get_current_block(curr_time_s)
+        ind, block = self._get_current_block(curr_time_s)
         start_power = block["start"]
         end_power = block["end"]
         _duration_s = block["duration"] * self._duration_s
-        time_left_s = self.block_time_remaining(curr_time_s)
+        time_left_s = self._time_remaining(ind, _duration_s, curr_time_s)
         block_slope = ((end_power - start_power) / _duration_s)
         power = block_slope * (_duration_s - time_left_s) + start_power
         return power
 
+    def power_targets(self, times_s):
+        '''
+        Returns the target power and block index at each of an array of times,
+        as a tuple of NumPy arrays: (power, block index). Matches power_target()
+        for times before the start and after the end of the workout.
+        '''
+        t = np.asarray(times_s, dtype=float)
+        ind = np.minimum(np.searchsorted(self._ends_arr, t, side="left"), len(self._ends_arr) - 1)
+        duration_s = self._durations_arr[ind]
+        time_left_s = np.where(t > self._duration_s, 0,
+                               np.where(t < 0, duration_s, np.maximum(self._ends_arr[ind] - t, 0)))
+        start_power = self._start_power_arr[ind]
+        block_slope = (self._end_power_arr[ind] - start_power) / duration_s
+        return block_slope * (duration_s - time_left_s) + start_power, ind
+
+    def power_targets_1hz(self):
+        '''
+        Returns a read-only array of the target power at each whole second from
+        the start to the end of the workout, inclusive. Calculated once and cached.
+        '''
+        if self._targets_1hz is None:
+            self._targets_1hz, _ = self.power_targets(np.arange(int(self._duration_s) + 1))
+            self._targets_1hz.flags.writeable = False
+        return self._targets_1hz
+
     def get_all_blocks(self):
         '''
         Returns all blocks from the workout as a list of tuples:
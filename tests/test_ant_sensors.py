@@ -0,0 +1,38 @@
+import math
+import unittest
+from pmtrainer.ant_sensors import RiderSensors
+
+
+class TestRiderSensors(unittest.TestCase):
+    def setUp(self):
+        self.time_s = 0.0
+        self.sensors = RiderSensors(clock=lambda: self.time_s)
+
+    def _page(self, event_count, accumulated_power_watts, power_watts=200):
+        self.time_s += 0.25
+        self.sensors._on_power_data(event_count, None, 90, accumulated_power_watts, power_watts)
+
+    def test_power_events(self):
+        self._page(10, 1000)
+        self._page(11, 1200)
+        self.assertEqual(self.sensors.power_watts, 200)
+        # Two events missed, averaged from the accumulated power:
+        self._page(14, 2100, power_watts=400)
+        self.assertEqual(self.sensors.power_watts, 300)
+        self.assertEqual(len(self.sensors.drain_power_samples()), 3)
+
+    def test_repeated_pages_over_rollover(self):
+        # Pages repeat until the next event, including when the count rolls over to 0:
+        accumulated = 0
+        for event_count in [254, 254, 255, 255, 0, 0, 0, 1, 1]:
+            if self.sensors._power_event_count != event_count:
+                accumulated += 250
+            self._page(event_count, accumulated % 65536, power_watts=250)
+            self.assertFalse(math.isnan(self.sensors.power_watts))
+            self.assertEqual(self.sensors.power_watts, 250)
+        samples = self.sensors.drain_power_samples()
+        self.assertEqual(list(samples["event_count"]), [254, 255, 0, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,6 @@
 import unittest
-from pmtrainer.bike_sim import BikeSim
+import numpy as np
+from pmtrainer.bike_sim import BikeSim, BikeSimBatch
 
 class TestBikeSim(unittest.TestCase):
 
@@ -34,6 +35,32 @@ class TestBikeSim(unittest.TestCase):
         with self.assertRaises(ValueError):
             self._pow_test(10001)
 
+    def _ride(self, tick_s, duration_s=60, power=300):
+        sim = BikeSim(weight_kg=80)
+        for i in range(int(round(duration_s / tick_s)) + 1):
+            sim.update(power, i * tick_s)
+        return sim
+
+    def test_update_rate(self):
+        # Results shouldn't depend on how often the sim is updated:
+        reference = self._ride(0.1)
+        for tick_s in [0.05, 0.25, 1.0, 5.0]:
+            sim = self._ride(tick_s)
+            self.assertAlmostEqual(sim.speed_mps, reference.speed_mps, places=6)
+            self.assertAlmostEqual(sim.total_distance_m, reference.total_distance_m, places=4)
+
+    def test_stall(self):
+        # A late update is simulated in steps, so the speed doesn't overshoot:
+        steady = self._ride(0.1, duration_s=300).speed_mps
+        self.sim.update(300, 0)
+        self.sim.update(300, 20)
+        self.assertLess(self.sim.speed_mps, steady)
+        self.assertAlmostEqual(self.sim.speed_mps, self._ride(0.1, duration_s=20).speed_mps)
+        # A very late update is covered at the speed reached after the substep limit:
+        self.sim.update(300, 3620)
+        self.assertAlmostEqual(self.sim.speed_mps, steady, delta=0.05)
+        self.assertAlmostEqual(self.sim.total_distance_m, steady * 3620, delta=steady * 60)
+
     def test_properties(self):
         # Test that all property accessors work as expected
         self.assertEqual(0.0, self.sim.speed_mps)
@@ -45,3 +72,103 @@ class TestBikeSim(unittest.TestCase):
         self.assertNotEqual(0.0, self.sim.speed_miph)
         self.assertNotEqual(0.0, self.sim.total_distance_m)
         self.assertNotEqual(0.0, self.sim.total_distance_mi)
+
+
+class TestBikeSimBatch(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.n = 20
+        self.weights = rng.uniform(50, 120, self.n)
+        self.times = np.cumsum(rng.uniform(0.05, 2.0, 300))
+        self.powers = rng.uniform(-100, 800, (300, self.n))
+        self.powers[100:150] = 0
+
+    def test_matches_scalar(self):
+        # Every rider's numbers should be exactly those of the scalar model:
+        sims = [BikeSim(weight_kg=w) for w in self.weights]
+        batch = BikeSimBatch(self.n, weight_kg=self.weights)
+        for t, powers in zip(self.times, self.powers):
+            batch.update(powers, t)
+            for sim, power in zip(sims, powers):
+                sim.update(power, t)
+            np.testing.assert_array_equal(batch.speed_mps, [sim.speed_mps for sim in sims])
+        np.testing.assert_array_equal(batch.total_distance_m,
+                                      [sim.total_distance_m for sim in sims])
+        np.testing.assert_array_equal(batch.speed_miph, [sim.speed_miph for sim in sims])
+        np.testing.assert_array_equal(batch.total_distance_mi,
+                                      [sim.total_distance_mi for sim in sims])
+
+    def test_run(self):
+        sim = BikeSim(weight_kg=self.weights[3])
+        speeds, distances = BikeSimBatch(self.n, weight_kg=self.weights).run(
+            self.powers, self.times)
+        self.assertEqual(speeds.shape, self.powers.shape)
+        for i, (t, power) in enumerate(zip(self.times, self.powers[:, 3])):
+            sim.update(power, t)
+            self.assertEqual(speeds[i, 3], sim.speed_mps)
+            self.assertEqual(distances[i, 3], sim.total_distance_m)
+
+    def test_steady_state(self):
+        batch = BikeSimBatch(3, weight_kg=80)
+        batch.run(np.full((99, 3), 200), np.arange(1, 100))
+        np.testing.assert_array_almost_equal(batch.speed_miph, [20.67] * 3, decimal=2)
+        batch.weight_kg = [60, 80, 100]
+        self.assertEqual(list(batch.weight_kg), [60, 80, 100])
+
+    def test_high_power(self):
+        with self.assertRaises(ValueError):
+            BikeSimBatch(2).update([100, 10001], 1)
+
+    def test_riders(self):
+        # Riders added over time, each updated on some steps but not others, and
+        # released and replaced, match scalar sims updated on the same steps:
+        batch = BikeSimBatch()
+        sims, riders = [], []
+        rng = np.random.default_rng(3)
+        for step, (t, powers) in enumerate(zip(self.times, self.powers)):
+            if step % 15 == 0 and len(riders) < self.n:
+                weight = self.weights[len(riders)]
+                sims.append(BikeSim(weight_kg=weight))
+                riders.append(batch.add_rider(weight))
+            if step == 200:
+                released = riders[2]
+                released.release()
+                final = (released.speed_mps, released.total_distance_m)
+                sims[2] = BikeSim(weight_kg=70)
+                riders[2] = batch.add_rider(70)
+                self.assertEqual(riders[2].index, released.index)
+                self.assertEqual(riders[2].total_distance_m, 0)
+            updated = [i for i in range(len(riders)) if rng.random() < 0.7]
+            batch.update(powers[updated], t, riders=[riders[i].index for i in updated])
+            for i in updated:
+                sims[i].update(powers[i], t)
+            riders[0].update(powers[0], t + 0.05)
+            sims[0].update(powers[0], t + 0.05)
+        self.assertEqual(len(batch), self.n)
+        for sim, rider in zip(sims, riders):
+            self.assertEqual(rider.speed_mps, sim.speed_mps)
+            self.assertEqual(rider.total_distance_m, sim.total_distance_m)
+            self.assertEqual(rider.weight_kg, sim.weight_kg)
+            self.assertEqual(rider.grade, 0)
+        # A released rider keeps its final state, whatever happens to its place:
+        self.assertEqual((released.speed_mps, released.total_distance_m), final)
+        with self.assertRaises(ValueError):
+            released.update(200, 1000)
+        riders[1].weight_kg = 90
+        self.assertEqual(batch.weight_kg[riders[1].index], 90)
+        self.assertNotEqual(batch.weight_kg[riders[2].index], 90)
+
+    def test_substeps(self):
+        # Riders updated at different times, and hitting the substep limit:
+        sims = [BikeSim(weight_kg=w, max_substeps=50) for w in self.weights]
+        batch = BikeSimBatch(self.n, weight_kg=self.weights, max_substeps=50)
+        times = np.cumsum(np.random.default_rng(2).uniform(0, 8, (300, self.n)), axis=0)
+        for t, powers in zip(times, self.powers):
+            batch.update(powers, t)
+            for sim, power, t_s in zip(sims, powers, t):
+                sim.update(power, t_s)
+        np.testing.assert_array_equal(batch.speed_mps, [sim.speed_mps for sim in sims])
+        np.testing.assert_array_equal(batch.total_distance_m,
+                                      [sim.total_distance_m for sim in sims])
+
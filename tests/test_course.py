@@ -0,0 +1,169 @@
+import datetime as dt
+import os
+import tempfile
+import unittest
+import numpy as np
+from pmtrainer.bike_sim import BikeSim, BikeSimBatch, G_MPS2, CRR, AERO_DRAG_COEFF, LOSS
+from pmtrainer.course import Course, path_distance_m
+from pmtrainer.sensors import SensorStatus
+from pmtrainer.tcx_file import Tcx, Point
+from pmtrainer.trainer_engine import TrainerEngine
+from pmtrainer.workout_profile import Workout
+
+HILL_GPX = "tests/fixtures/sample_courses/hill.gpx"
+WORKOUT_FILE = "tests/fixtures/sample_workouts/test_workout.yaml"
+
+
+class ConstantSensors():
+    '''
+    Sensor source with constant readings.
+    '''
+    def __init__(self, power_watts=200):
+        self.heartrate_bpm = 120
+        self.power_watts = power_watts
+        self.cadence_rpm = 90
+        self.heart_rate_status = SensorStatus.State.CONNECTED
+        self.power_meter_status = SensorStatus.State.CONNECTED
+
+    def update(self, elapsed_s):
+        pass
+
+
+class TestCourse(unittest.TestCase):
+
+    def test_constant_grade(self):
+        course = Course([0, 100, 200, 300], [0, 5, 10, 15])
+        self.assertEqual(course.length_m, 300)
+        for d in [0, 50, 150, 299]:
+            self.assertAlmostEqual(course.grade_at(d), 0.05)
+        self.assertEqual(course.grade_at(300), 0.0) # Flat past the finish
+        self.assertAlmostEqual(course.altitude_at(150), 7.5)
+        self.assertAlmostEqual(course.altitude_at(1000), 15)
+        self.assertEqual(course.position_at(150), (None, None))
+
+    def test_lookup(self):
+        rng = np.random.default_rng(1)
+        distance = np.cumsum(rng.uniform(1, 20, 10000))
+        course = Course(distance, np.cumsum(rng.normal(0, 0.5, 10000)))
+        queries = rng.uniform(-10, course.length_m + 10, 1000)
+        grades = course.grades_at(queries)
+        for d, grade in zip(queries, grades):
+            # The binary search should agree with a linear scan for the segment:
+            i = max(np.count_nonzero(course.distance_m[:-1] <= d) - 1, 0)
+            expected = 0.0 if d >= course.length_m else course.grade[i]
+            self.assertEqual(course.grade_at(d), expected)
+            self.assertEqual(grade, expected)
+
+    def test_smoothing(self):
+        # A one point spike in altitude should be spread out and limited:
+        distance = np.arange(0, 200, 2.0)
+        altitude = np.zeros(len(distance))
+        altitude[50] = 5
+        course = Course(distance, altitude)
+        self.assertLessEqual(np.max(np.abs(course.grade)), 0.3)
+        self.assertGreater(np.count_nonzero(course.grade), 2)
+        self.assertEqual(course.grade_at(10), 0.0)
+
+    def test_bad_points(self):
+        course = Course([0, 10, 10, np.nan, 5, 20], [1, 2, 3, 4, 5, 6])
+        np.testing.assert_array_equal(course.distance_m, [0, 10, 20])
+        np.testing.assert_array_equal(course.altitude_m, [1, 2, 6])
+        with self.assertRaises(ValueError):
+            Course([0, 10], [1, np.nan])
+
+    def test_gpx(self):
+        course = Course.from_file(HILL_GPX)
+        self.assertEqual(course.name, "hill")
+        # 27 steps of 0.001 degrees of latitude:
+        self.assertAlmostEqual(course.length_m, 27 * 111.19, delta=5)
+        self.assertAlmostEqual(course.grade_at(500), 0.0)
+        self.assertAlmostEqual(course.grade_at(1500), 0.05, delta=0.001)
+        self.assertAlmostEqual(course.grade_at(2500), -0.05, delta=0.001)
+        self.assertAlmostEqual(course.altitude_at(course.distance_m[17]), 150, delta=0.1)
+        lat, lon = course.position_at(course.length_m / 2)
+        self.assertAlmostEqual(lat, 30.0135, places=3)
+        self.assertAlmostEqual(lon, -97.7)
+
+    def test_tcx(self):
+        distance = path_distance_m([30.0, 30.001, 30.002], [-97.7, -97.7, -97.7])
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, "course.tcx")
+            log = Tcx()
+            log.start_log(fname)
+            log.start_activity(activity_type=Tcx.ActivityType.BIKING,
+                               start_time="2021-01-01T00:00:00Z")
+            for i in range(3):
+                log.add_point(Point(time="2021-01-01T00:00:{:02d}Z".format(i),
+                                    lat_deg=30.0 + 0.001 * i, lon_deg=-97.7,
+                                    altitude_m=100.0 + 10 * i, distance_m=distance[i]))
+            log.close_log()
+            course = Course.from_file(fname)
+        self.assertAlmostEqual(course.length_m, distance[-1], places=3)
+        self.assertAlmostEqual(course.grade_at(50), 10 / distance[1], places=3)
+
+
+class TestCourseSim(unittest.TestCase):
+
+    def _ride(self, course, power=250, duration_s=600):
+        sim = BikeSim(weight_kg=80, course=course)
+        for t in range(duration_s + 1):
+            sim.update(power, t)
+        return sim
+
+    def test_climb(self):
+        flat = self._ride(None)
+        climb = self._ride(Course([0, 1e5], [0, 5e3]))
+        descent = self._ride(Course([0, 1e5], [0, -5e3]))
+        self.assertLess(climb.total_distance_m, flat.total_distance_m)
+        self.assertGreater(descent.total_distance_m, flat.total_distance_m)
+        self.assertAlmostEqual(climb.grade, 0.05)
+        # Steady speed on a 5% grade, where power balances gravity, rolling and drag:
+        v = climb.speed_mps
+        forces = (80 * G_MPS2 * 0.05 / np.sqrt(1.0025) + 80 * G_MPS2 * CRR +
+                  AERO_DRAG_COEFF * v * v)
+        self.assertAlmostEqual(250 * (1 - LOSS), forces * v, delta=1)
+
+    def test_batch(self):
+        course = Course.from_file(HILL_GPX)
+        powers = np.linspace(150, 350, 4)
+        batch = BikeSimBatch(4, weight_kg=80, course=course)
+        sims = [BikeSim(weight_kg=80, course=course) for _ in powers]
+        for t in range(900):
+            batch.update(powers, t)
+            for sim, power in zip(sims, powers):
+                sim.update(power, t)
+        np.testing.assert_array_equal(batch.total_distance_m,
+                                      [sim.total_distance_m for sim in sims])
+        np.testing.assert_array_equal(batch.grade, [sim.grade for sim in sims])
+
+    def test_engine_log(self):
+        course = Course.from_file(HILL_GPX)
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, "ride.tcx")
+            log = Tcx()
+            log.start_log(fname)
+            log.start_activity(activity_type=Tcx.ActivityType.OTHER)
+            engine = TrainerEngine(ConstantSensors(), Workout(WORKOUT_FILE), log, course=course)
+            engine.start(dt.datetime(2021, 1, 1))
+            for _ in range(600):
+                engine.step(0.5)
+            log.close_log()
+            self.assertNotEqual(engine.grade, 0.0)
+
+            log = Tcx()
+            log.open_log(fname)
+            point = log.get_next_point()
+            points = 0
+            while point is not None:
+                self.assertAlmostEqual(point.altitude_m, course.altitude_at(point.distance_m),
+                                       delta=0.1)
+                lat, lon = course.position_at(point.distance_m)
+                self.assertAlmostEqual(point.lat_deg, lat, places=4)
+                self.assertAlmostEqual(point.lon_deg, lon, places=4)
+                points += 1
+                point = log.get_next_point()
+        self.assertGreater(points, 250)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+import tempfile
+import os
+import numpy as np
+from pmtrainer.tcx_file import Tcx, Point
+from pmtrainer.fit_file import write_fit, read_fit, read_fit_messages, FitError, \
+                               MESG_LAP, MESG_RECORD
+
+class TestFitFile(unittest.TestCase):
+    def setUp(self):
+        self.fixture_path = os.path.dirname(__file__) + "/fixtures/sample_tcx_files/"
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.fname = self.tmp_dir.name + "/test.fit"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _assert_columns_equal(self, expected, actual):
+        self.assertEqual(len(expected), len(actual))
+        tolerances = {"time": 0, "lat_deg": 1e-6, "lon_deg": 1e-6, "altitude_m": 0.1,
+                      "distance_m": 0.005, "heartrate_bpm": 0, "cadence_rpm": 0,
+                      "speed_mps": 0.0005, "power_watts": 0}
+        for column, tol in tolerances.items():
+            np.testing.assert_allclose(actual.column(column), expected.column(column),
+                                       rtol=0, atol=tol, err_msg=column)
+
+    def test_round_trip_fixture(self):
+        tcx = Tcx()
+        tcx.open_log(self.fixture_path + "20210325_160413.tcx")
+        self.assertIsNotNone(tcx.get_next_point()) # Load points
+        write_fit(self.fname, tcx.trackpoints)
+        self._assert_columns_equal(tcx.trackpoints, read_fit(self.fname))
+        # Binary file should be much smaller than the xml:
+        self.assertLess(os.path.getsize(self.fname) * 10,
+                        os.path.getsize(self.fixture_path + "20210325_160413.tcx"))
+
+    def test_export_from_log(self):
+        tcx = Tcx()
+        tcx.start_log(self.tmp_dir.name + "/test.tcx")
+        tcx.start_activity(activity_type=Tcx.ActivityType.OTHER)
+        tcx.add_point(Point(time="2021-03-11T21:26:53Z", lat_deg=51.50146,
+                            lon_deg=-0.140233, altitude_m=12.2, distance_m=2.0,
+                            heartrate_bpm=92, cadence_rpm=39, speed_mps=1.25, power_watts=92))
+        tcx.add_point(Point(time="2021-03-11T21:26:54Z", heartrate_bpm=93))
+        tcx.set_lap_stats(total_time_s=100, distance_m=150.5)
+        tcx.export_fit(self.fname)
+        self._assert_columns_equal(tcx.trackpoints, read_fit(self.fname))
+        laps = [m for num, m in read_fit_messages(self.fname) if num == MESG_LAP]
+        self.assertEqual(len(laps), 1)
+        self.assertEqual(laps[0][7], 100000) # Total elapsed time, ms
+        self.assertEqual(laps[0][9], 15050) # Total distance, cm
+        records = [m for num, m in read_fit_messages(self.fname) if num == MESG_RECORD]
+        self.assertIsNone(records[1][7]) # Missing power is written as invalid
+
+    def test_invalid_files(self):
+        with self.assertRaises(FileNotFoundError):
+            read_fit("asdf")
+        with self.assertRaises(FitError):
+            read_fit(self.fixture_path + "basic_file_structure_test.tcx")
+        tcx = Tcx()
+        tcx.start_log(self.tmp_dir.name + "/test.tcx")
+        tcx.start_activity(activity_type=Tcx.ActivityType.OTHER)
+        with self.assertRaises(FitError):
+            tcx.export_fit(self.fname) # No points
+        tcx.add_point(Point(power_watts=100))
+        tcx.export_fit(self.fname)
+        with open(self.fname, "r+b") as f:
+            f.seek(20)
+            f.write(b"\x55")
+        with self.assertRaises(FitError):
+            read_fit(self.fname) # Bad CRC
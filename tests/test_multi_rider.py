@@ -0,0 +1,130 @@
+import datetime as dt
+import os
+import tempfile
+import unittest
+from pmtrainer.ant_sensors import HEARTRATE_DEVICE_TYPE, POWER_DEVICE_TYPE
+from pmtrainer.multi_rider import Rider, SensorManager
+from pmtrainer.session_server import SessionServer
+from pmtrainer.sensors import SensorStatus
+from pmtrainer.simulated_ant import SimulatedAntDriver
+from pmtrainer.tcx_file import Tcx
+from pmtrainer.workout_profile import Workout
+
+
+class TestSensorManager(unittest.TestCase):
+    def setUp(self):
+        self.ant_driver = SimulatedAntDriver(num_devices=4, seed=1)
+        self.manager = SensorManager(self.ant_driver)
+
+    def test_channel_limit(self):
+        for i in range(4):
+            self.manager.add_rider(Rider("rider{}".format(i)))
+        with self.assertRaises(ValueError):
+            self.manager.add_rider(Rider("rider4"))
+        manager = SensorManager(SimulatedAntDriver(num_devices=8), max_channels=16)
+        for i in range(8):
+            manager.add_rider(Rider("rider{}".format(i)))
+
+    def test_routing(self):
+        riders = [self.manager.add_rider(Rider("rider{}".format(i))) for i in range(3)]
+        fixed = self.manager.add_rider(Rider("fixed", heartrate_device_number=2003,
+                                             power_device_number=1003))
+        self.manager.connect()
+        self.addCleanup(self.manager.close)
+        self.manager.update(10)
+        # Every rider paired with a different pair of devices, and gets their data:
+        power_devices = {r.power_device_number for r in riders}
+        self.assertEqual(power_devices, {1000, 1001, 1002})
+        self.assertEqual(fixed.power_device_number, 1003)
+        for rider in riders + [fixed]:
+            self.assertIs(self.manager.rider(POWER_DEVICE_TYPE, rider.power_device_number), rider)
+            self.assertIs(self.manager.rider(HEARTRATE_DEVICE_TYPE,
+                                             rider.heartrate_device_number), rider)
+            self.assertEqual(rider.power_meter_status, SensorStatus.State.CONNECTED)
+            self.assertAlmostEqual(len(rider.drain_power_samples()), 40, delta=2)
+        self.assertIsNone(self.manager.rider(POWER_DEVICE_TYPE, 1234))
+        self.assertIsNone(self.manager.rider(HEARTRATE_DEVICE_TYPE, 1000))
+
+    def test_shared_device_number(self):
+        # Device numbers are only unique within a device type, so a heartrate
+        # monitor and a power meter can have the same number:
+        for device in self.ant_driver.devices:
+            if device.device_type == HEARTRATE_DEVICE_TYPE:
+                device.device_number -= 1000
+        first = self.manager.add_rider(Rider("first", power_device_number=1000,
+                                             heartrate_device_number=1001))
+        second = self.manager.add_rider(Rider("second", power_device_number=1001,
+                                              heartrate_device_number=1000))
+        self.assertIs(self.manager.rider(POWER_DEVICE_TYPE, 1000), first)
+        self.assertIs(self.manager.rider(HEARTRATE_DEVICE_TYPE, 1000), second)
+        others = [self.manager.add_rider(Rider("rider{}".format(i))) for i in range(2)]
+        self.manager.connect()
+        self.addCleanup(self.manager.close)
+        self.manager.update(10)
+        # Riders paired with any device still get their own devices of each type:
+        self.assertEqual({r.power_device_number for r in others},
+                         {r.heartrate_device_number for r in others})
+        for rider in [first, second] + others:
+            self.assertIs(self.manager.rider(POWER_DEVICE_TYPE, rider.power_device_number), rider)
+            self.assertIs(self.manager.rider(HEARTRATE_DEVICE_TYPE,
+                                             rider.heartrate_device_number), rider)
+            self.assertEqual(rider.power_meter_status, SensorStatus.State.CONNECTED)
+            self.assertEqual(rider.heart_rate_status, SensorStatus.State.CONNECTED)
+
+    def test_missing_sensor(self):
+        self.manager.search_timeout_sec = 5
+        riders = [self.manager.add_rider(Rider("rider{}".format(i))) for i in range(3)]
+        missing = self.manager.add_rider(Rider("missing", power_device_number=4321))
+        self.manager.connect()
+        self.addCleanup(self.manager.close)
+        self.manager.update(10)
+        self.assertEqual(self.ant_driver.errors, [])
+        self.assertEqual(missing.power_meter_status, SensorStatus.State.NOTCONNECTED)
+        self.assertEqual(missing.heart_rate_status, SensorStatus.State.CONNECTED)
+        self.assertEqual(riders[0].power_meter_status, SensorStatus.State.CONNECTED)
+
+
+class TestGroupSession(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.workout = Workout(os.path.dirname(__file__) +
+                               "/fixtures/sample_workouts/test_workout.yaml")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_session_server(self):
+        # The sensor manager's riders are the sensors of sessions on a server:
+        ant_driver = SimulatedAntDriver(num_devices=2, seed=2)
+        manager = SensorManager(ant_driver)
+        light = manager.add_rider(Rider("light", weight_kg=60))
+        heavy = manager.add_rider(Rider("heavy", weight_kg=100))
+        manager.connect()
+        server = SessionServer(log_dir=self.tmp_dir.name)
+        start_time = dt.datetime.utcfromtimestamp(ant_driver.start_epoch_s)
+        sessions = [server.add_session(rider.name, rider, self.workout, weight_kg=rider.weight_kg,
+                                       duration_s=60, start_time=start_time, replay=True)
+                    for rider in manager.riders]
+        server.run(realtime=False)
+        server.close()
+        manager.close()
+
+        light_engine, heavy_engine = [s.engine for s in sessions]
+        self.assertIs(light_engine.sensors, light)
+        self.assertIs(heavy_engine.sensors, heavy)
+        # Same power, so the lighter rider goes further:
+        self.assertGreater(light_engine.sim.total_distance_m, heavy_engine.sim.total_distance_m)
+        logs = sorted(os.listdir(self.tmp_dir.name))
+        self.assertEqual(len(logs), 2) # Journals are removed once the logs are closed
+        self.assertTrue(logs[0].endswith("_heavy.tcx"))
+        for log in logs:
+            tcx = Tcx()
+            tcx.open_log(os.path.join(self.tmp_dir.name, log))
+            points = 0
+            while tcx.get_next_point() is not None:
+                points += 1
+            self.assertAlmostEqual(points, 60, delta=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
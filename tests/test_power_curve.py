@@ -0,0 +1,71 @@
+import os
+import unittest
+import numpy as np
+from pmtrainer.power_curve import PowerCurve, mean_max_power, resample_1hz
+from pmtrainer.tcx_file import Tcx
+
+TCX_FILE = os.path.dirname(__file__) + "/fixtures/sample_tcx_files/20210325_160413.tcx"
+
+
+def _naive_mmp(power, duration_s):
+    if duration_s > len(power):
+        return None
+    return max(np.mean(power[i:i + duration_s]) for i in range(len(power) - duration_s + 1))
+
+
+class TestPowerCurve(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.power = np.clip(rng.normal(200, 100, 1500), 0, None)
+        self.durations = (1, 5, 60, 300, 1200, 3600)
+
+    def test_mean_max_power(self):
+        curve = mean_max_power(self.power, self.durations)
+        for d in self.durations:
+            expected = _naive_mmp(self.power, d)
+            if expected is None:
+                self.assertIsNone(curve[d])
+            else:
+                self.assertAlmostEqual(curve[d], expected, places=6)
+        self.assertAlmostEqual(curve[1], np.max(self.power), places=6)
+
+    def test_live_curve(self):
+        live = PowerCurve(self.durations)
+        for i, p in enumerate(self.power):
+            live.add(p)
+            if i == 299:
+                self.assertAlmostEqual(live.best(300), np.mean(self.power[:300]))
+                self.assertIsNone(live.best(1200))
+        batch = mean_max_power(self.power, self.durations)
+        for d in self.durations:
+            if batch[d] is None:
+                self.assertIsNone(live.best(d))
+            else:
+                self.assertAlmostEqual(live.best(d), batch[d], places=6)
+        live.reset()
+        self.assertIsNone(live.curve[1])
+
+    def test_gaps(self):
+        live = PowerCurve((1, 5))
+        for p in [300, None, 300, float("nan"), 300]:
+            live.add(p)
+        # Missing seconds count as zero:
+        self.assertEqual(live.best(5), 180)
+        np.testing.assert_array_equal(
+            resample_1hz([0, 1, 3, 30], [100, 200, 300, 400], max_hold_s=10),
+            [100, 200, 200, 300] + [300] * 9 + [0] * 17 + [400])
+
+    def test_tcx(self):
+        for streaming in [False, True]:
+            log = Tcx()
+            log.open_log(TCX_FILE, streaming=streaming)
+            curve = log.power_curve()
+            self.assertIsNone(curve[3600])
+            self.assertGreater(curve[1], curve[60])
+            self.assertGreaterEqual(curve[60], curve[1200])
+            if not streaming:
+                self.assertEqual(curve[1], np.nanmax(log.trackpoints.column("power_watts")))
+
+
+if __name__ == "__main__":
+    unittest.main()
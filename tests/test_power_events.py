@@ -0,0 +1,68 @@
+import unittest
+import numpy as np
+from pmtrainer.power_events import interval_power, PowerReconstructor
+from pmtrainer.ring_buffer import RingBuffer
+from pmtrainer.sensors import POWER_SAMPLE_FIELDS
+
+
+def make_events(powers, rate_hz=4.0, start_count=0, start_accumulated=0):
+    '''
+    Returns power meter samples for a sequence of per-event powers, as drained from a sensor.
+    '''
+    buffer = RingBuffer(POWER_SAMPLE_FIELDS, capacity=len(powers))
+    accumulated = start_accumulated
+    for i, power in enumerate(powers):
+        accumulated = (accumulated + power) % 65536
+        buffer.push((start_count + i + 1) % 256, 90, accumulated, power, time_s=(i + 1) / rate_hz)
+    return buffer.drain()
+
+
+class TestPowerEvents(unittest.TestCase):
+    def test_interval_power(self):
+        d_events, power = interval_power([10, 11, 14, 14], [1000, 1200, 1800, 1800])
+        np.testing.assert_array_equal(d_events, [1, 3, 0])
+        np.testing.assert_array_equal(power[:2], [200, 200])
+        self.assertTrue(np.isnan(power[2]))
+
+    def test_rollover(self):
+        d_events, power = interval_power([254, 1], [65500, 564])
+        self.assertEqual(d_events[0], 3)
+        self.assertEqual(power[0], 200)
+
+    def test_missed_events(self):
+        samples = make_events([100] * 20 + [300] * 20, start_count=250, start_accumulated=65000)
+        received = samples[np.arange(len(samples)) % 3 == 0] # Only every third event received
+        reconstructor = PowerReconstructor()
+        self.assertIsNone(reconstructor.update(received[:1]))
+        # Average across all events after the first, including missed ones:
+        self.assertAlmostEqual(reconstructor.update(received[1:]), (100 * 19 + 300 * 20) / 39)
+        self.assertEqual(reconstructor.missed_events, 39 - len(received[1:]))
+
+    def test_batches(self):
+        samples = make_events([200] * 40)
+        reconstructor = PowerReconstructor()
+        for i in range(0, 40, 7):
+            self.assertAlmostEqual(reconstructor.update(samples[i:i + 7]), 200)
+
+    def test_1hz_stream(self):
+        samples = make_events([100] * 20 + [300] * 20)
+        reconstructor = PowerReconstructor()
+        reconstructor.update(samples[::5]) # Big gaps between received events
+        times, powers = reconstructor.drain_1hz()
+        np.testing.assert_array_equal(times, np.arange(0, 9))
+        np.testing.assert_allclose(powers[:4], 100)
+        np.testing.assert_allclose(powers[6:], 300)
+        self.assertEqual(len(reconstructor.drain_1hz()[0]), 0)
+
+    def test_long_gap(self):
+        reconstructor = PowerReconstructor(max_gap_s=2)
+        samples = make_events([200] * 8)
+        samples["time"][4:] += 10 # A 10s dropout
+        reconstructor.update(samples)
+        _, powers = reconstructor.drain_1hz()
+        self.assertTrue(np.all(np.isnan(powers[2:11])))
+        self.assertEqual(powers[0], 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
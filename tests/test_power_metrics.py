@@ -0,0 +1,81 @@
+import math
+import unittest
+import numpy as np
+from pmtrainer.power_metrics import PowerMetrics, RollingMean
+
+
+class TestRollingMean(unittest.TestCase):
+    def test_window(self):
+        avg = RollingMean(3)
+        self.assertIsNone(avg.mean)
+        avg.add(3)
+        self.assertEqual(avg.mean, 3)
+        for v in [6, 9, 12]:
+            avg.add(v)
+        self.assertTrue(avg.full)
+        self.assertEqual(avg.mean, 9)
+
+    def test_no_drift(self):
+        # Large values added and removed many times shouldn't leave rounding errors:
+        rng = np.random.default_rng(1)
+        values = rng.uniform(0, 1e12, 100000)
+        avg = RollingMean(30)
+        for v in values:
+            avg.add(v)
+        self.assertAlmostEqual(avg.mean, np.mean(values[-30:]), delta=1e-3)
+
+
+class TestPowerMetrics(unittest.TestCase):
+    def test_constant_power(self):
+        metrics = PowerMetrics(ftp_watts=250)
+        for _ in range(3600):
+            metrics.add(250)
+        for window in [3, 10, 30]:
+            self.assertAlmostEqual(metrics.average_watts(window), 250)
+        self.assertAlmostEqual(metrics.normalized_power_watts, 250)
+        self.assertAlmostEqual(metrics.intensity_factor, 1.0)
+        # An hour at FTP is 100 TSS:
+        self.assertAlmostEqual(metrics.tss, 100)
+
+    def test_against_rescan(self):
+        rng = np.random.default_rng(2)
+        power = np.clip(rng.normal(200, 80, 2000), 0, None)
+        metrics = PowerMetrics(ftp_watts=220)
+        for p in power:
+            metrics.add(p)
+        rolling = np.convolve(power, np.ones(30) / 30, mode="valid")
+        normalized = np.mean(rolling ** 4) ** 0.25
+        self.assertAlmostEqual(metrics.normalized_power_watts, normalized, places=6)
+        self.assertAlmostEqual(metrics.average_watts(3), np.mean(power[-3:]))
+        self.assertAlmostEqual(metrics.average_watts(10), np.mean(power[-10:]))
+        self.assertAlmostEqual(metrics.avg_power_watts, np.mean(power))
+        self.assertEqual(metrics.max_power_watts, np.max(power))
+        self.assertAlmostEqual(metrics.tss, 2000 / 3600 * (normalized / 220) ** 2 * 100)
+
+    def test_from_ride(self):
+        rng = np.random.default_rng(3)
+        power = np.clip(rng.normal(180, 90, 3000), 0, None)
+        power[100:150] = np.nan
+        live = PowerMetrics(ftp_watts=200)
+        for p in power:
+            live.add(p)
+        ride = PowerMetrics.from_ride(power, ftp_watts=200)
+        for key, value in live.summary().items():
+            self.assertAlmostEqual(ride.summary()[key], value, places=6)
+        self.assertIsNone(PowerMetrics.from_ride([]).tss)
+
+    def test_gaps_and_startup(self):
+        metrics = PowerMetrics()
+        for p in [None, math.nan, 100]:
+            metrics.add(p)
+        self.assertEqual(metrics.duration_s, 1)
+        self.assertEqual(metrics.average_watts(30), 100)
+        # NP needs a full 30s window:
+        self.assertIsNone(metrics.normalized_power_watts)
+        self.assertIsNone(metrics.tss)
+        metrics.reset()
+        self.assertIsNone(metrics.avg_power_watts)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import csv
+import gzip
+import os
+import tempfile
+import unittest
+from pmtrainer.replay import replay_rides, replay_output_name, SUMMARY_FILE_NAME
+from pmtrainer.tcx_file import Tcx
+from pmtrainer.workout_profile import Workout
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.fixture_path = os.path.dirname(__file__) + "/fixtures/"
+        self.workout = Workout(self.fixture_path + "sample_workouts/test_workout.yaml")
+        self.ride = self.fixture_path + "sample_tcx_files/20210325_160413.tcx"
+
+    def test_output_name(self):
+        self.assertEqual(replay_output_name("/a/ride.tcx.gz", "/out"), "/out/ride_replay.tcx")
+        self.assertEqual(replay_output_name("ride.tcx", "/out", "tcx.gz"),
+                         "/out/ride_replay.tcx.gz")
+
+    def test_replay_rides(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bad_file = tmp_dir + "/bad.tcx"
+            with open(bad_file, "w") as f:
+                f.write("not xml")
+            truncated_file = tmp_dir + "/truncated.tcx.gz"
+            with open(self.ride, "rb") as f:
+                data = gzip.compress(f.read())
+            with open(truncated_file, "wb") as f:
+                f.write(data[:len(data) // 2])
+            summaries = replay_rides([self.ride, bad_file, truncated_file], tmp_dir + "/out",
+                                     self.workout)
+            self.assertEqual(len(summaries), 1)
+            summary = summaries[0]
+            self.assertGreater(summary["points"], 2900)
+            self.assertGreater(summary["time_s"], 50 * 60)
+            self.assertGreater(summary["distance_m"], 20000)
+            self.assertEqual(summary["max_power_watts"], 255)
+
+            # The regenerated log keeps the original ride's times:
+            log = Tcx()
+            log.open_log(summary["output"])
+            self.assertEqual(log.get_next_point().time[:16], "2021-03-25T23:04")
+            with open(tmp_dir + "/out/" + SUMMARY_FILE_NAME) as f:
+                rows = list(csv.DictReader(f))
+            self.assertEqual(len(rows), 1)
+            self.assertEqual(int(rows[0]["points"]), summary["points"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import datetime as dt
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from pmtrainer.power_metrics import PowerMetrics
+from pmtrainer.ride_history import RideHistory, pack_column, unpack_column, per_second
+from pmtrainer.tcx_file import Tcx, Point
+from pmtrainer.trackpoints import format_time
+from pmtrainer.training_load import TrainingLoad, ride_day
+
+TCX_FILE = os.path.dirname(__file__) + "/fixtures/sample_tcx_files/20210325_160413.tcx"
+
+
+def _write_log(fname, start_s, power_watts, heartrate_bpm=140):
+    log = Tcx()
+    log.start_log(fname)
+    log.start_activity(activity_type=Tcx.ActivityType.OTHER, start_time=format_time(start_s))
+    for i, power in enumerate(power_watts):
+        log.add_point(Point(time=format_time(start_s + i), power_watts=power,
+                            heartrate_bpm=heartrate_bpm, distance_m=8.0 * i))
+    log.close_log()
+
+
+class TestColumns(unittest.TestCase):
+    def test_pack(self):
+        values = np.array([0, 250.4, np.nan, 2000, -5])
+        for dtype in ["<u2", "<f4"]:
+            out = unpack_column(pack_column(values, dtype), dtype)
+            self.assertTrue(np.isnan(out[2]))
+        np.testing.assert_array_equal(unpack_column(pack_column(values, "<u2"), "<u2"),
+                                      [0, 250, np.nan, 2000, 0])
+        # A steady hour of power packs into much less than a byte per second:
+        self.assertLess(len(pack_column(np.full(3600, 200.0), "<u2")), 100)
+
+    def test_per_second(self):
+        np.testing.assert_array_equal(per_second([10, 11, 13.1], [1, 2, 3]),
+                                      [1, 2, np.nan, 3])
+
+
+class TestRideHistory(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_dir = os.path.join(self.tmp_dir.name, "logs")
+        os.makedirs(self.log_dir)
+        self.history = RideHistory(os.path.join(self.tmp_dir.name, "history.db"))
+
+    def tearDown(self):
+        self.history.close()
+        self.tmp_dir.cleanup()
+
+    def test_add_ride(self):
+        fname = os.path.join(self.log_dir, "ride.tcx")
+        start = dt.datetime(2021, 6, 1, 12)
+        power = [200.0] * 600 + [300.0] * 600
+        _write_log(fname, start.replace(tzinfo=dt.timezone.utc).timestamp(), power)
+        ride_id = self.history.add_ride(fname, ftp_watts=250, workout="Short Stack")
+        ride = self.history.ride(fname)
+        expected = PowerMetrics.from_ride(power, ftp_watts=250)
+        self.assertEqual(ride["workout"], "Short Stack")
+        self.assertEqual(ride["duration_s"], 1199)
+        self.assertAlmostEqual(ride["tss"], expected.tss)
+        self.assertAlmostEqual(ride["normalized_power_watts"], expected.normalized_power_watts)
+        self.assertEqual(ride["upload_status"], "NOT_UPLOADED")
+        start_time, columns = self.history.samples(ride_id)
+        self.assertEqual(dt.datetime.utcfromtimestamp(start_time), start)
+        np.testing.assert_array_equal(columns["power_watts"], power)
+        np.testing.assert_array_equal(columns["heartrate_bpm"], 140)
+        self.assertTrue(np.all(np.isnan(columns["altitude_m"])))
+
+        self.history.set_upload_status(fname, RideHistory.UploadStatus.UPLOADED, 1234)
+        ride = self.history.ride(fname)
+        self.assertEqual(ride["upload_status"], "UPLOADED")
+        self.assertEqual(ride["strava_activity_id"], 1234)
+        # Adding it again replaces it:
+        self.history.add_ride(fname, ftp_watts=250, workout="Short Stack")
+        self.assertEqual(len(self.history), 1)
+        self.assertEqual(self.history.db.execute("SELECT COUNT(*) FROM samples").fetchone()[0], 1)
+
+    def test_import_logs(self):
+        start = dt.datetime(2021, 6, 1, tzinfo=dt.timezone.utc).timestamp()
+        for day in range(5):
+            _write_log(os.path.join(self.log_dir, "ride{}.tcx".format(day)),
+                       start + day * 86400, [150 + 10 * day] * 120)
+        shutil.copy(TCX_FILE, self.log_dir)
+        with open(os.path.join(self.log_dir, "broken.tcx"), "w") as f:
+            f.write("<TrainingCenterDatabase>")
+        with open(TCX_FILE, "rb") as f:
+            data = gzip.compress(f.read())
+        with open(os.path.join(self.log_dir, "truncated.tcx.gz"), "wb") as f:
+            f.write(data[:len(data) // 2])
+        added = self.history.import_logs(self.log_dir, ftp_watts=200)
+        self.assertEqual(len(added), 6)
+        self.assertEqual(len(self.history), 6)
+        # Unchanged logs aren't imported again:
+        self.assertEqual(self.history.import_logs(self.log_dir), [])
+
+        rides = self.history.rides(start=dt.datetime(2021, 6, 2), end=dt.datetime(2021, 6, 4))
+        self.assertEqual([r["avg_power_watts"] for r in rides], [160, 170])
+        self.assertEqual(len(self.history.rides(end=start)), 1) # The fixture, from March
+        # The stored training load is kept up to date as rides are added and replaced:
+        days = [ride_day(r["start_time"]) for r in self.history.rides()]
+        expected = TrainingLoad.from_rides(days, [r["tss"] for r in self.history.rides()])
+        load = self.history.training_load(days[-1])
+        self.assertAlmostEqual(load.ctl, expected.ctl)
+        fname = os.path.join(self.log_dir, "ride0.tcx")
+        _write_log(fname, start, [400] * 120)
+        self.history.add_ride(fname, ftp_watts=200)
+        self.history.add_ride(os.path.join(self.log_dir, "ride4.tcx"), ftp_watts=200)
+        expected = TrainingLoad.from_rides(days, [r["tss"] for r in self.history.rides()])
+        load = self.history.training_load(days[-1])
+        self.assertAlmostEqual(load.ctl, expected.ctl)
+        self.assertAlmostEqual(load.atl, expected.atl)
+        plan = " ".join(str(tuple(row)) for row in self.history.db.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM rides WHERE tss > 10"))
+        self.assertIn("rides_tss", plan)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import threading
+import unittest
+import numpy as np
+from pmtrainer.ring_buffer import RingBuffer
+
+
+class TestRingBuffer(unittest.TestCase):
+    def setUp(self):
+        self.buffer = RingBuffer(["power", "cadence"], capacity=4)
+
+    def test_push_drain(self):
+        self.buffer.push(100, 80, time_s=1.0)
+        self.buffer.push(110, None, time_s=2.0)
+        self.assertEqual(len(self.buffer), 2)
+        samples = self.buffer.drain()
+        self.assertEqual(samples.dtype.names, ("time", "power", "cadence"))
+        np.testing.assert_array_equal(samples["time"], [1.0, 2.0])
+        np.testing.assert_array_equal(samples["power"], [100, 110])
+        self.assertTrue(np.isnan(samples["cadence"][1]))
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(len(self.buffer.drain()), 0)
+
+    def test_overwrite_oldest(self):
+        for i in range(10):
+            self.buffer.push(i, i, time_s=i)
+        self.assertEqual(self.buffer.dropped, 6)
+        np.testing.assert_array_equal(self.buffer.drain()["power"], [6, 7, 8, 9])
+        # Wrapped around the end of the storage:
+        for i in range(3):
+            self.buffer.push(i, i)
+        np.testing.assert_array_equal(self.buffer.drain()["power"], [0, 1, 2])
+
+    def test_threaded(self):
+        buffer = RingBuffer(["value"], capacity=100000)
+        count = 20000
+        def producer():
+            for i in range(count):
+                buffer.push(i)
+        thread = threading.Thread(target=producer)
+        thread.start()
+        drained = []
+        while thread.is_alive() or len(buffer):
+            drained.append(buffer.drain()["value"])
+        thread.join()
+        drained.append(buffer.drain()["value"])
+        np.testing.assert_array_equal(np.concatenate(drained), np.arange(count))
+        self.assertEqual(buffer.dropped, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
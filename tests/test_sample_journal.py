@@ -0,0 +1,86 @@
+import unittest
+import tempfile
+import os
+import numpy as np
+from pmtrainer.tcx_file import Tcx, Point, recover_journal
+from pmtrainer.sample_journal import SampleJournal, RECORD_DTYPE
+
+class TestSampleJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_name = self.tmp_dir.name + "/test.tcx"
+        self.points = [Point(time="2021-03-11T21:26:{:02d}Z".format(i), distance_m=10.0 * i,
+                             heartrate_bpm=90 + i, cadence_rpm=80, speed_mps=10.0,
+                             power_watts=200 + i) for i in range(20)]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_write_read(self):
+        journal = SampleJournal(SampleJournal.journal_name(self.log_name), fsync_interval=3)
+        for p in self.points:
+            journal.append(p)
+        journal.append(Point(time="2021-03-11T21:27:00Z"))
+        journal.close(remove=False)
+        trackpoints = SampleJournal.read(journal.file_name)
+        self.assertEqual(len(trackpoints), len(self.points) + 1)
+        for i, p in enumerate(self.points):
+            self.assertEqual(trackpoints.row(i), vars(p))
+        self.assertIsNone(trackpoints.row(-1)["power_watts"])
+        journal.close()
+        self.assertFalse(os.path.exists(journal.file_name))
+
+    def test_partial_record(self):
+        journal = SampleJournal(SampleJournal.journal_name(self.log_name))
+        for p in self.points:
+            journal.append(p)
+        journal.close(remove=False)
+        with open(journal.file_name, "r+b") as f:
+            f.truncate(os.path.getsize(journal.file_name) - RECORD_DTYPE.itemsize // 2)
+        self.assertEqual(len(SampleJournal.read(journal.file_name)), len(self.points) - 1)
+
+    def test_invalid_journal(self):
+        with open(self.log_name, "wb") as f:
+            f.write(b"not a journal")
+        with self.assertRaises(SampleJournal.JournalError):
+            SampleJournal.read(self.log_name)
+
+    def test_truncated_header(self):
+        journal = SampleJournal(SampleJournal.journal_name(self.log_name))
+        journal.close(remove=False)
+        for size in range(4, 8):
+            with open(journal.file_name, "r+b") as f:
+                f.truncate(size)
+            with self.assertRaises(SampleJournal.JournalError):
+                SampleJournal.read(journal.file_name)
+
+    def test_recover_log(self):
+        log = Tcx()
+        log.start_log(self.log_name, streaming=True, journal=True)
+        log.start_activity(activity_type=Tcx.ActivityType.OTHER)
+        for p in self.points:
+            log.add_point(p)
+        # Simulate a crash before the log is flushed or closed:
+        self.assertEqual(SampleJournal.find_unfinished(self.tmp_dir.name),
+                         [SampleJournal.journal_name(self.log_name)])
+        self.assertEqual(recover_journal(SampleJournal.journal_name(self.log_name)),
+                         self.log_name)
+        self.assertEqual(SampleJournal.find_unfinished(self.tmp_dir.name), [])
+
+        recovered = Tcx()
+        recovered.open_log(self.log_name)
+        for p in self.points:
+            self.assertEqual(vars(recovered.get_next_point()), vars(p))
+        with open(self.log_name) as f:
+            contents = f.read()
+        self.assertIn("<TotalTimeSeconds>19</TotalTimeSeconds>", contents)
+        self.assertIn("<DistanceMeters>190.0</DistanceMeters>", contents)
+
+    def test_clean_close(self):
+        log = Tcx()
+        log.start_log(self.log_name, streaming=True, journal=True)
+        log.start_activity(activity_type=Tcx.ActivityType.OTHER)
+        log.add_point(self.points[0])
+        log.close_log()
+        self.assertEqual(SampleJournal.find_unfinished(self.tmp_dir.name), [])
+        np.testing.assert_array_equal(log.trackpoints.column("power_watts"), [200])
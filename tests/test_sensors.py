@@ -0,0 +1,47 @@
+import os
+import unittest
+import numpy as np
+from pmtrainer.sensors import SensorStatus, ReplaySensors
+
+
+class TestSensorStatus(unittest.TestCase):
+    def test_states(self):
+        status = SensorStatus(fresh_time_s=15)
+        self.assertEqual(status.state, SensorStatus.State.NOTCONNECTED)
+        status.make_fresh()
+        self.assertEqual(status.state, SensorStatus.State.CONNECTED)
+        status.make_disconnected()
+        self.assertEqual(status.state, SensorStatus.State.NOTCONNECTED)
+
+    def test_stale(self):
+        status = SensorStatus(fresh_time_s=-1)
+        status.make_fresh()
+        self.assertEqual(status.state, SensorStatus.State.STALE)
+
+
+class TestReplaySensors(unittest.TestCase):
+    def setUp(self):
+        self.sensors = ReplaySensors(os.path.dirname(__file__) +
+                                     "/fixtures/sample_tcx_files/20210325_160413.tcx")
+
+    def test_replay(self):
+        self.assertIsNone(self.sensors.power_watts)
+        self.assertEqual(self.sensors.power_meter_status, SensorStatus.State.NOTCONNECTED)
+        self.sensors.update(0)
+        self.assertEqual(self.sensors.heartrate_bpm, 89)
+        self.assertEqual(self.sensors.heart_rate_status, SensorStatus.State.CONNECTED)
+        self.sensors.update(600)
+        self.assertIsNotNone(self.sensors.power_watts)
+        self.assertFalse(self.sensors.finished)
+        samples = self.sensors.drain_power_samples()
+        self.assertGreater(len(samples), 100)
+        self.assertTrue(np.all(np.diff(samples["time"]) > 0))
+        self.assertEqual(samples["instantaneous_power_watts"][-1], self.sensors.power_watts)
+        self.assertEqual(len(self.sensors.drain_power_samples()), 0)
+        self.sensors.update(1e6)
+        self.assertTrue(self.sensors.finished)
+        self.assertEqual(self.sensors.heartrate_bpm, 147)
+
+
+if __name__ == "__main__":
+    unittest.main()
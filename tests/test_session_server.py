@@ -0,0 +1,138 @@
+import datetime as dt
+import os
+import tempfile
+import threading
+import time
+import unittest
+from pmtrainer.ant_sensors import AntSensors
+from pmtrainer.session_server import WriterPool, SessionServer
+from pmtrainer.simulated_ant import SimulatedAntDriver
+from pmtrainer.sample_journal import SampleJournal
+from pmtrainer.tcx_file import Tcx, recover_journal
+from pmtrainer.workout_profile import Workout
+
+
+class TestWriterPool(unittest.TestCase):
+    def test_order(self):
+        pool = WriterPool(num_workers=3)
+        results = {key: [] for key in range(5)}
+        for i in range(200):
+            for key in results:
+                pool.submit(key, results[key].append, i)
+        pool.join()
+        for values in results.values():
+            self.assertEqual(values, list(range(200)))
+        pool.submit("error", int, "not a number")
+        pool.close()
+        self.assertEqual(len(pool.errors), 1)
+
+    def test_off_thread(self):
+        pool = WriterPool(num_workers=1)
+        threads = []
+        pool.submit("log", lambda: threads.append(threading.current_thread()))
+        pool.close()
+        self.assertIsNot(threads[0], threading.current_thread())
+
+
+class TestSessionServer(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.workout = Workout(os.path.dirname(__file__) +
+                               "/fixtures/sample_workouts/test_workout.yaml")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _add_riders(self, server, count, duration_s, prefix="rider"):
+        sessions = []
+        for i in range(count):
+            ant_driver = SimulatedAntDriver(power_watts=100 + 50 * i, seed=i)
+            sensors = AntSensors(ant_driver=ant_driver)
+            sensors.connect()
+            self.addCleanup(sensors.close)
+            sessions.append(server.add_session(
+                prefix + str(i), sensors, self.workout, duration_s=duration_s,
+                start_time=dt.datetime.utcfromtimestamp(ant_driver.start_epoch_s), replay=True))
+        return sessions
+
+    def test_sessions(self):
+        uploads = []
+        server = SessionServer(log_dir=self.tmp_dir.name,
+                               uploader=lambda session, f: uploads.append((session.name, f)))
+        sessions = self._add_riders(server, 3, duration_s=30)
+        short = self._add_riders(server, 1, duration_s=10, prefix="short")[0]
+        server.run(realtime=False)
+        self.assertFalse(server.active_sessions)
+        self.assertEqual(len(server.tick_latencies_s), 300)
+        server.close()
+
+        self.assertEqual(sorted(name for name, _ in uploads),
+                         ["rider0", "rider1", "rider2", "short0"])
+        # Each session has its own rider in the shared sim batch, and its own log:
+        self.assertEqual(list(server.sims), [None])
+        self.assertEqual(len(server.sims[None]), 4)
+        distances = [s.engine.sim.total_distance_m for s in sessions]
+        self.assertEqual(distances, sorted(distances))
+        self.assertEqual(len(set(distances)), 3)
+        time_s, _ = short.engine.logfile.get_lap_stats()
+        self.assertAlmostEqual(float(time_s), 10, delta=1)
+        for session in sessions + [short]:
+            self.assertEqual(session.uploaded, [session.engine.logfile.file_name])
+            log = Tcx()
+            log.open_log(session.engine.logfile.file_name)
+            self.assertIsNotNone(log.get_next_point())
+        percentiles = server.latency_percentiles()
+        self.assertLessEqual(percentiles[50], percentiles[99])
+
+    def test_batched_sims(self):
+        # Every tick updates the sims of all the sessions on a course at once,
+        # and the riders of ended sessions are reused by new sessions:
+        server = SessionServer()
+        sessions = self._add_riders(server, 3, duration_s=5)
+        batch = server.sims[None]
+        updates = []
+        original_update = batch.update
+        batch.update = lambda *args, **kwargs: (updates.append(kwargs["riders"]),
+                                                original_update(*args, **kwargs))
+        server.run(realtime=False)
+        self.assertEqual(len(updates), 50)
+        self.assertEqual(updates[-1], [0, 1, 2])
+        distances = [s.engine.sim.total_distance_m for s in sessions]
+        self.assertGreater(min(distances), 0)
+        later = self._add_riders(server, 2, duration_s=5, prefix="later")
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(later[0].engine.sim.total_distance_m, 0)
+        server.run(realtime=False)
+        self.assertEqual([s.engine.sim.total_distance_m for s in sessions], distances)
+        self.assertGreater(later[1].engine.sim.total_distance_m, 0)
+        server.close()
+
+    def test_crash_recovery(self):
+        # Logs that aren't closed, as if the server crashed, are rebuilt from their journals:
+        server = SessionServer(log_dir=self.tmp_dir.name)
+        session = self._add_riders(server, 1, duration_s=None)[0]
+        for _ in range(50):
+            server.tick(0.1)
+        server.writers.join()
+        journals = SampleJournal.find_unfinished(self.tmp_dir.name)
+        self.assertEqual(journals, [SampleJournal.journal_name(session.engine.logfile.file_name)])
+        log = Tcx()
+        log.open_log(recover_journal(journals[0]))
+        points = 0
+        while log.get_next_point() is not None:
+            points += 1
+        self.assertAlmostEqual(points, 5, delta=1)
+        server.close()
+
+    def test_realtime(self):
+        server = SessionServer(tick_s=0.02)
+        self._add_riders(server, 2, duration_s=None)
+        start = time.monotonic()
+        server.run(duration_s=0.2)
+        self.assertAlmostEqual(time.monotonic() - start, 0.2, delta=0.1)
+        self.assertLessEqual(len(server.tick_latencies_s) + server.overruns, 11)
+        server.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import datetime as dt
+import os
+import time
+import unittest
+import numpy as np
+from pmtrainer.ant_sensors import AntSensors
+from pmtrainer.sensors import SensorStatus
+from pmtrainer.simulated_ant import SimulatedAntDriver, ChannelState
+from pmtrainer.trainer_engine import TrainerEngine, Timer
+from pmtrainer.workout_profile import Workout
+
+
+class TestSimulatedAntDriver(unittest.TestCase):
+    def _connect(self, ant_driver):
+        sensors = AntSensors(ant_driver=ant_driver)
+        sensors.connect()
+        self.addCleanup(sensors.close)
+        return sensors
+
+    def test_pages(self):
+        ant_driver = SimulatedAntDriver(power_noise_watts=0, heartrate_noise_bpm=0, seed=1)
+        sensors = self._connect(ant_driver)
+        sensors.update(10)
+        self.assertEqual(sensors.power_meter_status, SensorStatus.State.CONNECTED)
+        self.assertEqual(sensors.heart_rate_status, SensorStatus.State.CONNECTED)
+        self.assertEqual(sensors.power_watts, 200)
+        self.assertEqual(sensors.heartrate_bpm, 140)
+        power = sensors.drain_power_samples()
+        # About 4 pages per second, stamped with the simulated time:
+        self.assertAlmostEqual(len(power), 40, delta=2)
+        self.assertTrue(np.all(np.diff(power["time"]) > 0))
+        self.assertLessEqual(power["time"][-1], ant_driver.start_epoch_s + 10)
+        heartrate = sensors.drain_heartrate_samples()
+        # Only new beats are buffered:
+        self.assertAlmostEqual(len(heartrate), 140 / 6, delta=2)
+        self.assertTrue(np.all(heartrate["rr_interval_ms"] == 428))
+
+    def test_dropouts(self):
+        ant_driver = SimulatedAntDriver(dropout=0.5, seed=2)
+        sensors = self._connect(ant_driver)
+        sensors.update(100)
+        self.assertGreater(ant_driver.pages_dropped, 0.4 * ant_driver.pages_sent)
+        self.assertLess(len(sensors.drain_power_samples()), 300)
+
+    def test_device_count(self):
+        ant_driver = SimulatedAntDriver(num_devices=3, seed=3)
+        self.assertEqual(len(ant_driver.devices), 6)
+        sensors = self._connect(ant_driver)
+        sensors.update(5)
+        # One channel of each type pairs with one of the devices:
+        paired = [d for d in ant_driver.devices if d.channel is not None]
+        self.assertEqual(len(paired), 2)
+        self.assertEqual(sensors.device_power_meter.state, ChannelState.TRACKING)
+
+    def test_search_timeout(self):
+        ant_driver = SimulatedAntDriver(num_devices=0)
+        sensors = AntSensors(search_timeout_sec=30, ant_driver=ant_driver)
+        sensors.connect()
+        sensors.update(31)
+        self.assertEqual(len(ant_driver.errors), 2)
+        self.assertEqual(ant_driver.errors[0].err_type, AntSensors.SensorError.ErrorType.TIMEOUT)
+        self.assertEqual(sensors.device_heart_rate.state, ChannelState.CLOSED)
+        sensors.close()
+
+    def test_time_scale(self):
+        ant_driver = SimulatedAntDriver(time_scale=100, seed=4)
+        sensors = self._connect(ant_driver)
+        time.sleep(0.1)
+        sensors.close()
+        # About 10s of simulated time:
+        self.assertAlmostEqual(len(sensors.drain_power_samples()), 40, delta=8)
+
+    def test_engine(self):
+        ant_driver = SimulatedAntDriver(dropout=0.3, seed=5)
+        sensors = self._connect(ant_driver)
+        workout = Workout(os.path.dirname(__file__) +
+                          "/fixtures/sample_workouts/test_workout.yaml")
+        engine = TrainerEngine(sensors, workout, timer=Timer(replay=True))
+        engine.start(dt.datetime.utcfromtimestamp(ant_driver.start_epoch_s))
+        engine.run(tick_s=0.1, duration_s=120, realtime=False)
+        self.assertGreater(engine.power_reconstructor.missed_events, 50)
+        self.assertAlmostEqual(engine.power_reconstructor.total_accumulated_power /
+                               engine.power_reconstructor.total_events, 200, delta=3)
+        self.assertGreater(engine.sim.total_distance_m, 500)
+
+
+if __name__ == '__main__':
+    unittest.main()
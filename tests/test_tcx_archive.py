@@ -0,0 +1,97 @@
+import gzip
+import os
+import tempfile
+import time
+import unittest
+import numpy as np
+from unittest import mock
+from pmtrainer.tcx_archive import (archive_name, convert_dir, convert_log, load_archive,
+                                   read_columns)
+from pmtrainer.tcx_file import Tcx, Point
+from pmtrainer.trackpoints import COLUMNS, format_time
+
+START_S = 1622548800 # 2021-06-01
+
+
+def _write_log(fname, power_watts):
+    log = Tcx()
+    log.start_log(fname)
+    log.start_activity(activity_type=Tcx.ActivityType.OTHER, start_time=format_time(START_S))
+    for i, power in enumerate(power_watts):
+        log.add_point(Point(time=format_time(START_S + i), power_watts=power,
+                            distance_m=8.0 * i))
+    log.close_log()
+
+
+class TestTcxArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_dir = os.path.join(self.tmp_dir.name, "logs")
+        self.out_dir = os.path.join(self.tmp_dir.name, "npz")
+        os.makedirs(self.log_dir)
+        for i in range(3):
+            _write_log(os.path.join(self.log_dir, "ride{}.tcx".format(i)), [100 + i] * 60)
+        _write_log(os.path.join(self.log_dir, "ride3.tcx.gz"), [200] * 30)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_archive_name(self):
+        self.assertEqual(archive_name("/logs/ride.tcx.gz", "/npz"), "/npz/ride.tcx.gz.npz")
+        self.assertEqual(archive_name("/logs/ride.tcx", "/npz"), "/npz/ride.tcx.npz")
+
+    def test_convert(self):
+        converted = convert_dir(self.log_dir, self.out_dir, workers=2)
+        self.assertEqual([os.path.basename(f) for f in converted],
+                         ["ride0.tcx.npz", "ride1.tcx.npz", "ride2.tcx.npz", "ride3.tcx.gz.npz"])
+        columns = load_archive(os.path.join(self.out_dir, "ride1.tcx.npz"))
+        self.assertEqual(sorted(columns), sorted(COLUMNS))
+        expected = read_columns(os.path.join(self.log_dir, "ride1.tcx"))
+        for c in COLUMNS:
+            np.testing.assert_array_equal(columns[c], expected[c])
+        np.testing.assert_array_equal(columns["power_watts"], [101] * 60)
+        np.testing.assert_array_equal(columns["time"], START_S + np.arange(60))
+        self.assertTrue(np.all(np.isnan(columns["heartrate_bpm"])))
+        self.assertEqual(len(load_archive(converted[3])["time"]), 30)
+
+        # Only new or changed logs are converted again:
+        self.assertEqual(convert_dir(self.log_dir, self.out_dir, workers=2), [])
+        fname = os.path.join(self.log_dir, "ride2.tcx")
+        _write_log(fname, [300] * 10)
+        later = time.time() + 10
+        os.utime(fname, (later, later))
+        converted = convert_dir(self.log_dir, self.out_dir, workers=2)
+        self.assertEqual([os.path.basename(f) for f in converted], ["ride2.tcx.npz"])
+        np.testing.assert_array_equal(load_archive(converted[0])["power_watts"], [300] * 10)
+
+    def test_bad_log(self):
+        with open(os.path.join(self.log_dir, "bad.tcx"), "w") as f:
+            f.write("<TrainingCenterDatabase><Activities>")
+        with open(os.path.join(self.log_dir, "ride0.tcx"), "rb") as f:
+            data = gzip.compress(f.read())
+        with open(os.path.join(self.log_dir, "truncated.tcx.gz"), "wb") as f:
+            f.write(data[:len(data) // 2])
+        converted = convert_dir(self.log_dir, self.out_dir, workers=1)
+        self.assertEqual(len(converted), 4)
+        self.assertFalse(os.path.exists(os.path.join(self.out_dir, "bad.tcx.npz")))
+        self.assertFalse(os.path.exists(os.path.join(self.out_dir, "bad.tcx.npz.tmp")))
+
+    def test_same_name(self):
+        # A log and a compressed log with the same name each get their own archive:
+        _write_log(os.path.join(self.log_dir, "ride3.tcx"), [300] * 10)
+        convert_dir(self.log_dir, self.out_dir, workers=1)
+        self.assertEqual(len(load_archive(os.path.join(self.out_dir, "ride3.tcx.npz"))["time"]),
+                         10)
+        self.assertEqual(
+            len(load_archive(os.path.join(self.out_dir, "ride3.tcx.gz.npz"))["time"]), 30)
+
+    def test_failed_save(self):
+        out_fname = os.path.join(self.tmp_dir.name, "ride0.tcx.npz")
+        with mock.patch("pmtrainer.tcx_archive.np.savez_compressed", side_effect=OSError):
+            with self.assertRaises(OSError):
+                convert_log(os.path.join(self.log_dir, "ride0.tcx"), out_fname)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir.name)), ["logs"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,9 @@
 import unittest
 import tempfile
 import os
-from pmtrainer.tcx_file import Tcx, Point
+import gzip
+import shutil
+from pmtrainer.tcx_file import Tcx, Point, repair_log, GZIP_SYNC_FLUSHES
 
 class TestTcxFile(unittest.TestCase):
     def setUp(self):
@@ -92,3 +94,94 @@ class TestTcxFile(unittest.TestCase):
     def test_open_invalid_file(self):
         with self.assertRaises(FileNotFoundError):
             self.tcx.open_log("asdf")
+
+    def test_streaming_log(self):
+        points = [Point(time="2021-03-11T21:26:{:02d}Z".format(i), lat_deg=51.5 + i,
+                        lon_deg=-0.14, altitude_m=12.2, distance_m=2.0 * i, heartrate_bpm=92,
+                        cadence_rpm=39, speed_mps=1.5, power_watts=100 + i) for i in range(10)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            stream_name = tmp_dir + "/stream.tcx"
+            self.tcx.start_log(stream_name, streaming=True)
+            self.tcx.start_activity(activity_type=Tcx.ActivityType.OTHER)
+            dom = Tcx()
+            dom.start_log(tmp_dir + "/dom.tcx")
+            dom.start_activity(activity_type=Tcx.ActivityType.OTHER)
+            dom.activity.find("Id").text = self.tcx.activity.find("Id").text
+            for i, p in enumerate(points):
+                for log in [self.tcx, dom]:
+                    log.add_point(p)
+                    log.set_lap_stats(total_time_s=i + 1, distance_m=p.distance_m)
+                    log.flush()
+                # File should be complete and readable after every flush:
+                self.assertEqual(open(stream_name).read(), open(dom.file_name).read())
+            self.tcx.close_log()
+
+            read_log = Tcx()
+            read_log.open_log(stream_name)
+            for p in points:
+                self._assert_point_equal(p, read_log.get_next_point(), check_time=True)
+            self.assertIsNone(read_log.get_next_point())
+
+    def test_repair_log(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fname = tmp_dir + "/crashed.tcx"
+            self.tcx.start_log(fname, streaming=True)
+            self.tcx.start_activity(activity_type=Tcx.ActivityType.OTHER)
+            for i in range(3):
+                self.tcx.add_point(Point(heartrate_bpm=90 + i, power_watts=100))
+            self.tcx.flush()
+            self.assertFalse(repair_log(fname))
+            # Simulate a crash part way through writing a point:
+            data = open(fname).read()
+            cut = data.rfind("</Track>")
+            with open(fname, "w") as f:
+                f.write(data[:cut] + "<Trackpoint><Time>2021-03")
+            self.assertTrue(repair_log(fname))
+            read_log = Tcx()
+            read_log.open_log(fname)
+            for i in range(3):
+                self.assertEqual(read_log.get_next_point().heartrate_bpm, 90 + i)
+            self.assertIsNone(read_log.get_next_point())
+
+    def test_streaming_read(self):
+        for fname in ["20210325_160413.tcx", "basic_file_structure_test.tcx"]:
+            dom = Tcx()
+            dom.open_log(self.fixture_path + fname)
+            self.tcx.open_log(self.fixture_path + fname, streaming=True)
+            p = dom.get_next_point()
+            while p is not None:
+                self._assert_point_equal(p, self.tcx.get_next_point(), check_time=True)
+                p = dom.get_next_point()
+            self.assertIsNone(self.tcx.get_next_point())
+        with self.assertRaises(FileNotFoundError):
+            self.tcx.open_log("asdf", streaming=True)
+
+    def test_compressed_log(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fname = tmp_dir + "/compressed.tcx.gz"
+            self.tcx.start_log(fname, streaming=True)
+            self.tcx.start_activity(activity_type=Tcx.ActivityType.OTHER)
+            for i in range(GZIP_SYNC_FLUSHES + 1):
+                self.tcx.add_point(Point(heartrate_bpm=90 + i, power_watts=100))
+                self.tcx.set_lap_stats(total_time_s=i + 1, distance_m=10)
+                self.tcx.flush()
+            # Check that points up to the last sync point can be recovered mid-ride:
+            crashed = tmp_dir + "/crashed.tcx.gz"
+            shutil.copy(fname, crashed)
+            self.assertTrue(repair_log(crashed))
+            read_log = Tcx()
+            read_log.open_log(crashed)
+            for i in range(GZIP_SYNC_FLUSHES):
+                self.assertEqual(read_log.get_next_point().heartrate_bpm, 90 + i)
+            self.tcx.close_log()
+            self.assertFalse(repair_log(fname))
+
+            for streaming in [False, True]:
+                read_log = Tcx()
+                read_log.open_log(fname, streaming=streaming)
+                for i in range(GZIP_SYNC_FLUSHES + 1):
+                    self.assertEqual(read_log.get_next_point().heartrate_bpm, 90 + i)
+                self.assertIsNone(read_log.get_next_point())
+            with gzip.open(fname, "rt") as f:
+                self.assertIn("<TotalTimeSeconds>{}</TotalTimeSeconds>".format(
+                    GZIP_SYNC_FLUSHES + 1), f.read())
@@ -0,0 +1,43 @@
+import unittest
+import numpy as np
+from pmtrainer.tcx_file import Point
+from pmtrainer.trackpoints import TrackpointBuffer, parse_time, format_time
+
+class TestTrackpointBuffer(unittest.TestCase):
+    def setUp(self):
+        self.buffer = TrackpointBuffer(capacity=2)
+
+    def test_append_and_row(self):
+        p = Point(time="2021-03-11T21:26:53Z", lat_deg=51.50146, lon_deg=-0.140233,
+                  altitude_m=12.2, distance_m=2.0, heartrate_bpm=92, cadence_rpm=39,
+                  speed_mps=0.0, power_watts=92)
+        self.assertEqual(self.buffer.append(p), 0)
+        self.assertEqual(self.buffer.append(Point(time="2021-03-11T21:26:54Z")), 1)
+        self.assertEqual(len(self.buffer), 2)
+        self.assertEqual(self.buffer.row(0), vars(p))
+        row = self.buffer.row(-1)
+        self.assertEqual(row["time"], "2021-03-11T21:26:54Z")
+        self.assertIsNone(row["power_watts"])
+        self.assertIsInstance(self.buffer.row(0)["heartrate_bpm"], int)
+        with self.assertRaises(IndexError):
+            self.buffer.row(2)
+
+    def test_growth_and_columns(self):
+        for i in range(100):
+            self.buffer.append(Point(time="2021-03-11T21:26:53Z", power_watts=i))
+        self.assertEqual(len(self.buffer), 100)
+        power = self.buffer.column("power_watts")
+        np.testing.assert_array_equal(power, np.arange(100))
+        with self.assertRaises(ValueError):
+            power[0] = 1 # Columns are read-only views
+        self.assertTrue(np.all(np.isnan(self.buffer.column("heartrate_bpm"))))
+        self.buffer.clear()
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(len(self.buffer.column("time")), 0)
+
+    def test_time_conversion(self):
+        self.assertEqual(parse_time("1970-01-01T00:01:00Z"), 60.0)
+        self.assertEqual(parse_time("1970-01-01T00:01:00.500Z"), 60.5)
+        self.assertEqual(parse_time("1970-01-01T01:01:00+01:00"), 60.0)
+        self.assertEqual(format_time(60.0), "1970-01-01T00:01:00Z")
+        self.assertEqual(format_time(60.5), "1970-01-01T00:01:00.500Z")
@@ -0,0 +1,181 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from pmtrainer.bike_sim import BikeSimBatch
+from pmtrainer.ring_buffer import RingBuffer
+from pmtrainer.sensors import SensorStatus, ReplaySensors, POWER_SAMPLE_FIELDS
+from pmtrainer.tcx_file import Tcx
+from pmtrainer.trainer_engine import TrainerEngine, Timer, step_engines
+from pmtrainer.workout_profile import Workout
+
+
+class ConstantSensors():
+    '''
+    Sensor source with constant readings.
+    '''
+    def __init__(self, power_watts=200, heartrate_bpm=120, cadence_rpm=90):
+        self.heartrate_bpm = heartrate_bpm
+        self.power_watts = power_watts
+        self.cadence_rpm = cadence_rpm
+        self.heart_rate_status = SensorStatus.State.CONNECTED
+        self.power_meter_status = SensorStatus.State.CONNECTED
+        self.update_times = []
+
+    def update(self, elapsed_s):
+        self.update_times.append(elapsed_s)
+
+
+class DroppedEventSensors(ConstantSensors):
+    '''
+    Power meter sending a 4Hz event per update, where only every third event is received.
+    '''
+    def __init__(self):
+        super().__init__()
+        self.buffer = RingBuffer(POWER_SAMPLE_FIELDS)
+        self.events = 0
+        self.accumulated = 0
+
+    def update(self, elapsed_s):
+        power = 300 if self.events % 3 == 0 else 150
+        self.events += 1
+        self.accumulated = (self.accumulated + power) % 65536
+        self.power_watts = power
+        if power == 300:
+            self.buffer.push(self.events % 256, 90, self.accumulated, power, time_s=elapsed_s)
+
+    def drain_power_samples(self):
+        return self.buffer.drain()
+
+
+class TestTimer(unittest.TestCase):
+    def test_replay_ticks(self):
+        t = Timer(replay=True, tick_ms=250)
+        t.start()
+        t.update()
+        t.update()
+        self.assertEqual(t.get_time().total_seconds(), 0.5)
+        t.update(dt_s=2)
+        self.assertEqual(t.get_time().total_seconds(), 2.5)
+
+
+class TestTrainerEngine(unittest.TestCase):
+    def setUp(self):
+        self.workout = Workout(os.path.dirname(__file__) +
+                               "/fixtures/sample_workouts/test_workout.yaml")
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.logfile = Tcx()
+        self.logfile.start_log(self.tmp_dir.name + "/log.tcx", streaming=True)
+        self.logfile.start_activity(activity_type=Tcx.ActivityType.OTHER)
+
+    def tearDown(self):
+        self.logfile.close_log()
+        self.tmp_dir.cleanup()
+
+    def test_step(self):
+        sensors = ConstantSensors()
+        engine = TrainerEngine(sensors, self.workout, self.logfile, ftp_watts=200)
+        states = []
+        engine.subscribe(lambda e: states.append((e.elapsed.total_seconds(), e.power_watts)))
+        engine.start()
+        for _ in range(100):
+            engine.step(0.1)
+        self.assertEqual(len(states), 100)
+        self.assertAlmostEqual(states[-1][0], 10.0)
+        self.assertAlmostEqual(sensors.update_times[-1], 10.0)
+        self.assertEqual(states[-1][1], 200)
+        self.assertAlmostEqual(engine.power_target_watts, 0.5 * 200 + 10 * 0.35 / 450 * 200)
+        self.assertAlmostEqual(engine.block_remaining_s, 440)
+        self.assertGreater(engine.sim.total_distance_m, 0)
+        # Points are logged once a second:
+        self.assertEqual(len(self.logfile.trackpoints), 10)
+
+    def test_step_engines(self):
+        # Engines stepped together, with their sims in a batch, match engines
+        # stepped one at a time:
+        sensors = [ConstantSensors(power_watts=p) for p in [100, 200, 300]]
+        sensors[1].power_meter_status = SensorStatus.State.NOTCONNECTED
+        batch = BikeSimBatch(3, weight_kg=[60, 80, 100])
+        batched = [TrainerEngine(s, self.workout, sim=batch.rider(i))
+                   for i, s in enumerate(sensors)]
+        single = [TrainerEngine(s, self.workout, weight_kg=w)
+                  for s, w in zip(sensors, [60, 80, 100])]
+        for engine in batched + single:
+            engine.start()
+        updates = []
+        original_update = batch.update
+        batch.update = lambda *args, **kwargs: (updates.append(kwargs["riders"]),
+                                                original_update(*args, **kwargs))
+        for _ in range(50):
+            step_engines(batched, 0.2)
+            step_engines(single, 0.2)
+        self.assertEqual(updates, [[0, 2]] * 50)
+        for b, s in zip(batched, single):
+            self.assertEqual(b.sim.total_distance_m, s.sim.total_distance_m)
+            self.assertEqual(b.sim.speed_mps, s.sim.speed_mps)
+            self.assertEqual(b.elapsed, s.elapsed)
+            self.assertEqual(b.metrics.duration_s, s.metrics.duration_s)
+        self.assertEqual(batched[1].sim.total_distance_m, 0)
+
+    def test_missed_power_events(self):
+        engine = TrainerEngine(DroppedEventSensors(), self.workout, self.logfile)
+        engine.run(tick_s=0.25, duration_s=30, realtime=False)
+        logged = self.logfile.trackpoints.column("power_watts")
+        self.assertGreater(len(logged), 25)
+        # Only 300W events are received, but the events in between are reconstructed:
+        np.testing.assert_allclose(logged[1:], 200, atol=1)
+        seconds = []
+        engine.subscribe(lambda e: seconds.extend(e.power_1hz[1]))
+        engine.run(tick_s=0.25, duration_s=60, realtime=False)
+        self.assertGreater(len(seconds), 25)
+        np.testing.assert_allclose(seconds[1:], 200, atol=1)
+
+    def test_power_metrics(self):
+        engine = TrainerEngine(ConstantSensors(power_watts=230), self.workout, self.logfile,
+                               ftp_watts=230)
+        engine.run(tick_s=0.5, duration_s=60, realtime=False)
+        self.assertEqual(engine.metrics.duration_s, 60)
+        self.assertAlmostEqual(engine.metrics.average_watts(3), 230)
+        self.assertAlmostEqual(engine.avg_power_watts, 230)
+        self.assertAlmostEqual(engine.metrics.intensity_factor, 1.0)
+        self.assertAlmostEqual(engine.metrics.tss, 60 / 3600 * 100)
+        self.assertAlmostEqual(engine.power_curve.best(60), 230)
+        self.assertIsNone(engine.power_curve.best(300))
+        lap = self.logfile.get_lap_metrics()
+        self.assertEqual(lap["avg_power_watts"], 230)
+        self.assertEqual(lap["normalized_power_watts"], 230)
+        self.assertAlmostEqual(lap["tss"], 1.7)
+        self.logfile.flush()
+        with open(self.logfile.file_name) as f:
+            self.assertIn("<AvgWatts>230</AvgWatts>", f.read())
+
+    def test_no_power_not_logged(self):
+        sensors = ConstantSensors(power_watts=None)
+        sensors.power_meter_status = SensorStatus.State.NOTCONNECTED
+        engine = TrainerEngine(sensors, self.workout, self.logfile)
+        engine.run(tick_s=0.5, duration_s=5, realtime=False)
+        self.assertEqual(len(self.logfile.trackpoints), 0)
+        self.assertEqual(engine.sim.total_distance_m, 0)
+        self.assertEqual(engine.avg_heartrate_bpm, 120)
+
+    def test_run_replay(self):
+        sensors = ReplaySensors(os.path.dirname(__file__) +
+                                "/fixtures/sample_tcx_files/20210325_160413.tcx")
+        engine = TrainerEngine(sensors, self.workout, self.logfile)
+        engine.run(tick_s=1.0, realtime=False)
+        self.assertTrue(sensors.finished)
+        self.assertEqual(engine.elapsed.total_seconds(), 50 * 60 + 8)
+        self.assertGreater(len(self.logfile.trackpoints), 1800)
+        time_s, distance_m = self.logfile.get_lap_stats()
+        self.assertGreater(float(time_s), 50 * 60)
+        self.assertGreater(float(distance_m), 0)
+
+    def test_stop(self):
+        engine = TrainerEngine(ConstantSensors(), self.workout)
+        engine.subscribe(lambda e: e.stop() if e.elapsed.total_seconds() >= 3 else None)
+        engine.run(tick_s=1.0, realtime=False)
+        self.assertEqual(engine.elapsed.total_seconds(), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
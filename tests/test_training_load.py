@@ -0,0 +1,70 @@
+import unittest
+import numpy as np
+from pmtrainer.training_load import TrainingLoad, daily_load
+
+
+def _replay(daily_tss, ctl_days=42, atl_days=7):
+    '''
+    The load at the end of each day, by the textbook day-by-day recurrence.
+    '''
+    ctl, atl, out = 0.0, 0.0, []
+    for tss in daily_tss:
+        ctl += (tss - ctl) * (1 - np.exp(-1 / ctl_days))
+        atl += (tss - atl) * (1 - np.exp(-1 / atl_days))
+        out.append((ctl, atl))
+    return out
+
+
+class TestTrainingLoad(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.first_day = 737000
+        self.days = np.sort(rng.integers(self.first_day, self.first_day + 3650, 4000))
+        self.tss = rng.uniform(20, 150, len(self.days))
+        daily = np.bincount(self.days - self.first_day, weights=self.tss)
+        self.expected = _replay(daily)
+
+    def test_from_rides(self):
+        load = TrainingLoad.from_rides(self.days, self.tss)
+        self.assertEqual(load.day, self.days[-1])
+        self.assertAlmostEqual(load.ctl, self.expected[-1][0])
+        self.assertAlmostEqual(load.atl, self.expected[-1][1])
+        self.assertAlmostEqual(load.tsb, load.ctl - load.atl)
+
+    def test_incremental(self):
+        load = TrainingLoad()
+        for day, tss in zip(self.days, self.tss):
+            load.add(day, tss)
+        self.assertAlmostEqual(load.ctl, self.expected[-1][0])
+        self.assertAlmostEqual(load.atl, self.expected[-1][1])
+        # Rides added out of order, and removed, count the same:
+        shuffled = TrainingLoad()
+        order = np.random.default_rng(2).permutation(len(self.days))
+        for day, tss in zip(self.days[order], self.tss[order]):
+            shuffled.add(day, tss)
+        shuffled.add(self.days[5], 100)
+        shuffled.add(self.days[5], -100)
+        self.assertAlmostEqual(shuffled.ctl, load.ctl)
+        self.assertAlmostEqual(shuffled.atl, load.atl)
+
+    def test_rest(self):
+        load = TrainingLoad.from_rides([10], [100])
+        rested = load.at(17)
+        self.assertAlmostEqual(rested.atl, load.atl * np.exp(-1))
+        self.assertAlmostEqual(rested.ctl, load.ctl * np.exp(-7 / 42))
+        self.assertGreater(rested.tsb, load.tsb)
+        with self.assertRaises(ValueError):
+            load.at(9)
+        self.assertEqual(TrainingLoad().at(5).ctl, 0)
+
+    def test_daily_load(self):
+        last_day = self.first_day + 3649
+        ctl, atl, tsb = daily_load(self.days, self.tss, self.first_day + 1000, last_day)
+        self.assertEqual(len(ctl), 2650)
+        np.testing.assert_allclose(ctl, [c for c, _ in self.expected[1000:]])
+        np.testing.assert_allclose(atl, [a for _, a in self.expected[1000:]])
+        np.testing.assert_allclose(tsb, ctl - atl)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from pmtrainer.workout_profile import Workout
+from pmtrainer.workout_library import WorkoutLibrary
+
+
+class TestWorkoutLibrary(unittest.TestCase):
+    def setUp(self):
+        self.fixture_path = os.path.dirname(__file__) + "/fixtures/sample_workouts/"
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.workout_dir = self.tmp_dir.name + "/workouts"
+        shutil.copytree(self.fixture_path, self.workout_dir)
+        self.index_file = self.tmp_dir.name + "/index.json"
+        self.workout_file = self.workout_dir + "/test_workout.yaml"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get(self):
+        library = WorkoutLibrary(self.index_file)
+        workout = library.get(self.workout_file)
+        self.assertEqual(workout.name, "Test Workout")
+        self.assertEqual(workout.duration_s, 1800)
+        self.assertEqual(library.get_min_max_power(self.workout_file), (0.5, 1.0))
+        self.assertIs(library.get(self.workout_file), workout)
+        with self.assertRaises(FileNotFoundError):
+            library.get(self.workout_dir + "/asdf.yaml")
+        with self.assertRaises(Workout.WorkoutError):
+            library.get(self.workout_dir + "/test_invalid_duration_workout.yaml")
+
+    def test_index_persists(self):
+        WorkoutLibrary(self.index_file).get(self.workout_file)
+        with open(self.index_file) as f:
+            index = json.load(f)
+        self.assertIn(os.path.abspath(self.workout_file), index["workouts"])
+
+        # A new library shouldn't parse the file again:
+        with mock.patch("pmtrainer.workout_library.yaml.load") as load:
+            workout = WorkoutLibrary(self.index_file).get(self.workout_file)
+            load.assert_not_called()
+        self.assertEqual(workout.get_all_blocks(), [(0.25, 0.5, 0.85), (0.75, 1.0, 1.0)])
+
+    def test_changed_file_reparsed(self):
+        WorkoutLibrary(self.index_file).get(self.workout_file)
+        with open(self.workout_file) as f:
+            text = f.read()
+        with open(self.workout_file, "w") as f:
+            f.write(text.replace("Test Workout", "Changed Workout"))
+        self.assertEqual(WorkoutLibrary(self.index_file).get(self.workout_file).name,
+                         "Changed Workout")
+
+    def test_scan(self):
+        library = WorkoutLibrary(self.index_file)
+        workouts, errors = library.scan(self.workout_dir)
+        self.assertEqual(list(workouts), [os.path.abspath(self.workout_file)])
+        self.assertEqual(list(errors), [os.path.abspath(
+            self.workout_dir + "/test_invalid_duration_workout.yaml")])
+
+        # Removed files are dropped from the index:
+        os.remove(self.workout_file)
+        workouts, _ = library.scan(self.workout_dir)
+        self.assertEqual(workouts, {})
+        with open(self.index_file) as f:
+            self.assertNotIn(os.path.abspath(self.workout_file), json.load(f)["workouts"])
+
+    def test_extra_fields(self):
+        # Only the validated workout fields are indexed, so extra YAML values
+        # that JSON can't hold don't break saving the index:
+        with open(self.workout_file) as f:
+            text = f.read()
+        with open(self.workout_file, "w") as f:
+            f.write("created: 2021-01-01\n" + text)
+        library = WorkoutLibrary(self.index_file)
+        workouts, errors = library.scan(self.workout_dir)
+        self.assertIn(os.path.abspath(self.workout_file), workouts)
+        self.assertEqual(len(errors), 1)
+        self.assertFalse(os.path.exists(self.index_file + ".tmp"))
+        with open(self.index_file) as f:
+            entry = json.load(f)["workouts"][os.path.abspath(self.workout_file)]
+        self.assertEqual(sorted(entry["workout"]), ["blocks", "description", "duration_s", "name"])
+        workout = WorkoutLibrary(self.index_file).get(self.workout_file)
+        self.assertEqual(workout.get_all_blocks(), [(0.25, 0.5, 0.85), (0.75, 1.0, 1.0)])
+
+    def test_unreadable_file(self):
+        bad_file = self.workout_dir + "/not_utf8.yaml"
+        with open(bad_file, "wb") as f:
+            f.write(b"name: \xff\xfe\n")
+        workouts, errors = WorkoutLibrary(self.index_file).scan(self.workout_dir)
+        self.assertIn(os.path.abspath(self.workout_file), workouts)
+        self.assertIn(os.path.abspath(bad_file), errors)
+
+    def _write_workouts(self, directory, names):
+        os.makedirs(directory, exist_ok=True)
+        for name in names:
+            with open("{}/{}.yaml".format(directory, name.lower()), "w") as f:
+                f.write("name: {}\ndescription: d\nduration_s: 60\n"
+                        "blocks:\n  - duration: 1.0\n    start: 0.5\n    end: 0.5\n".format(name))
+
+    def test_recursive_scan(self):
+        self._write_workouts(self.workout_dir + "/sub/deeper", ["Zebra", "Alpha"])
+        library = WorkoutLibrary(self.index_file)
+        workouts, _ = library.scan(self.workout_dir)
+        self.assertEqual(len(workouts), 1)
+        workouts, errors = library.scan(self.workout_dir, recursive=True)
+        self.assertEqual([w.name for w in workouts.values()],
+                         ["Alpha", "Test Workout", "Zebra"])
+        self.assertEqual(len(errors), 1)
+
+    def test_parallel_scan(self):
+        names = ["Workout {:03d}".format(i) for i in range(20)]
+        self._write_workouts(self.workout_dir + "/many", names)
+        library = WorkoutLibrary(self.index_file)
+        with mock.patch("pmtrainer.workout_library.PARALLEL_MIN_FILES", 2):
+            workouts, errors = library.scan(self.workout_dir, recursive=True, max_workers=2)
+        self.assertEqual([w.name for w in workouts.values()], ["Test Workout"] + names)
+        self.assertEqual(len(errors), 1)
+        self.assertIn("Invalid workout duration", list(errors.values())[0])
+        # Everything was indexed, so a new library has nothing to parse:
+        with mock.patch("pmtrainer.workout_library._parse_workout_file") as parse:
+            workouts, _ = WorkoutLibrary(self.index_file).scan(self.workout_dir, recursive=True)
+            parse.assert_not_called()
+        self.assertEqual(len(workouts), 21)
+
+    def test_corrupt_index(self):
+        with open(self.index_file, "w") as f:
+            f.write("{not json")
+        self.assertEqual(WorkoutLibrary(self.index_file).get(self.workout_file).name,
+                         "Test Workout")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,8 @@
 import unittest
 import os
+import tempfile
+import numpy as np
+import yaml
 from pmtrainer.workout_profile import Workout, get_zone
 
 
@@ -28,6 +31,57 @@ class TestWorkoutProfile(unittest.TestCase):
         self.assertEqual(self.workout.block_time_remaining(time_s), 0)
         self.assertAlmostEqual(self.workout.power_target(time_s), 1.0)
 
+    def test_block_index(self):
+        self.assertEqual(self.workout.block_index(-10), 0)
+        self.assertEqual(self.workout.block_index(0), 0)
+        self.assertEqual(self.workout.block_index(450), 0)
+        self.assertEqual(self.workout.block_index(450.5), 1)
+        self.assertEqual(self.workout.block_index(1800), 1)
+        self.assertEqual(self.workout.block_index(1900), 1)
+
+    def test_many_blocks(self):
+        blocks = [{"duration": 0.001, "start": 0.5 + i / 2000, "end": 0.6 + i / 2000}
+                  for i in range(1000)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fname = tmp_dir + "/long_workout.yaml"
+            with open(fname, "w") as f:
+                yaml.dump({"name": "Long", "description": "", "duration_s": 10000,
+                           "blocks": blocks}, f)
+            workout = Workout(fname)
+        self.assertEqual(workout.block_index(5), 0)
+        self.assertEqual(workout.block_index(5005), 500)
+        self.assertAlmostEqual(workout.block_time_remaining(5005), 5)
+        self.assertAlmostEqual(workout.power_target(5005), 0.75 + 0.05)
+        self.assertEqual(workout.block_index(9999), 999)
+        self.assertAlmostEqual(workout.power_target(10000), 0.6 + 999 / 2000)
+
+    def test_power_targets(self):
+        times = np.array([-10, 0, 100, 450, 450.5, 1000, 1800, 1800.5])
+        power, ind = self.workout.power_targets(times)
+        np.testing.assert_allclose(power, [self.workout.power_target(t) for t in times])
+        np.testing.assert_array_equal(ind, [self.workout.block_index(t) for t in times])
+
+    def test_power_targets_1hz(self):
+        targets = self.workout.power_targets_1hz()
+        self.assertEqual(len(targets), 1801)
+        self.assertAlmostEqual(targets[0], 0.5)
+        self.assertAlmostEqual(targets[450], 0.85)
+        self.assertAlmostEqual(targets[1800], 1.0)
+        self.assertIs(self.workout.power_targets_1hz(), targets)
+        with self.assertRaises(ValueError):
+            targets[0] = 0
+
+    def test_from_dict(self):
+        workout = Workout.from_dict({"name": "Dict", "description": "", "duration_s": 60,
+                                     "blocks": [{"duration": 1.0, "start": 0.5, "end": 0.5}]})
+        self.assertEqual(workout.name, "Dict")
+        self.assertAlmostEqual(workout.power_target(30), 0.5)
+        with self.assertRaises(Workout.WorkoutError):
+            Workout.from_dict({"name": "No Blocks", "description": "", "duration_s": 60})
+        with self.assertRaises(Workout.WorkoutError):
+            Workout.from_dict({"name": "Bad Block", "description": "", "duration_s": 60,
+                               "blocks": [{"duration": 1.0, "start": "high"}]})
+
     def test_zones(self):
         self.assertEqual(get_zone(0),0)
         self.assertEqual(get_zone(-0.001),0)